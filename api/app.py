@@ -5,17 +5,34 @@ import asyncio
 import io
 import json
 import shutil
+import sqlite3
 import glob
+import hashlib
+import threading
+import uuid
+import math
+import re
+import random
+import time
+import logging
+import weakref
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
 from datetime import datetime
+from email.utils import formatdate, parsedate_to_datetime
+from logging.handlers import RotatingFileHandler
 from pathlib import Path
-from fastapi import FastAPI, HTTPException, Query
+from fastapi import FastAPI, File, HTTPException, Query, Request, Response, UploadFile
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, StreamingResponse
 from pydantic import BaseModel, Field
-from typing import Optional, List, Dict, Any, Literal
-from PIL import Image, ImageDraw, ImageFont
+from typing import Optional, List, Dict, Any, Literal, NamedTuple, Tuple
+from PIL import Image, ImageDraw, ImageFont, ImageOps
 from dotenv import load_dotenv
 from fastapi.responses import JSONResponse
+from starlette.datastructures import MutableHeaders
 
 import tempfile
 import mimetypes
@@ -24,18 +41,13 @@ import mimetypes
 # NEW: Google GenAI Imports for Nano Banana
 from google import genai
 from google.genai import types
+from google.genai import errors as genai_errors
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, generate_latest
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
 
 load_dotenv()
 
-app = FastAPI()
-
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+logger = logging.getLogger("content_factory")
 
 # --- CONFIG ---
 API_KEY = os.getenv("AZURE_OPENAI_API_KEY")
@@ -52,11 +64,18 @@ REACT_PUBLIC_DIR = os.getenv("REACT_PUBLIC_DIR", r"C:\Users\milad.moradi\Desktop
 # NEW: Google Config from .env
 GOOGLE_CLOUD_API_KEY = os.getenv("GOOGLE_CLOUD_API_KEY")
 GOOGLE_IMAGE_MODEL = os.getenv("GOOGLE_IMAGE_MODEL", "gemini-3-pro-image-preview")
+# Override the Gemini endpoint (e.g. bench/stub_upstreams.py); unset means the SDK's Vertex AI default
+GEMINI_API_BASE = os.getenv("GEMINI_API_BASE") or None
+
+# Concurrency caps for Gemini image calls: per request (variations of one card) and process-wide
+NANO_BANANA_VARIATION_CONCURRENCY = max(1, int(os.getenv("NANO_BANANA_VARIATION_CONCURRENCY", "4")))
+GEMINI_MAX_CONCURRENCY = max(1, int(os.getenv("GEMINI_MAX_CONCURRENCY", "16")))
+gemini_semaphore = asyncio.Semaphore(GEMINI_MAX_CONCURRENCY)
 
 # Updated to point to the Public directory for web compatibility
-SAVE_BASE_DIR = r"C:\Users\milad.moradi\Desktop\Demo Portal\ReactVideo\public\All AI Jsons"
+SAVE_BASE_DIR = os.getenv("SAVE_BASE_DIR", r"C:\Users\milad.moradi\Desktop\Demo Portal\ReactVideo\public\All AI Jsons")
 # Unified Campaign directory inside the React Public folder for persistence
-CAMPAIGN_SAVE_DIR = r"C:\Users\milad.moradi\Desktop\Demo Portal\ReactVideo\public\Campaigns"
+CAMPAIGN_SAVE_DIR = os.getenv("CAMPAIGN_SAVE_DIR", r"C:\Users\milad.moradi\Desktop\Demo Portal\ReactVideo\public\Campaigns")
 
 if not API_KEY:
     raise ValueError("Azure API Key not found!")
@@ -68,6 +87,1231 @@ def require_azure_openai():
             detail="Azure OpenAI is not configured (AZURE_OPENAI_API_KEY/ENDPOINT/DEPLOYMENT_NAME)."
         )
 
+# --- SHARED UPSTREAM CLIENTS ---
+# One long-lived, keep-alive pool per upstream instead of a new client (and TLS handshake) per request.
+# Pool sizes come from <PREFIX>_POOL_MAX_CONNECTIONS / <PREFIX>_POOL_MAX_KEEPALIVE.
+UPSTREAM_POOL_KEEPALIVE_EXPIRY = float(os.getenv("UPSTREAM_POOL_KEEPALIVE_EXPIRY", "60"))
+UPSTREAM_HTTP2 = os.getenv("UPSTREAM_HTTP2", "true").lower() in ("1", "true", "yes")
+
+try:
+    import h2  # noqa: F401  (httpx needs it for http2=True)
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+
+class CountingTransport(httpx.AsyncHTTPTransport):
+    """httpx transport that counts requests and freshly opened TCP connections, so pool reuse is visible."""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.requests = 0
+        self.new_connections = 0
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        self.requests += 1
+        request.extensions = {**request.extensions, "trace": self._trace}
+        return await super().handle_async_request(request)
+
+    async def _trace(self, event_name: str, info: Dict[str, Any]):
+        if event_name == "connection.connect_tcp.complete":
+            self.new_connections += 1
+
+
+def build_pooled_client(prefix: str, default_max_connections: int, default_keepalive: int) -> httpx.AsyncClient:
+    limits = httpx.Limits(
+        max_connections=int(os.getenv(f"{prefix}_POOL_MAX_CONNECTIONS", str(default_max_connections))),
+        max_keepalive_connections=int(os.getenv(f"{prefix}_POOL_MAX_KEEPALIVE", str(default_keepalive))),
+        keepalive_expiry=UPSTREAM_POOL_KEEPALIVE_EXPIRY,
+    )
+    transport = CountingTransport(limits=limits, http2=UPSTREAM_HTTP2 and HTTP2_AVAILABLE)
+    return httpx.AsyncClient(transport=transport, timeout=httpx.Timeout(120.0, connect=10.0))
+
+
+class UpstreamClients:
+    """Process-wide clients for Azure OpenAI, the Veo REST API and the Gemini SDK."""
+
+    def __init__(self):
+        self.azure = build_pooled_client("AZURE", 20, 10)
+        self.veo = build_pooled_client("VEO", 10, 5)
+        self.gemini_http = build_pooled_client("GEMINI", 20, 10)
+        self._genai: Optional[genai.Client] = None
+
+    @property
+    def genai(self) -> genai.Client:
+        # Built on first use so a missing Google key doesn't break startup for the Azure-only endpoints
+        if self._genai is None:
+            self._genai = genai.Client(
+                vertexai=True,
+                api_key=GOOGLE_CLOUD_API_KEY,
+                http_options=types.HttpOptions(base_url=GEMINI_API_BASE, httpx_async_client=self.gemini_http),
+            )
+        return self._genai
+
+    def pools(self) -> Dict[str, httpx.AsyncClient]:
+        return {"azure": self.azure, "veo": self.veo, "gemini": self.gemini_http}
+
+    def stats(self) -> Dict[str, Any]:
+        stats = {}
+        for name, client in self.pools().items():
+            transport = client._transport
+            stats[name] = {
+                "requests": transport.requests,
+                "new_connections": transport.new_connections,
+                "reused_connections": max(0, transport.requests - transport.new_connections),
+                "http2": UPSTREAM_HTTP2 and HTTP2_AVAILABLE,
+            }
+        return stats
+
+    async def aclose(self):
+        for client in self.pools().values():
+            await client.aclose()
+
+
+_upstream_clients: Optional[UpstreamClients] = None
+
+
+def get_upstream_clients() -> UpstreamClients:
+    """Returns the shared clients, creating them on first use (e.g. when the host skips lifespan events)."""
+    global _upstream_clients
+    if _upstream_clients is None:
+        _upstream_clients = UpstreamClients()
+    return _upstream_clients
+
+
+# Reference images used to be spilled here (one file per Live-mode request, never deleted). Inputs are now kept in
+# memory, so whatever is left over is cleared at startup.
+LEGACY_SCRATCH_DIR = os.path.join(tempfile.gettempdir(), "sjc_image_mod")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    get_upstream_clients()
+    await asyncio.to_thread(shutil.rmtree, LEGACY_SCRATCH_DIR, True)
+    await asyncio.to_thread(asset_index.refresh, True)
+    video_job_poller.start()
+    yield
+    await video_job_poller.stop()
+    global _upstream_clients
+    if _upstream_clients is not None:
+        await _upstream_clients.aclose()
+        _upstream_clients = None
+
+
+# --- REQUEST TRACING ---
+# Each request carries a RequestTrace in a context variable; span("name") adds wall time to a named phase
+# (resolve, read, decode, prepare, queue, upstream, encode, serialize, ...). The totals go out in a Server-Timing
+# header, so they show up under Timing in the browser devtools. For streamed responses the header only covers the
+# work done before the first byte. A sample of traces (plus every slow one) is appended to a rotating JSONL file;
+# summarize it with bench/trace_summary.py.
+TRACE_LOG_PATH = os.getenv("TRACE_LOG_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "_traces", "trace.jsonl"))
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0.05"))
+TRACE_SLOW_SECONDS = float(os.getenv("TRACE_SLOW_SECONDS", "10"))
+TRACE_LOG_MAX_BYTES = int(float(os.getenv("TRACE_LOG_MAX_MB", "20")) * 1024 * 1024)
+TRACE_LOG_BACKUPS = int(os.getenv("TRACE_LOG_BACKUPS", "5"))
+
+
+class RequestTrace:
+    __slots__ = ("started", "spans")
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.spans: Dict[str, List[float]] = {}  # phase -> [seconds, count]
+
+    def add(self, name: str, seconds: float):
+        entry = self.spans.setdefault(name, [0.0, 0])
+        entry[0] += seconds
+        entry[1] += 1
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    def server_timing(self) -> str:
+        # Concurrent spans (e.g. parallel variations) are summed, so a phase can exceed the total; desc shows the count
+        entries = [
+            f"{name};dur={seconds * 1000:.1f}" + (f';desc="x{count}"' if count > 1 else "")
+            for name, (seconds, count) in self.spans.items()
+        ]
+        entries.append(f"total;dur={self.elapsed() * 1000:.1f}")
+        return ", ".join(entries)
+
+
+current_trace: ContextVar[Optional[RequestTrace]] = ContextVar("current_trace", default=None)
+
+
+@contextmanager
+def span(name: str):
+    """Times the enclosed block as phase `name` of the current request (a no-op outside a request)."""
+    trace = current_trace.get()
+    if trace is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.add(name, time.perf_counter() - started)
+
+
+class TraceFileHandler(RotatingFileHandler):
+    """Creates the trace folder on the first write, so importing the app never touches the disk."""
+
+    def _open(self):
+        os.makedirs(os.path.dirname(self.baseFilename), exist_ok=True)
+        return super()._open()
+
+
+trace_logger = logging.getLogger("content_factory.trace")
+trace_logger.propagate = False
+if TRACE_SAMPLE_RATE > 0 or TRACE_SLOW_SECONDS > 0:
+    _trace_handler = TraceFileHandler(TRACE_LOG_PATH, maxBytes=TRACE_LOG_MAX_BYTES, backupCount=TRACE_LOG_BACKUPS, delay=True)
+    _trace_handler.setFormatter(logging.Formatter("%(message)s"))
+    trace_logger.addHandler(_trace_handler)
+    trace_logger.setLevel(logging.INFO)
+
+
+class ServerTimingMiddleware:
+    """Installs a RequestTrace per request, adds Server-Timing to the response and writes sampled traces."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        trace = RequestTrace()
+        token = current_trace.set(trace)
+        status = {"code": 500}
+
+        async def timed_send(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                headers = MutableHeaders(scope=message)
+                headers.append("Server-Timing", trace.server_timing())
+                headers.append("Timing-Allow-Origin", "*")  # the React dev server is a different origin
+            await send(message)
+
+        try:
+            await self.app(scope, receive, timed_send)
+        finally:
+            current_trace.reset(token)
+            total = trace.elapsed()
+            if (TRACE_SLOW_SECONDS > 0 and total >= TRACE_SLOW_SECONDS) or random.random() < TRACE_SAMPLE_RATE:
+                route = scope.get("route")
+                trace_logger.info(json.dumps({
+                    "ts": datetime.now().isoformat(timespec="milliseconds"),
+                    "route": getattr(route, "path", None) or scope.get("path"),
+                    "method": scope.get("method"),
+                    "status": status["code"],
+                    "total_ms": round(total * 1000, 2),
+                    "spans": {
+                        name: {"ms": round(seconds * 1000, 2), "count": count}
+                        for name, (seconds, count) in trace.spans.items()
+                    },
+                }))
+
+
+class TimedJSONResponse(JSONResponse):
+    """JSONResponse that reports its json.dumps as the "serialize" phase (large base64 payloads make this visible)."""
+
+    def render(self, content: Any) -> bytes:
+        with span("serialize"):
+            return super().render(content)
+
+
+app = FastAPI(lifespan=lifespan, default_response_class=TimedJSONResponse)
+
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=["*"],
+    allow_credentials=True,
+    allow_methods=["*"],
+    allow_headers=["*"],
+    expose_headers=["Server-Timing"],
+)
+app.add_middleware(ServerTimingMiddleware)
+
+
+# --- METRICS ---
+# Prometheus text format at /metrics. Route metrics come from a thin ASGI middleware (labelled by route template, not
+# raw path, to keep cardinality bounded); upstream calls are timed where they are made. The existing stats objects
+# (caches, scheduler, breakers, single-flight) are read only at scrape time, so they add nothing to the hot path.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300, 600)
+SIZE_BUCKETS = tuple(256 * 4 ** i for i in range(10))  # 256 B .. 64 MB
+
+metrics_registry = CollectorRegistry()
+http_requests_total = Counter(
+    "http_requests_total", "HTTP requests by route, method and status code.",
+    ["route", "method", "status"], registry=metrics_registry,
+)
+http_request_duration = Histogram(
+    "http_request_duration_seconds", "Time until the last response byte was sent.",
+    ["route", "method"], buckets=LATENCY_BUCKETS, registry=metrics_registry,
+)
+http_request_size = Histogram(
+    "http_request_size_bytes", "Request body size.", ["route"], buckets=SIZE_BUCKETS, registry=metrics_registry,
+)
+http_response_size = Histogram(
+    "http_response_size_bytes", "Response body size.", ["route"], buckets=SIZE_BUCKETS, registry=metrics_registry,
+)
+http_in_flight = Gauge("http_requests_in_flight", "Requests currently being served.", registry=metrics_registry)
+upstream_requests_total = Counter(
+    "upstream_requests_total", "Upstream calls by provider, model and status (HTTP code or error type).",
+    ["provider", "model", "status"], registry=metrics_registry,
+)
+upstream_duration = Histogram(
+    "upstream_request_duration_seconds", "Upstream call latency, excluding time queued in the scheduler.",
+    ["provider", "model"], buckets=LATENCY_BUCKETS, registry=metrics_registry,
+)
+upstream_in_flight = Gauge(
+    "upstream_requests_in_flight", "Upstream calls currently outstanding.", ["provider"], registry=metrics_registry,
+)
+
+
+class UpstreamTally:
+    """Upstream calls made for one unit of work (see upstream_tally). Scheduler queueing and cache hits never reach it."""
+    __slots__ = ("calls", "longest")
+
+    def __init__(self):
+        self.calls = 0
+        self.longest = 0.0
+
+    def observe(self, seconds: float):
+        self.calls += 1
+        self.longest = max(self.longest, seconds)
+
+
+upstream_tally: ContextVar[Optional[UpstreamTally]] = ContextVar("upstream_tally", default=None)
+
+
+class observe_upstream:
+    """with observe_upstream("gemini_image", model) as call: ...  (set call.status for non-exception outcomes)."""
+
+    def __init__(self, provider: str, model: Optional[str]):
+        self.provider = provider
+        self.model = model or "unknown"
+        self.status = "ok"
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        upstream_in_flight.labels(self.provider).inc()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = time.perf_counter() - self._started
+        upstream_in_flight.labels(self.provider).dec()
+        upstream_duration.labels(self.provider, self.model).observe(elapsed)
+        trace = current_trace.get()
+        if trace is not None:
+            trace.add("upstream", elapsed)
+        tally = upstream_tally.get()
+        if tally is not None:
+            tally.observe(elapsed)
+        if exc is not None:
+            code = getattr(exc, "code", None)
+            self.status = str(code) if isinstance(code, int) else type(exc).__name__
+        upstream_requests_total.labels(self.provider, self.model, self.status).inc()
+        return False
+
+    def set_response(self, response: httpx.Response) -> httpx.Response:
+        self.status = str(response.status_code)
+        return response
+
+
+class MetricsMiddleware:
+    """Pure ASGI middleware (no BaseHTTPMiddleware) so streaming responses are measured to the last byte."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        started = time.perf_counter()
+        sizes = {"request": 0, "response": 0}
+        status = {"code": 500}
+
+        async def counting_receive():
+            message = await receive()
+            if message["type"] == "http.request":
+                sizes["request"] += len(message.get("body", b""))
+            return message
+
+        async def counting_send(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            elif message["type"] == "http.response.body":
+                sizes["response"] += len(message.get("body", b""))
+            await send(message)
+
+        http_in_flight.inc()
+        try:
+            await self.app(scope, counting_receive, counting_send)
+        finally:
+            http_in_flight.dec()
+            route = scope.get("route")
+            route_label = getattr(route, "path", None) or "unmatched"
+            method = scope.get("method", "GET")
+            http_requests_total.labels(route_label, method, str(status["code"])).inc()
+            http_request_duration.labels(route_label, method).observe(time.perf_counter() - started)
+            http_request_size.labels(route_label).observe(sizes["request"])
+            http_response_size.labels(route_label).observe(sizes["response"])
+
+
+class AppStatsCollector:
+    """Exports the counters the app already keeps (caches, scheduler, breakers, single-flight, retries) at scrape time."""
+
+    def collect(self):
+        cache = GaugeMetricFamily("app_cache_entries", "Entries per cache.", labels=["cache"])
+        cache_bytes = GaugeMetricFamily("app_cache_bytes", "Bytes held per cache.", labels=["cache"])
+        cache_hits = CounterMetricFamily("app_cache_hits", "Cache hits.", labels=["cache"])
+        cache_misses = CounterMetricFamily("app_cache_misses", "Cache misses.", labels=["cache"])
+        for name, store in (
+            ("generation", generation_cache), ("preprocess", prepared_image_cache),
+            ("derivatives", derivative_cache), ("references", reference_store),
+        ):
+            stats = store.stats()
+            cache.add_metric([name], stats["entries"])
+            cache_bytes.add_metric([name], stats["bytes"])
+            cache_hits.add_metric([name], stats["hits"])
+            cache_misses.add_metric([name], stats["misses"])
+        yield from (cache, cache_bytes, cache_hits, cache_misses)
+
+        queued = GaugeMetricFamily("scheduler_queue_depth", "Callers waiting for admission.", labels=["provider", "priority"])
+        tokens = GaugeMetricFamily("scheduler_tokens", "Tokens left in the provider bucket.", labels=["provider"])
+        rejected = CounterMetricFamily("scheduler_rejected", "Calls turned away with 429.", labels=["provider", "priority"])
+        for name, scheduler in schedulers.items():
+            stats = scheduler.stats()
+            tokens.add_metric([name], stats["tokens"])
+            for priority in SCHEDULER_PRIORITIES:
+                queued.add_metric([name, priority], stats["queued"][priority])
+                rejected.add_metric([name, priority], stats["rejected"][priority])
+        yield from (queued, tokens, rejected)
+
+        breaker_open = GaugeMetricFamily("engine_circuit_open", "1 when the engine's circuit is open or half-open.", labels=["engine"])
+        for engine, breaker in engine_breakers.items():
+            breaker_open.add_metric([engine], 0 if breaker.state == "closed" else 1)
+        yield breaker_open
+
+        coalesced = CounterMetricFamily("singleflight_coalesced", "Requests served by another in-flight call.", labels=["endpoint"])
+        for group in (style_flight, advertorial_flight):
+            coalesced.add_metric([group.name], group.coalesced)
+        yield coalesced
+
+        retries = CounterMetricFamily("upstream_retries", "Retry/hedge events per provider.", labels=["provider", "event"])
+        for provider, counters in retry_stats.counters.items():
+            for event in ("retries", "gave_up", "hedges", "hedge_wins"):
+                retries.add_metric([provider, event], counters[event])
+        yield retries
+
+
+metrics_registry.register(AppStatsCollector())
+app.add_middleware(MetricsMiddleware)
+
+@app.get("/metrics")
+async def metrics():
+    return Response(generate_latest(metrics_registry), media_type=CONTENT_TYPE_LATEST)
+
+@app.get("/upstream-stats")
+async def upstream_stats():
+    """Connection pool counters per upstream, single-flight savings, and retry/hedge counters."""
+    return {
+        "pools": get_upstream_clients().stats(),
+        "singleflight": {group.name: group.stats() for group in (style_flight, advertorial_flight)},
+        "retries": retry_stats.snapshot(),
+    }
+
+# --- ADMISSION SCHEDULER ---
+# Each upstream quota (Gemini image, Veo, Azure image edits, Azure chat) gets a token bucket. A call takes one token;
+# when the bucket is empty callers queue, interactive work always ahead of bulk grid generation. If the expected wait
+# exceeds the class's limit the request is turned away at once with 429, Retry-After and its queue position.
+# Rates come from <PROVIDER>_RATE_PER_MIN / <PROVIDER>_BURST, e.g. GEMINI_IMAGE_RATE_PER_MIN.
+SCHEDULER_PRIORITIES = ("interactive", "bulk")
+SCHEDULER_MAX_WAIT = {
+    "interactive": float(os.getenv("SCHEDULER_MAX_WAIT_INTERACTIVE", "30")),
+    "bulk": float(os.getenv("SCHEDULER_MAX_WAIT_BULK", "600")),
+}
+SCHEDULER_PROVIDER_DEFAULTS = {
+    # provider: (requests per minute, burst)
+    "gemini_image": (60, 16),
+    "veo": (10, 4),
+    "azure_image": (30, 6),
+    "azure_chat": (120, 20),
+}
+
+
+class AdmissionScheduler:
+    def __init__(self, name: str, rate_per_min: float, burst: int):
+        self.name = name
+        self.rate = max(rate_per_min, 0.001) / 60.0
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._queues: Dict[str, deque] = {p: deque() for p in SCHEDULER_PRIORITIES}
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self.admitted = {p: 0 for p in SCHEDULER_PRIORITIES}
+        self.rejected = {p: 0 for p in SCHEDULER_PRIORITIES}
+        self.queued_seconds = {p: 0.0 for p in SCHEDULER_PRIORITIES}
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def _ahead_of(self, priority: str) -> int:
+        # Interactive only waits behind interactive; bulk waits behind everything
+        classes = SCHEDULER_PRIORITIES[:SCHEDULER_PRIORITIES.index(priority) + 1]
+        return sum(1 for p in classes for fut in self._queues[p] if not fut.done())
+
+    async def acquire(self, priority: str = "interactive"):
+        """Waits for a token. Raises HTTPException(429) straight away when the wait would be too long."""
+        if priority not in SCHEDULER_PRIORITIES:
+            priority = "interactive"
+        self._refill()
+        ahead = self._ahead_of(priority)
+        if ahead == 0 and self.tokens >= 1:
+            self.tokens -= 1
+            self.admitted[priority] += 1
+            return
+
+        expected_wait = (ahead + 1 - self.tokens) / self.rate
+        if expected_wait > SCHEDULER_MAX_WAIT[priority]:
+            self.rejected[priority] += 1
+            raise HTTPException(
+                status_code=429,
+                detail={
+                    "message": f"{self.name} is saturated, retry later",
+                    "provider": self.name,
+                    "queue_position": ahead + 1,
+                    "retry_after": round(expected_wait, 1),
+                },
+                headers={"Retry-After": str(int(math.ceil(expected_wait)))},
+            )
+
+        fut = asyncio.get_running_loop().create_future()
+        self._queues[priority].append(fut)
+        self._schedule_dispatch()
+        started = time.monotonic()
+        try:
+            await fut
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                self.tokens += 1  # Admitted and cancelled in the same tick: hand the token back
+            raise
+        self.admitted[priority] += 1
+        self.queued_seconds[priority] += time.monotonic() - started
+
+    def _schedule_dispatch(self):
+        if self._timer is not None:
+            return
+        self._refill()
+        delay = 0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+        self._timer = asyncio.get_running_loop().call_later(delay, self._dispatch)
+
+    def _dispatch(self):
+        self._timer = None
+        self._refill()
+        for priority in SCHEDULER_PRIORITIES:
+            queue = self._queues[priority]
+            while queue and self.tokens >= 1:
+                fut = queue.popleft()
+                if fut.done():
+                    continue  # Caller went away
+                self.tokens -= 1
+                fut.set_result(None)
+        if any(self._queues.values()):
+            self._schedule_dispatch()
+
+    def stats(self) -> Dict[str, Any]:
+        self._refill()
+        return {
+            "rate_per_min": round(self.rate * 60, 2),
+            "burst": self.capacity,
+            "tokens": round(self.tokens, 2),
+            "queued": {p: sum(1 for fut in self._queues[p] if not fut.done()) for p in SCHEDULER_PRIORITIES},
+            "admitted": dict(self.admitted),
+            "rejected": dict(self.rejected),
+            "avg_wait_seconds": {
+                p: round(self.queued_seconds[p] / self.admitted[p], 3) if self.admitted[p] else 0.0
+                for p in SCHEDULER_PRIORITIES
+            },
+        }
+
+
+schedulers = {
+    name: AdmissionScheduler(
+        name,
+        float(os.getenv(f"{name.upper()}_RATE_PER_MIN", str(rate))),
+        int(os.getenv(f"{name.upper()}_BURST", str(burst))),
+    )
+    for name, (rate, burst) in SCHEDULER_PROVIDER_DEFAULTS.items()
+}
+
+
+async def admit(provider: str, priority: Optional[str] = "interactive"):
+    with span("queue"):
+        await schedulers[provider].acquire(priority or "interactive")
+
+
+async def admitted_post(provider: str, url: str, **kwargs) -> httpx.Response:
+    """POST through the Azure pool once the provider's scheduler admits the call."""
+    await admit(provider)
+    with observe_upstream(provider, VISION_DEPLOYMENT_NAME) as call:
+        return call.set_response(await get_upstream_clients().azure.post(url, **kwargs))
+
+@app.get("/scheduler-stats")
+async def scheduler_stats():
+    """Token bucket level, queue depth per priority class and admit/reject counters per upstream provider."""
+    return {name: scheduler.stats() for name, scheduler in schedulers.items()}
+
+# --- SINGLE-FLIGHT ---
+# Double clicks, re-renders and extra tabs send the same brief or image set again while the first call is still
+# running. Identical in-flight requests (same hash of the normalized body) share one upstream call and its result.
+class SingleFlight:
+    def __init__(self, name: str):
+        self.name = name
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self.upstream_calls = 0
+        self.coalesced = 0
+
+    @staticmethod
+    def make_key(payload: Dict[str, Any]) -> str:
+        return hashlib.sha256(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()
+
+    async def do(self, key: str, call):
+        """Runs call() once per key at a time; concurrent callers with the same key await the same result."""
+        task = self._inflight.get(key)
+        if task is None:
+            self.upstream_calls += 1
+            task = asyncio.ensure_future(call())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._finish(key, t))
+        else:
+            self.coalesced += 1
+        # shield: one caller disconnecting must not cancel the call the others are waiting on
+        return await asyncio.shield(task)
+
+    def _finish(self, key: str, task: asyncio.Task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled():
+            task.exception()  # Mark as retrieved even if every caller went away
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.upstream_calls + self.coalesced
+        return {
+            "upstream_calls": self.upstream_calls,
+            "coalesced": self.coalesced,
+            "saved_ratio": round(self.coalesced / total, 4) if total else 0.0,
+            "in_flight": len(self._inflight),
+        }
+
+
+style_flight = SingleFlight("analyze_style")
+advertorial_flight = SingleFlight("generate_advertorial")
+
+# --- UPSTREAM RETRIES & HEDGING ---
+# Transient upstream failures (429, 5xx, connection resets) are retried with jittered exponential backoff inside a
+# per-call deadline budget, honouring Retry-After. Chat calls can additionally be hedged: if the first attempt is
+# still running after the recent p95 latency, a second identical request is raced against it.
+RETRY_MAX_ATTEMPTS = max(1, int(os.getenv("RETRY_MAX_ATTEMPTS", "3")))
+RETRY_BASE_DELAY = float(os.getenv("RETRY_BASE_DELAY", "0.5"))
+RETRY_MAX_DELAY = float(os.getenv("RETRY_MAX_DELAY", "8"))
+RETRY_DEADLINES = {
+    "gemini_image": float(os.getenv("GEMINI_IMAGE_DEADLINE", "240")),
+    "azure_image": float(os.getenv("AZURE_IMAGE_DEADLINE", "240")),
+    "azure_chat": float(os.getenv("AZURE_CHAT_DEADLINE", "90")),
+}
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+# Only failures where the request never produced a result; a read timeout on a generation is not retried blindly
+RETRYABLE_ERRORS = (
+    httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout, httpx.ReadError, httpx.WriteError,
+    httpx.RemoteProtocolError,
+)
+# Hedging sends a second paid request (with its image payload), so it is opt-in
+CHAT_HEDGE_ENABLED = os.getenv("CHAT_HEDGE_ENABLED", "0") == "1"
+CHAT_HEDGE_DEFAULT_DELAY = float(os.getenv("CHAT_HEDGE_DEFAULT_DELAY", "8"))
+HEDGE_MIN_SAMPLES = 20
+
+
+def retry_after_seconds(response: Optional[httpx.Response]) -> Optional[float]:
+    value = response.headers.get("retry-after") if response is not None else None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - datetime.now().timestamp())
+        except (TypeError, ValueError):
+            return None
+
+
+def classify_upstream_failure(outcome) -> Tuple[bool, Optional[float]]:
+    """(retryable, retry_after) for a returned httpx.Response or a raised exception."""
+    if isinstance(outcome, httpx.Response):
+        return outcome.status_code in RETRYABLE_STATUS, retry_after_seconds(outcome)
+    if isinstance(outcome, genai_errors.APIError):
+        response = outcome.response if isinstance(outcome.response, httpx.Response) else None
+        return outcome.code in RETRYABLE_STATUS, retry_after_seconds(response)
+    return isinstance(outcome, RETRYABLE_ERRORS), None
+
+
+class RetryStats:
+    def __init__(self):
+        self.counters: Dict[str, Dict[str, int]] = {}
+        self._latencies: Dict[str, deque] = {}
+
+    def bump(self, name: str, counter: str):
+        group = self.counters.setdefault(name, {"calls": 0, "retries": 0, "gave_up": 0, "hedges": 0, "hedge_wins": 0})
+        group[counter] += 1
+
+    def observe(self, name: str, seconds: float):
+        self._latencies.setdefault(name, deque(maxlen=200)).append(seconds)
+
+    def p95(self, name: str) -> Optional[float]:
+        samples = self._latencies.get(name)
+        if not samples or len(samples) < HEDGE_MIN_SAMPLES:
+            return None
+        ordered = sorted(samples)
+        return ordered[int(0.95 * (len(ordered) - 1))]
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            name: {**counters, "p95_seconds": round(self.p95(name), 3) if self.p95(name) is not None else None}
+            for name, counters in self.counters.items()
+        }
+
+
+retry_stats = RetryStats()
+
+
+async def call_with_retry(name: str, attempt, deadline: Optional[float] = None):
+    """Runs attempt() until it succeeds, fails with a non-retryable error, or the deadline budget is spent.
+
+    attempt may return an httpx.Response: a retryable status is retried, and the last response is returned as-is
+    once retries run out so callers keep their own status handling.
+    """
+    budget_ends = time.monotonic() + (deadline or RETRY_DEADLINES.get(name, 120.0))
+    retry_stats.bump(name, "calls")
+    for attempt_no in range(1, RETRY_MAX_ATTEMPTS + 1):
+        started = time.monotonic()
+        try:
+            outcome = await attempt()
+            failure = outcome if isinstance(outcome, httpx.Response) and outcome.status_code in RETRYABLE_STATUS else None
+        except HTTPException:
+            raise  # Our own admission/validation errors are final
+        except Exception as e:
+            outcome, failure = e, e
+        if failure is None:
+            retry_stats.observe(name, time.monotonic() - started)
+            return outcome
+
+        retryable, retry_after = classify_upstream_failure(failure)
+        delay = min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** (attempt_no - 1)) * random.uniform(0.5, 1.0)
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        if not retryable or attempt_no == RETRY_MAX_ATTEMPTS or time.monotonic() + delay >= budget_ends:
+            if retryable:
+                retry_stats.bump(name, "gave_up")
+            if isinstance(outcome, Exception):
+                raise outcome
+            return outcome
+        retry_stats.bump(name, "retries")
+        logger.info(
+            "Retrying %s in %.1fs after %s", name, delay,
+            failure if isinstance(failure, Exception) else failure.status_code,
+        )
+        await asyncio.sleep(delay)
+
+
+async def hedged(name: str, attempt):
+    """Starts attempt(); if it hasn't finished after the recent p95 latency, races a second copy and keeps the winner."""
+    if not CHAT_HEDGE_ENABLED:
+        return await attempt()
+    primary = asyncio.ensure_future(attempt())
+    hedge_delay = retry_stats.p95(name) or CHAT_HEDGE_DEFAULT_DELAY
+    done, _ = await asyncio.wait({primary}, timeout=hedge_delay)
+    if done:
+        return primary.result()
+
+    retry_stats.bump(name, "hedges")
+    secondary = asyncio.ensure_future(attempt())
+    pending = {primary, secondary}
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None and not (
+                    isinstance(task.result(), httpx.Response) and task.result().status_code in RETRYABLE_STATUS
+                ):
+                    if task is secondary:
+                        retry_stats.bump(name, "hedge_wins")
+                    return task.result()
+        # Both failed: surface the primary's outcome so retry classification sees it
+        return primary.result()
+    finally:
+        for task in (primary, secondary):
+            if not task.done():
+                task.cancel()
+
+
+async def chat_completion(url: str, headers: Dict[str, str], payload: Dict[str, Any]) -> httpx.Response:
+    """Azure chat call: admitted by the scheduler, hedged, and retried on transient failures."""
+    return await call_with_retry(
+        "azure_chat",
+        lambda: hedged("azure_chat", lambda: admitted_post("azure_chat", url, headers=headers, json=payload, timeout=60.0)),
+    )
+
+# --- DISK LRU CACHE ---
+class DiskLRUCache:
+    """Files in one directory keyed by hash, with a total size budget and least-recently-used eviction.
+
+    Hits touch the file's mtime, so the LRU order is rebuilt from mtimes after a restart.
+    """
+
+    def __init__(self, directory: str, max_bytes: int, suffix: str):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.suffix = suffix
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, int]" = OrderedDict()
+        self._total_bytes = 0
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}{self.suffix}")
+
+    def _load(self):
+        if self._loaded:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        files = []
+        for fpath in glob.glob(os.path.join(self.directory, f"*{self.suffix}")):
+            try:
+                st = os.stat(fpath)
+            except OSError:
+                continue
+            files.append((st.st_mtime, os.path.basename(fpath)[:-len(self.suffix)], st.st_size))
+        for _, key, size in sorted(files):
+            self._entries[key] = size
+            self._total_bytes += size
+        self._loaded = True
+
+    def get_path(self, key: str, count: bool = True) -> Optional[str]:
+        """Returns the entry's file path (and marks it recently used), or None on a miss.
+
+        count=False leaves the hit/miss stats alone, for existence checks that are not cache lookups.
+        """
+        with self._lock:
+            self._load()
+            if key not in self._entries or not os.path.exists(self.path(key)):
+                self._total_bytes -= self._entries.pop(key, 0)
+                self.misses += count
+                return None
+            self._entries.move_to_end(key)
+            self.hits += count
+        try:
+            os.utime(self.path(key))
+        except OSError:
+            pass
+        return self.path(key)
+
+    def put_bytes(self, key: str, data: bytes):
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            self._load()
+        tmp_path = f"{self.path(key)}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, self.path(key))
+
+        evicted = []
+        with self._lock:
+            self._total_bytes -= self._entries.pop(key, 0)
+            self._entries[key] = len(data)
+            self._total_bytes += len(data)
+            while self._total_bytes > self.max_bytes and self._entries:
+                old_key, old_size = self._entries.popitem(last=False)
+                self._total_bytes -= old_size
+                evicted.append(old_key)
+        for old_key in evicted:
+            try:
+                os.remove(self.path(old_key))
+            except OSError:
+                pass
+
+    def _record_corrupt(self, key: str):
+        with self._lock:
+            self._total_bytes -= self._entries.pop(key, 0)
+            self.hits -= 1
+            self.misses += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "entries": len(self._entries),
+                "bytes": self._total_bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+
+# --- GENERATION RESULT CACHE ---
+# Content-addressed: key = hash(source image bytes + generation params + variation index).
+# Entries are the data URLs returned to the client, stored as JSON files and evicted LRU by total size.
+GENERATION_CACHE_DIR = os.getenv("GENERATION_CACHE_DIR", os.path.join(tempfile.gettempdir(), "sjc_generation_cache"))
+GENERATION_CACHE_MAX_BYTES = int(float(os.getenv("GENERATION_CACHE_MAX_MB", "2048")) * 1024 * 1024)
+
+
+class GenerationCache(DiskLRUCache):
+    """Disk-backed cache of generated images (as data URLs) with a size budget and LRU eviction."""
+
+    def __init__(self, directory: str, max_bytes: int):
+        super().__init__(directory, max_bytes, ".json")
+
+    @staticmethod
+    def make_key(image_bytes: bytes, params: Dict[str, Any], variation_index: int) -> str:
+        digest = hashlib.sha256()
+        digest.update(hashlib.sha256(image_bytes).digest())
+        digest.update(json.dumps(params, sort_keys=True, default=str).encode("utf-8"))
+        digest.update(str(variation_index).encode("utf-8"))
+        return digest.hexdigest()
+
+    def get(self, key: str) -> Optional[List[str]]:
+        path = self.get_path(key)
+        if path is None:
+            return None
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            self._record_corrupt(key)
+            return None
+
+    def put(self, key: str, images: List[str]):
+        if images:
+            self.put_bytes(key, json.dumps(images).encode("utf-8"))
+
+
+generation_cache = GenerationCache(GENERATION_CACHE_DIR, GENERATION_CACHE_MAX_BYTES)
+
+
+@app.get("/cache-stats")
+async def cache_stats():
+    """Hit/miss counters and sizes of the generation result cache and the upload preprocessing cache."""
+    return {
+        "generation": generation_cache.stats(),
+        "preprocess": prepared_image_cache.stats(),
+        "derivatives": derivative_cache.stats(),
+        "references": reference_store.stats(),
+    }
+
+# --- SOURCE IMAGE PREPROCESSING ---
+# Camera JPEGs and 4K PNGs are far larger than what a 1K card needs. Before upload we sniff the real format,
+# drop metadata, downscale to the target tier and re-encode. Results are memoized by content hash.
+UPLOAD_MAX_EDGE = {"1K": 1024, "2K": 2048, "4K": 4096, "720p": 1280, "1080p": 1920}
+UPLOAD_JPEG_QUALITY = int(os.getenv("UPLOAD_JPEG_QUALITY", "90"))
+PREPROCESS_CACHE_MAX_BYTES = int(float(os.getenv("PREPROCESS_CACHE_MAX_MB", "256")) * 1024 * 1024)
+
+IMAGE_SIGNATURES = [
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+    (b"BM", "image/bmp"),
+]
+
+
+def sniff_image_mime(data: bytes) -> Optional[str]:
+    """Detects the image format from its magic bytes rather than trusting the file extension."""
+    for signature, mime in IMAGE_SIGNATURES:
+        if data.startswith(signature):
+            return mime
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    if data[4:12] in (b"ftypavif", b"ftypheic", b"ftypheix", b"ftypmif1"):
+        return "image/heic" if b"hei" in data[8:12] else "image/avif"
+    return None
+
+
+def decode_data_url(data_url: str) -> Tuple[bytes, Optional[str]]:
+    """Splits a data: URL into (bytes, declared mime type)."""
+    header, encoded = data_url.split(",", 1)
+    data = base64.b64decode(encoded)
+    if not data:
+        raise ValueError("Empty image data")
+    return data, header[5:].split(";", 1)[0] or None
+
+
+class SourceImage(NamedTuple):
+    """A generation input held in memory: raw bytes plus a stem used to name the upload."""
+    data: bytes
+    name: str
+
+
+class PreparedImage(NamedTuple):
+    data: bytes
+    mime_type: str
+    width: int
+    height: int
+
+    @property
+    def extension(self) -> str:
+        return {"image/png": "png", "image/webp": "webp"}.get(self.mime_type, "jpg")
+
+
+# Formats an upstream accepts as-is; the original is sent untouched when it's already the smaller payload
+IMAGE_UPLOAD_MIMES = ("image/png", "image/jpeg", "image/webp")
+VIDEO_UPLOAD_MIMES = ("image/png", "image/jpeg")
+
+
+def prepare_upload_image(data: bytes, max_edge: int, passthrough_mimes=IMAGE_UPLOAD_MIMES) -> PreparedImage:
+    """Strips metadata, applies EXIF rotation, downscales to max_edge and re-encodes as JPEG (PNG if transparent)."""
+    original_mime = sniff_image_mime(data)
+    if original_mime is None:
+        raise ValueError("Unsupported or corrupt image data")
+
+    with Image.open(io.BytesIO(data)) as src:
+        # Let libjpeg decode straight at a reduced scale (1/2..1/8) instead of full camera resolution
+        if src.format == "JPEG":
+            src.draft("RGB", (max_edge, max_edge))
+        img = ImageOps.exif_transpose(src)
+        has_alpha = img.mode in ("RGBA", "LA", "PA") or (img.mode == "P" and "transparency" in img.info)
+        if has_alpha:
+            img = img.convert("RGBA")
+            # Fully opaque "RGBA" product shots encode much smaller as JPEG
+            has_alpha = img.getchannel("A").getextrema()[0] < 255
+        if not has_alpha:
+            img = img.convert("RGB")
+
+        resized = max(img.size) > max_edge
+        if resized:
+            img.thumbnail((max_edge, max_edge), Image.Resampling.LANCZOS)
+
+        out = io.BytesIO()
+        if has_alpha:
+            img.save(out, format="PNG", optimize=False, compress_level=6)
+            mime_type = "image/png"
+        else:
+            img.save(out, format="JPEG", quality=UPLOAD_JPEG_QUALITY, optimize=True)
+            mime_type = "image/jpeg"
+        prepared = PreparedImage(data=out.getvalue(), mime_type=mime_type, width=img.width, height=img.height)
+
+    # Already tightly encoded (small JPEGs, lossy WebP cutouts): re-encoding would only grow it
+    if len(data) <= len(prepared.data) and original_mime in passthrough_mimes:
+        with Image.open(io.BytesIO(data)) as src:
+            width, height = ImageOps.exif_transpose(src).size
+        return PreparedImage(data=data, mime_type=original_mime, width=width, height=height)
+    return prepared
+
+
+def resize_mask(mask: bytes, width: int, height: int) -> bytes:
+    """Masks must match the (possibly downscaled) upload dimensions exactly."""
+    with Image.open(io.BytesIO(mask)) as img:
+        if img.size == (width, height):
+            return mask
+        out = io.BytesIO()
+        img.convert("RGBA").resize((width, height), Image.Resampling.NEAREST).save(out, format="PNG")
+        return out.getvalue()
+
+
+class PreparedImageCache:
+    """In-memory LRU of prepared uploads keyed by (source hash, max edge), bounded by total bytes."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self._entries: "OrderedDict[str, PreparedImage]" = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+
+    def prepare(self, data: bytes, max_edge: int, passthrough_mimes=IMAGE_UPLOAD_MIMES) -> PreparedImage:
+        key = f"{hashlib.sha256(data).hexdigest()}:{max_edge}:{','.join(passthrough_mimes)}"
+        with self._lock:
+            prepared = self._entries.get(key)
+            if prepared is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                self.bytes_in += len(data)
+                self.bytes_out += len(prepared.data)
+                return prepared
+
+        prepared = prepare_upload_image(data, max_edge, passthrough_mimes)
+        with self._lock:
+            self.misses += 1
+            self.bytes_in += len(data)
+            self.bytes_out += len(prepared.data)
+            if key not in self._entries and len(prepared.data) <= self.max_bytes:
+                self._entries[key] = prepared
+                self._total_bytes += len(prepared.data)
+                while self._total_bytes > self.max_bytes:
+                    _, old = self._entries.popitem(last=False)
+                    self._total_bytes -= len(old.data)
+        return prepared
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": len(self._entries),
+                "bytes": self._total_bytes,
+                "max_bytes": self.max_bytes,
+                "source_bytes": self.bytes_in,
+                "upload_bytes": self.bytes_out,
+            }
+
+
+prepared_image_cache = PreparedImageCache(PREPROCESS_CACHE_MAX_BYTES)
+
+
+async def prepare_source_image(data: bytes, max_edge: int, passthrough_mimes=IMAGE_UPLOAD_MIMES) -> PreparedImage:
+    try:
+        with span("prepare"):
+            return await asyncio.to_thread(prepared_image_cache.prepare, data, max_edge, passthrough_mimes)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Invalid source image: {str(e)}")
+
+# --- REFERENCE IMAGE HANDLES ---
+# Iterative workflows (refine loops, re-generations) send the same multi-MB image again and again. An image can be
+# uploaded once to /references and then passed by handle ("ref:<hash>") anywhere a data URL or path is accepted.
+# Handles are content hashes, so re-uploading the same image returns the same handle. Entries live on disk with a
+# size budget (LRU) and a sliding TTL: every use pushes expiry back.
+REFERENCE_PREFIX = "ref:"
+REFERENCE_DIR = os.getenv("REFERENCE_DIR", os.path.join(tempfile.gettempdir(), "sjc_references"))
+REFERENCE_MAX_BYTES = int(float(os.getenv("REFERENCE_MAX_MB", "1024")) * 1024 * 1024)
+REFERENCE_MAX_UPLOAD_BYTES = int(float(os.getenv("REFERENCE_MAX_UPLOAD_MB", "50")) * 1024 * 1024)
+REFERENCE_TTL = float(os.getenv("REFERENCE_TTL_SECONDS", "3600"))
+
+
+class ReferenceStore(DiskLRUCache):
+    """DiskLRUCache whose entries also expire after REFERENCE_TTL seconds without use."""
+
+    def __init__(self, directory: str, max_bytes: int, ttl: float):
+        super().__init__(directory, max_bytes, ".ref")
+        self.ttl = ttl
+
+    @staticmethod
+    def key_for(handle: str) -> Optional[str]:
+        key = handle[len(REFERENCE_PREFIX):]
+        return key if len(key) == 32 and all(ch in "0123456789abcdef" for ch in key) else None
+
+    def _expired(self, key: str) -> bool:
+        try:
+            return datetime.now().timestamp() - os.path.getmtime(self.path(key)) > self.ttl
+        except OSError:
+            return True
+
+    def purge_expired(self):
+        # Entries are in LRU (= mtime) order, so expired ones are all at the front
+        expired = []
+        with self._lock:
+            self._load()
+            for key in list(self._entries):
+                if not self._expired(key):
+                    break
+                self._total_bytes -= self._entries.pop(key)
+                expired.append(key)
+        for key in expired:
+            try:
+                os.remove(self.path(key))
+            except OSError:
+                pass
+
+    def put(self, data: bytes) -> str:
+        self.purge_expired()
+        key = hashlib.sha256(data).hexdigest()[:32]
+        # An upload is not a lookup: don't count it as a miss (or a re-upload as a hit)
+        if self.get_path(key, count=False) is None:
+            self.put_bytes(key, data)
+        return f"{REFERENCE_PREFIX}{key}"
+
+    def read(self, handle: str) -> bytes:
+        """Returns the referenced bytes; raises KeyError for unknown, expired or malformed handles."""
+        key = self.key_for(handle)
+        if key is None or self._expired(key):
+            raise KeyError(handle)
+        path = self.get_path(key)  # touches mtime: the TTL is sliding
+        if path is None:
+            raise KeyError(handle)
+        try:
+            with open(path, "rb") as f:
+                return f.read()
+        except OSError:
+            self._record_corrupt(key)
+            raise KeyError(handle)
+
+
+reference_store = ReferenceStore(REFERENCE_DIR, REFERENCE_MAX_BYTES, REFERENCE_TTL)
+
+
+def is_reference_handle(value: Optional[str]) -> bool:
+    return isinstance(value, str) and value.startswith(REFERENCE_PREFIX)
+
+
+def read_reference(handle: str) -> bytes:
+    try:
+        return reference_store.read(handle.strip())
+    except KeyError:
+        raise HTTPException(status_code=410, detail=f"Reference {handle} is unknown or expired; upload the image again.")
+
+
+async def load_reference(handle: str) -> bytes:
+    return await asyncio.to_thread(read_reference, handle)
+
+
+def store_result_references(images: List[str]) -> List[Optional[str]]:
+    """Puts generated data URL images in the reference store, so the next refine can send handles back instead."""
+    handles = []
+    for image in images:
+        try:
+            handles.append(reference_store.put(decode_data_url(image)[0]) if image.startswith("data:image") else None)
+        except ValueError:
+            handles.append(None)
+    return handles
+
+
+async def add_result_references(result: Dict[str, Any], wanted: Optional[bool]) -> Dict[str, Any]:
+    if wanted and result.get("images"):
+        result["references"] = await asyncio.to_thread(store_result_references, result["images"])
+    return result
+
+
+def reference_data_url(handle: str) -> str:
+    data = read_reference(handle)
+    return f"data:{sniff_image_mime(data) or 'image/png'};base64,{base64.b64encode(data).decode('utf-8')}"
+
+@app.post("/references")
+async def upload_reference(file: UploadFile = File(...)):
+    """Stores an image once and returns a short handle usable in place of the image on generation endpoints."""
+    chunks, size = [], 0
+    while True:
+        chunk = await file.read(1024 * 1024)
+        if not chunk:
+            break
+        size += len(chunk)
+        if size > REFERENCE_MAX_UPLOAD_BYTES:
+            raise HTTPException(status_code=413, detail="Reference image too large")
+        chunks.append(chunk)
+    data = b"".join(chunks)
+    mime_type = sniff_image_mime(data)
+    if mime_type is None:
+        raise HTTPException(status_code=415, detail="Unsupported or unrecognized image format")
+    handle = await asyncio.to_thread(reference_store.put, data)
+    return {"handle": handle, "mime_type": mime_type, "size": size, "ttl_seconds": REFERENCE_TTL}
+
 # 2. Update the ProductRequest Model to make fields optional
 class ProductRequest(BaseModel):
     image_path: str
@@ -92,6 +1336,15 @@ class ProductRequest(BaseModel):
     temperature: Optional[float] = 1.0
     top_p: Optional[float] = 0.95
 
+    # Set to False to force a fresh generation instead of reusing a cached result
+    use_cache: Optional[bool] = True
+    # Scheduling class for the upstream call; batch grid generation defaults to "bulk"
+    priority: Optional[Literal["interactive", "bulk"]] = None
+    # Let the other engine (v2 <-> v1) serve the card when the requested one is failing or its circuit is open
+    allow_fallback: Optional[bool] = False
+    # Also return "references": one handle per result image, for iterative refines
+    return_references: Optional[bool] = False
+
 # --- NEW: Video Schema ---
 class VideoRequest(BaseModel):
     image_path: str
@@ -101,97 +1354,837 @@ class VideoRequest(BaseModel):
     duration: Optional[int] = 8
     generate_audio: Optional[bool] = False
     model: Optional[str] = "veo-3.1-generate-001"
+    # Blocks until the video is ready instead of returning a job id (legacy behaviour)
+    wait: Optional[bool] = False
 
-# 3. Update the generate_card endpoint with smart path resolving
-@app.post("/generate-card")
-async def generate_card(product: ProductRequest):
-    raw_path = product.image_path.strip().replace('"', "")
+# --- ASSET PATH INDEX ---
+# Image/video paths from the UI come in many shapes ("/Image/1.jpg", "public/Image/1.jpg", absolute, bare name).
+# Rather than probing candidates with os.path.exists (slow on synced drives), the public folder is indexed once
+# at startup and kept fresh by re-listing only directories whose mtime changed. Lookups are dictionary hits.
+ASSET_INDEX_ROOT = os.getenv("ASSET_INDEX_ROOT", os.path.join(REACT_PUBLIC_DIR, "public"))
+ASSET_INDEX_RESCAN_INTERVAL = float(os.getenv("ASSET_INDEX_RESCAN_INTERVAL", "5"))
 
-    # Support data URLs (Live mode "previous" results are often data:image/... base64)
-    if raw_path.startswith("data:image"):
-        try:
-            header, encoded = raw_path.split(",", 1)
-            mime = header.split(";")[0].split(":")[1] if ":" in header else "image/png"
-            ext = (mime.split("/")[-1] or "png").lower()
 
-            tmp_dir = os.path.join(tempfile.gettempdir(), "sjc_image_mod")
-            os.makedirs(tmp_dir, exist_ok=True)
+class AmbiguousAssetError(Exception):
+    def __init__(self, name: str, candidates: List[str]):
+        super().__init__(f"'{name}' matches {len(candidates)} files: {candidates[:10]}")
+        self.candidates = candidates
 
-            tmp_name = f"ref_{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}.{ext}"
-            clean_path = os.path.join(tmp_dir, tmp_name)
 
-            with open(clean_path, "wb") as f:
-                f.write(base64.b64decode(encoded))
-        except Exception as e:
-            raise HTTPException(status_code=400, detail=f"Invalid data URL image_path: {str(e)}")
-    else:
-        # Normalize leading slashes so os.path.join doesn't drop REACT_PUBLIC_DIR on Windows
-        raw_rel = raw_path.lstrip("/\\") if raw_path else raw_path
+def asset_key(path: str) -> str:
+    return path.replace("\\", "/").strip("/").lower()
 
-        # Path Resolver Logic:
-        # 1. Try path as-is
-        clean_path = raw_path
 
-        # 2. Try relative to React Project Root (e.g., public/Image/1.jpg)
-        if not os.path.exists(clean_path):
-            clean_path = os.path.join(REACT_PUBLIC_DIR, raw_rel)
+class AssetIndex:
+    def __init__(self, root: str):
+        self.root = os.path.abspath(root)
+        self.project_root = os.path.dirname(self.root)
+        self._dirs: Dict[str, Any] = {}  # abs dir -> (mtime_ns, file names, subdir paths)
+        self._by_rel: Dict[str, str] = {}
+        self._by_name: Dict[str, List[str]] = {}
+        self._next_scan_at = 0.0
+        self._lock = threading.Lock()
 
-        # 3. Try relative to public folder specifically
-        if not os.path.exists(clean_path):
-            raw_rel_no_public = raw_rel.replace("public/", "").replace("public\\", "")
-            clean_path = os.path.join(REACT_PUBLIC_DIR, "public", raw_rel_no_public)
+    def _scan_dir(self, directory: str):
+        try:
+            st = os.stat(directory)
+            files, subdirs = [], []
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if entry.name.startswith("."):
+                        continue
+                    if entry.is_dir():
+                        subdirs.append(entry.path)
+                    elif entry.is_file():
+                        files.append(entry.name)
+        except OSError:
+            self._dirs.pop(directory, None)
+            return
+        self._dirs[directory] = (st.st_mtime_ns, files, subdirs)
+        for subdir in subdirs:
+            if subdir not in self._dirs:
+                self._scan_dir(subdir)
+
+    def refresh(self, force: bool = False) -> bool:
+        """Re-lists directories whose mtime changed. Returns True when the index changed."""
+        with self._lock:
+            now = datetime.now().timestamp()
+            if not force and now < self._next_scan_at:
+                return False
+            changed = False
+            if not self._dirs:
+                self._scan_dir(self.root)
+                changed = True
+            for directory, (mtime_ns, _, _) in list(self._dirs.items()):
+                if directory not in self._dirs:
+                    continue  # Dropped while rescanning a parent
+                try:
+                    current = os.stat(directory).st_mtime_ns
+                except OSError:
+                    current = None
+                if current != mtime_ns:
+                    old_subdirs = self._dirs.pop(directory)[2]
+                    if current is not None:
+                        self._scan_dir(directory)
+                    kept = set(self._dirs.get(directory, (0, [], []))[2])
+                    for gone in old_subdirs:
+                        if gone not in kept:
+                            self._drop_tree(gone)
+                    changed = True
+            if changed:
+                self._rebuild()
+            self._next_scan_at = now + ASSET_INDEX_RESCAN_INTERVAL
+            return changed
+
+    def _drop_tree(self, directory: str):
+        prefix = directory + os.sep
+        for path in [d for d in self._dirs if d == directory or d.startswith(prefix)]:
+            del self._dirs[path]
+
+    def _rebuild(self):
+        by_rel, by_name = {}, {}
+        for directory, (_, files, _) in self._dirs.items():
+            rel_dir = os.path.relpath(directory, self.root)
+            for name in files:
+                abs_path = os.path.join(directory, name)
+                by_rel[asset_key(os.path.join(rel_dir, name))] = abs_path
+                by_name.setdefault(name.lower(), []).append(abs_path)
+        self._by_rel, self._by_name = by_rel, by_name
+
+    def _is_external(self, raw: str) -> bool:
+        """True for absolute paths outside the public folder: DAM folders, C:\\..., \\\\server\\share\\...
+
+        "/Image/1.jpg" looks absolute but is public-relative when its first segment is a folder under the root.
+        """
+        key = asset_key(raw)
+        windows_abs = bool(re.match(r"[a-z]:/", key)) or raw.startswith(("\\\\", "//"))
+        if not (windows_abs or os.path.isabs(raw)):
+            return False
+        for prefix in (asset_key(self.root) + "/", asset_key(self.project_root) + "/public/"):
+            if key.startswith(prefix):
+                return False
+        first_segment = raw.replace("\\", "/").strip("/").split("/", 1)[0]
+        return windows_abs or not os.path.isdir(os.path.join(self.root, first_segment))
+
+    def _lookup(self, raw: str, prefer_dir: Optional[str], by_basename: bool = True) -> Optional[str]:
+        key = asset_key(raw)
+        root_key = asset_key(self.root)
+        project_key = asset_key(self.project_root)
+        # Absolute paths inside the indexed tree, "public/..." and "/Image/..." all reduce to a key under the root
+        for prefix in (root_key + "/", project_key + "/public/", "public/"):
+            if key.startswith(prefix):
+                key = key[len(prefix):]
+                break
+        if key in self._by_rel:
+            return self._by_rel[key]
+        if not by_basename:
+            return None
+
+        name = key.rsplit("/", 1)[-1]
+        candidates = self._by_name.get(name, [])
+        if prefer_dir:
+            preferred = [p for p in candidates if asset_key(os.path.relpath(os.path.dirname(p), self.root)) == prefer_dir.lower()]
+            if len(preferred) == 1:
+                return preferred[0]
+            if preferred:
+                candidates = preferred
+        if len(candidates) == 1:
+            return candidates[0]
+        if candidates:
+            raise AmbiguousAssetError(raw, sorted(candidates))
+        return None
+
+    def resolve(self, raw: str, prefer_dir: Optional[str] = None, by_basename: bool = True) -> Optional[str]:
+        """Maps a UI path to an absolute file path, or None. Raises AmbiguousAssetError for a basename with several hits.
+
+        prefer_dir (relative to the public folder, e.g. "Image") breaks ties for bare basenames. by_basename=False
+        only accepts the exact path, for callers that never searched by file name.
+        """
+        raw = raw.strip().replace('"', "")
+        if not raw:
+            return None
+        # Paths outside the public folder (e.g. DAM folders) are taken as given; guessing by basename would
+        # serve an unrelated public file that happens to share the name
+        external = self._is_external(raw)
+        if external and os.path.isfile(raw):
+            return raw
+        self.refresh()
+        by_basename = by_basename and not external
+        found = self._lookup(raw, prefer_dir, by_basename)
+        if found is None and self.refresh(force=True):
+            found = self._lookup(raw, prefer_dir, by_basename)  # The file may have been added since the last scan
+        return found
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "root": self.root,
+            "directories": len(self._dirs),
+            "files": len(self._by_rel),
+            "ambiguous_names": sum(1 for paths in self._by_name.values() if len(paths) > 1),
+        }
 
-        # 4. Try just the filename inside public/Image
-        if not os.path.exists(clean_path):
-            clean_path = os.path.join(REACT_PUBLIC_DIR, "public", "Image", os.path.basename(raw_rel))
 
-    if not os.path.exists(clean_path):
+asset_index = AssetIndex(ASSET_INDEX_ROOT)
+
+
+async def resolve_asset_path(
+    raw: str,
+    prefer_dir: Optional[str] = None,
+    not_found_detail: Optional[str] = None,
+    by_basename: bool = True,
+) -> str:
+    """Shared resolver for every endpoint that takes an image/video path. 404 when missing, 409 when ambiguous."""
+    try:
+        with span("resolve"):
+            found = await asyncio.to_thread(asset_index.resolve, raw, prefer_dir, by_basename)
+    except AmbiguousAssetError as e:
         raise HTTPException(
-            status_code=404,
-            detail=f"Image file not found at: {clean_path}. Check REACT_PUBLIC_DIR in .env"
+            status_code=409,
+            detail={"message": f"Ambiguous asset path: {e}", "candidates": e.candidates},
         )
+    if found is None:
+        raise HTTPException(status_code=404, detail=not_found_detail or f"Asset not found: {raw}")
+    return found
+
+@app.get("/asset-index-stats")
+async def asset_index_stats():
+    return asset_index.stats()
+
+# --- ENGINE CIRCUIT BREAKERS ---
+# One breaker per card engine (v2 = Gemini, v1 = Azure gpt-image). Each keeps a sliding window of recent outcomes;
+# too many failures, or a p90 latency above the engine's limit, opens it. While open, calls fail fast (or fall back
+# to the other engine when the request allows it). After BREAKER_OPEN_SECONDS a single half-open probe decides
+# whether to close again or stay open.
+BREAKER_WINDOW_SECONDS = float(os.getenv("BREAKER_WINDOW_SECONDS", "120"))
+BREAKER_MIN_CALLS = int(os.getenv("BREAKER_MIN_CALLS", "5"))
+BREAKER_ERROR_RATE = float(os.getenv("BREAKER_ERROR_RATE", "0.5"))
+BREAKER_OPEN_SECONDS = float(os.getenv("BREAKER_OPEN_SECONDS", "30"))
+BREAKER_P90_LIMITS = {
+    "v2": float(os.getenv("V2_BREAKER_P90_SECONDS", "120")),
+    "v1": float(os.getenv("V1_BREAKER_P90_SECONDS", "150")),
+}
+
+
+class CircuitOpenError(Exception):
+    def __init__(self, engine: str, retry_after: float):
+        super().__init__(f"Engine {engine} is unavailable (circuit open)")
+        self.engine = engine
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    def __init__(self, name: str, p90_limit: float):
+        self.name = name
+        self.p90_limit = p90_limit
+        self.state = "closed"
+        self.opened_at = 0.0
+        self.open_reason = None
+        self.times_opened = 0
+        self.rejected = 0
+        self._outcomes: deque = deque()  # (monotonic time, ok, latency)
+        self._probe_in_flight = False
+
+    def _trim(self):
+        horizon = time.monotonic() - BREAKER_WINDOW_SECONDS
+        while self._outcomes and self._outcomes[0][0] < horizon:
+            self._outcomes.popleft()
+
+    def retry_after(self) -> float:
+        return max(0.0, self.opened_at + BREAKER_OPEN_SECONDS - time.monotonic())
+
+    def before_call(self) -> bool:
+        """Admits a call or raises CircuitOpenError. Returns True when the call is the half-open probe."""
+        if self.state == "open" and self.retry_after() == 0:
+            self.state = "half_open"
+        if self.state == "closed":
+            return False
+        if self.state == "half_open" and not self._probe_in_flight:
+            self._probe_in_flight = True
+            return True
+        self.rejected += 1
+        raise CircuitOpenError(self.name, self.retry_after() or 1.0)
+
+    def record(self, ok: bool, latency: float, probe: bool):
+        if probe:
+            self._probe_in_flight = False
+            if ok:
+                self.state, self.open_reason = "closed", None
+                self._outcomes.clear()
+                logger.info("Circuit for engine %s closed after a successful probe", self.name)
+            else:
+                self._open("half-open probe failed")
+            return
+        self._outcomes.append((time.monotonic(), ok, latency))
+        self._trim()
+        if self.state != "closed" or len(self._outcomes) < BREAKER_MIN_CALLS:
+            return
+        error_rate, p90 = self._window_stats()
+        if error_rate >= BREAKER_ERROR_RATE:
+            self._open(f"error rate {error_rate:.0%}")
+        elif p90 is not None and p90 >= self.p90_limit:
+            self._open(f"p90 latency {p90:.1f}s")
+
+    def release_probe(self):
+        # Probe was cancelled (client went away) without an outcome; let the next call probe instead
+        self._probe_in_flight = False
+
+    def _open(self, reason: str):
+        self.state = "open"
+        self.opened_at = time.monotonic()
+        self.open_reason = reason
+        self.times_opened += 1
+        logger.warning("Circuit for engine %s opened: %s", self.name, reason)
+
+    def _window_stats(self) -> Tuple[float, Optional[float]]:
+        if not self._outcomes:
+            return 0.0, None
+        errors = sum(1 for _, ok, _ in self._outcomes if not ok)
+        latencies = sorted(latency for _, ok, latency in self._outcomes if ok)
+        p90 = latencies[int(0.9 * (len(latencies) - 1))] if latencies else None
+        return errors / len(self._outcomes), p90
+
+    def allows(self) -> bool:
+        return self.state == "closed" or (self.state == "open" and self.retry_after() == 0) or (
+            self.state == "half_open" and not self._probe_in_flight
+        )
+
+    def stats(self) -> Dict[str, Any]:
+        self._trim()
+        error_rate, p90 = self._window_stats()
+        latencies = sorted(latency for _, ok, latency in self._outcomes if ok)
+        return {
+            "state": self.state,
+            "open_reason": self.open_reason,
+            "retry_after": round(self.retry_after(), 1) if self.state == "open" else 0,
+            "window_calls": len(self._outcomes),
+            "error_rate": round(error_rate, 3),
+            "p50_seconds": round(latencies[len(latencies) // 2], 3) if latencies else None,
+            "p90_seconds": round(p90, 3) if p90 is not None else None,
+            "p90_limit_seconds": self.p90_limit,
+            "times_opened": self.times_opened,
+            "rejected": self.rejected,
+        }
+
+
+engine_breakers = {engine: CircuitBreaker(engine, limit) for engine, limit in BREAKER_P90_LIMITS.items()}
+
+
+def is_engine_failure(exc: Exception) -> bool:
+    """Engine-health failures: upstream 5xx/429 and transport errors. Bad input and local admission don't count."""
+    if isinstance(exc, HTTPException):
+        if isinstance(exc.detail, dict) and "queue_position" in exc.detail:
+            return False  # Our own scheduler turned it away
+        return exc.status_code >= 500 or exc.status_code == 429
+    return True
+
+
+async def run_card_engine(engine: str, product: ProductRequest, source: "SourceImage", mask_path: Optional[str]):
+    breaker = engine_breakers[engine]
+    probe = breaker.before_call()
+    # The breaker only sees calls that reached the provider, timed by the longest single upstream call; admission
+    # queueing, semaphore waits and cache hits say nothing about engine health
+    tally = UpstreamTally()
+    token = upstream_tally.set(tally)
+    try:
+        if engine == "v2":
+            result = await handle_nano_banana(product, source)
+        else:
+            result = await handle_gpt_image1_request(product, source, mask_path)
+    except asyncio.CancelledError:
+        if probe:
+            breaker.release_probe()
+        raise
+    except Exception as e:
+        if is_engine_failure(e) and tally.calls:
+            breaker.record(False, tally.longest, probe)
+        elif probe:
+            breaker.release_probe()
+        raise
+    finally:
+        upstream_tally.reset(token)
+    if tally.calls:
+        breaker.record(True, tally.longest, probe)
+    elif probe:
+        breaker.release_probe()
+    return result
+
+@app.get("/engine-status")
+async def engine_status():
+    """Circuit breaker state, error rate and latency percentiles for each card engine."""
+    return {engine: breaker.stats() for engine, breaker in engine_breakers.items()}
+
+# 3. Update the generate_card endpoint with smart path resolving
+@app.post("/generate-card")
+async def generate_card(product: ProductRequest):
+    raw_path = product.image_path.strip().replace('"', "")
+
+    # Support data URLs (Live mode "previous" results are often data:image/... base64).
+    # They are decoded straight into memory; nothing is written to disk for the upstream call.
+    if is_reference_handle(raw_path):
+        with span("read"):
+            source = SourceImage(await load_reference(raw_path), "reference")
+    elif raw_path.startswith("data:image"):
+        try:
+            with span("decode"):
+                img_bytes, _ = await asyncio.to_thread(decode_data_url, raw_path)
+        except Exception as e:
+            raise HTTPException(status_code=400, detail=f"Invalid data URL image_path: {str(e)}")
+        source = SourceImage(img_bytes, "reference")
+    else:
+        # Bare file names fall back to public/Image, as before
+        clean_path = await resolve_asset_path(
+            raw_path, prefer_dir="Image",
+            not_found_detail=f"Image file not found: {raw_path}. Check REACT_PUBLIC_DIR in .env",
+        )
+        with span("read"):
+            source = SourceImage(await asyncio.to_thread(Path(clean_path).read_bytes), Path(clean_path).stem)
 
     # Proceed with original logic
     mask_path = None
     if getattr(product, "mask_path", None):
-        mask_candidate = product.mask_path.strip().replace('"', "")
-        if os.path.exists(mask_candidate):
-            mask_path = mask_candidate
-
-    if product.server_version == "v2":
-        # Pass the newly resolved clean_path to your handlers if necessary
-        # or ensure product.image_path is updated
-        product.image_path = clean_path
-        return await handle_nano_banana(product)
+        # Masks were always looked up by exact path; a same-named file elsewhere is not this mask
+        with span("resolve"):
+            mask_path = await asyncio.to_thread(asset_index.resolve, product.mask_path, None, False)
+
+    engine = "v2" if product.server_version == "v2" else "v1"
+    fallback = "v1" if engine == "v2" else "v2"
+    try:
+        result = await run_card_engine(engine, product, source, mask_path)
+    except CircuitOpenError as e:
+        if not product.allow_fallback or not engine_breakers[fallback].allows():
+            raise HTTPException(
+                status_code=503,
+                detail=f"{e} and no fallback engine is available",
+                headers={"Retry-After": str(int(math.ceil(e.retry_after)))},
+            )
+        logger.warning("Engine %s circuit open, falling back to %s", engine, fallback)
+    except Exception as e:
+        if not (product.allow_fallback and is_engine_failure(e) and engine_breakers[fallback].allows()):
+            raise
+        logger.warning("Engine %s failed (%s), falling back to %s", engine, e, fallback)
     else:
-        return await handle_gpt_image1_request(product, clean_path, mask_path)
+        return await add_result_references(result, product.return_references)
+
+    try:
+        result = await run_card_engine(fallback, product, source, mask_path)
+    except CircuitOpenError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(int(math.ceil(e.retry_after)))})
+    return await add_result_references({**result, "engine": fallback, "fallback": True}, product.return_references)
+
+# --- BATCH CARD GENERATION ---
+# One request renders a whole flyer grid; each cell's result is streamed back as NDJSON as soon as it's ready.
+BATCH_CARD_CONCURRENCY = max(1, int(os.getenv("BATCH_CARD_CONCURRENCY", "6")))
+
+class CardBatchCell(ProductRequest):
+    cell_id: str
+
+class CardBatchRequest(BaseModel):
+    cells: List[CardBatchCell]
+    concurrency: Optional[int] = None
+
+@app.post("/generate-cards")
+async def generate_cards(request: CardBatchRequest):
+    """Generates many cards with bounded concurrency, streaming one NDJSON line per cell as it completes."""
+    if not request.cells:
+        raise HTTPException(status_code=400, detail="No cells provided")
+
+    limit = max(1, min(request.concurrency or BATCH_CARD_CONCURRENCY, BATCH_CARD_CONCURRENCY))
+    slots = asyncio.Semaphore(limit)
+
+    async def run_cell(cell: CardBatchCell) -> Dict[str, Any]:
+        async with slots:
+            try:
+                cell.priority = cell.priority or "bulk"
+                result = await generate_card(cell)
+                return {"cell_id": cell.cell_id, **result}
+            except HTTPException as e:
+                return {"cell_id": cell.cell_id, "error": e.detail, "status_code": e.status_code}
+            except Exception as e:
+                return {"cell_id": cell.cell_id, "error": str(e), "status_code": 500}
+
+    async def stream():
+        tasks = [asyncio.create_task(run_cell(cell)) for cell in request.cells]
+        failed = 0
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                line = await next_done
+                if "error" in line:
+                    failed += 1
+                yield json.dumps(line) + "\n"
+            yield json.dumps({"done": True, "total": len(tasks), "failed": failed}) + "\n"
+        finally:
+            # Client went away mid-stream: don't keep paying for cells nobody will see
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+# --- VIDEO JOBS ---
+# Veo runs as a long-running operation. /generate-video launches it and returns a job id at once; a single
+# background poller tracks every pending operation with adaptive backoff. Jobs are kept as one JSON file each
+# so pending operations are picked up again after a restart. Finished clips (and a poster frame) are written to
+# VIDEO_OUTPUT_DIR and served from /videos with byte ranges, so the browser can start playing before the download ends.
+VEO_API_BASE = os.getenv("VEO_API_BASE", "https://us-central1-aiplatform.googleapis.com/v1")
+VIDEO_JOB_DIR = os.getenv("VIDEO_JOB_DIR", os.path.join(tempfile.gettempdir(), "sjc_video_jobs"))
+VIDEO_OUTPUT_DIR = os.getenv("VIDEO_OUTPUT_DIR", os.path.join(REACT_PUBLIC_DIR, "public", "Video", "Generated"))
+VIDEO_POSTER_MAX_SIZE = 1280
+VIDEO_POLL_MIN_INTERVAL = float(os.getenv("VIDEO_POLL_MIN_INTERVAL", "5"))
+VIDEO_POLL_MAX_INTERVAL = float(os.getenv("VIDEO_POLL_MAX_INTERVAL", "30"))
+VIDEO_JOB_TIMEOUT = float(os.getenv("VIDEO_JOB_TIMEOUT", "900"))
+VIDEO_POLL_MAX_ERRORS = 5
+# Finished jobs (and their clip and poster) are removed this long after they finish
+VIDEO_JOB_RETENTION = float(os.getenv("VIDEO_JOB_RETENTION", str(7 * 24 * 3600)))
+VIDEO_JOB_GC_INTERVAL = 3600.0
+
+VIDEO_JOB_TERMINAL = {"succeeded", "failed"}
+
+
+class VideoJobStore:
+    """One JSON file per job, written atomically."""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def _path(self, job_id: str) -> str:
+        return os.path.join(self.directory, f"{job_id}.json")
+
+    def save(self, job: Dict[str, Any]):
+        os.makedirs(self.directory, exist_ok=True)
+        tmp_path = f"{self._path(job['job_id'])}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(job, f, indent=2)
+        os.replace(tmp_path, self._path(job["job_id"]))
+
+    def delete(self, job_id: str):
+        try:
+            os.remove(self._path(job_id))
+        except FileNotFoundError:
+            pass
+
+    def load_all(self) -> Dict[str, Dict[str, Any]]:
+        jobs = {}
+        for fpath in glob.glob(os.path.join(self.directory, "*.json")):
+            try:
+                with open(fpath, "r", encoding="utf-8") as f:
+                    job = json.load(f)
+                jobs[job["job_id"]] = job
+            except Exception:
+                continue
+        return jobs
+
+
+class VideoJobPoller:
+    """Single background task that polls all pending Veo operations, backing off per job."""
+
+    def __init__(self, store: VideoJobStore):
+        self.store = store
+        self.jobs: Dict[str, Dict[str, Any]] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._wake: Optional[asyncio.Event] = None
+        self._changed: Optional[asyncio.Condition] = None
+        self._next_gc_at = 0.0
+
+    def start(self):
+        if self._task is not None and not self._task.done():
+            return
+        self._wake = asyncio.Event()
+        self._changed = asyncio.Condition()
+        # Resume anything left pending by a previous process
+        self.jobs = self.store.load_all()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def submit(self, op_name: str, req: "VideoRequest", source_image: bytes) -> Dict[str, Any]:
+        self.start()
+        now = datetime.now().timestamp()
+        job_id = uuid.uuid4().hex
+        # Image-to-video clips open on the source image, so it doubles as the poster frame
+        poster_name = f"{job_id}.jpg"
+        try:
+            await asyncio.to_thread(write_video_poster, poster_name, source_image)
+        except Exception as e:
+            logger.warning("Skipping poster frame: %s", e)
+            poster_name = None
+        job = {
+            "job_id": job_id,
+            "status": "running",
+            "poster_file": poster_name,
+            "op_name": op_name,
+            "model": req.model,
+            "prompt": req.prompt,
+            "created_at": now,
+            "updated_at": now,
+            "next_poll_at": now + VIDEO_POLL_MIN_INTERVAL,
+            "poll_interval": VIDEO_POLL_MIN_INTERVAL,
+            "poll_errors": 0,
+            "error": None,
+        }
+        self.jobs[job["job_id"]] = job
+        await asyncio.to_thread(self.store.save, job)
+        self._wake.set()
+        return job
+
+    async def wait_for_change(self, job_id: str, last_updated: float, timeout: float) -> Optional[Dict[str, Any]]:
+        """Blocks until the job's updated_at moves past last_updated (or timeout); returns the job."""
+        self.start()
+        async with self._changed:
+            try:
+                await asyncio.wait_for(
+                    self._changed.wait_for(lambda: self.jobs.get(job_id, {}).get("updated_at", 0) > last_updated),
+                    timeout,
+                )
+            except asyncio.TimeoutError:
+                pass
+        return self.jobs.get(job_id)
+
+    async def _update(self, job: Dict[str, Any], **changes):
+        job.update(changes, updated_at=datetime.now().timestamp())
+        await asyncio.to_thread(self.store.save, job)
+        async with self._changed:
+            self._changed.notify_all()
+
+    def _collect_garbage(self, now: float):
+        """Drops finished jobs older than VIDEO_JOB_RETENTION along with their output files."""
+        expired = [
+            job for job in list(self.jobs.values())
+            if job["status"] in VIDEO_JOB_TERMINAL and now - job["updated_at"] > VIDEO_JOB_RETENTION
+        ]
+        for job in expired:
+            for name in (job.get("video_file"), job.get("poster_file")):
+                if name:
+                    try:
+                        os.remove(os.path.join(VIDEO_OUTPUT_DIR, name))
+                    except FileNotFoundError:
+                        pass
+            self.store.delete(job["job_id"])
+            self.jobs.pop(job["job_id"], None)
+        return len(expired)
+
+    async def _run(self):
+        while True:
+            now = datetime.now().timestamp()
+            if now >= self._next_gc_at:
+                self._next_gc_at = now + VIDEO_JOB_GC_INTERVAL
+                try:
+                    removed = await asyncio.to_thread(self._collect_garbage, now)
+                    if removed:
+                        logger.info("Removed %d expired video jobs", removed)
+                except Exception:
+                    logger.exception("Video job cleanup failed")
+
+            pending = [job for job in self.jobs.values() if job["status"] not in VIDEO_JOB_TERMINAL]
+            if not pending:
+                self._wake.clear()
+                await self._wake.wait()
+                continue
+
+            now = datetime.now().timestamp()
+            due = [job for job in pending if job["next_poll_at"] <= now]
+            if not due:
+                delay = min(job["next_poll_at"] for job in pending) - now
+                self._wake.clear()
+                try:
+                    await asyncio.wait_for(self._wake.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            results = await asyncio.gather(*[self._poll(job) for job in due], return_exceptions=True)
+            failures = [(job, result) for job, result in zip(due, results) if isinstance(result, Exception)]
+            for job, result in failures:
+                # _update marks the job before saving, so it is already failed in memory; just wake the waiters
+                logger.error("Video job %s could not be saved: %s", job["job_id"], result)
+            if failures:
+                async with self._changed:
+                    self._changed.notify_all()
+
+    async def _poll(self, job: Dict[str, Any]):
+        """Polls one job; any unexpected error (e.g. a failed disk write) fails the job instead of the poller."""
+        try:
+            await self._poll_once(job)
+        except Exception as e:
+            logger.exception("Video job %s failed", job["job_id"])
+            await self._update(job, status="failed", error=f"Video job error: {str(e)}")
+
+    async def _poll_once(self, job: Dict[str, Any]):
+        now = datetime.now().timestamp()
+        if now - job["created_at"] > VIDEO_JOB_TIMEOUT:
+            await self._update(job, status="failed", error="Video generation timed out.")
+            return
+
+        client = get_upstream_clients().veo
+        poll_url = f"{VEO_API_BASE}/{job['op_name']}?key={GOOGLE_CLOUD_API_KEY}"
+        try:
+            with observe_upstream("veo_poll", job.get("model")) as call:
+                poll_resp = call.set_response(
+                    await client.get(poll_url, headers={"Content-Type": "application/json; charset=utf-8"}, timeout=60.0)
+                )
+            poll_resp.raise_for_status()
+            status = poll_resp.json()
+        except Exception as e:
+            errors = job["poll_errors"] + 1
+            if errors >= VIDEO_POLL_MAX_ERRORS:
+                await self._update(job, status="failed", error=f"Veo Engine Error: {str(e)}")
+            else:
+                interval = min(job["poll_interval"] * 2, VIDEO_POLL_MAX_INTERVAL)
+                await self._update(job, poll_errors=errors, poll_interval=interval, next_poll_at=now + interval)
+            return
+
+        if not status.get("done"):
+            # Veo clips take minutes: start tight, then back off so idle jobs cost few calls
+            interval = min(job["poll_interval"] * 1.5, VIDEO_POLL_MAX_INTERVAL)
+            job.update(poll_errors=0, poll_interval=interval, next_poll_at=now + interval)
+            await asyncio.to_thread(self.store.save, job)
+            return
+
+        if status.get("error"):
+            await self._update(job, status="failed", error=f"Veo Engine Error: {status['error']}")
+            return
+
+        video_info = (status.get("response", {}).get("videos") or [{}])[0]
+        b64_video = video_info.get("bytesBase64Encoded")
+        if not b64_video:
+            await self._update(job, status="failed", error="Veo returned no video data.")
+            return
+
+        video_name = f"{job['job_id']}.mp4"
+        await asyncio.to_thread(write_video_output, video_name, b64_video)
+        await self._update(job, status="succeeded", video_file=video_name)
+
+
+video_job_store = VideoJobStore(VIDEO_JOB_DIR)
+video_job_poller = VideoJobPoller(video_job_store)
+
+
+def write_video_output(video_name: str, b64_video: str):
+    os.makedirs(VIDEO_OUTPUT_DIR, exist_ok=True)
+    tmp_path = os.path.join(VIDEO_OUTPUT_DIR, f"{video_name}.tmp")
+    with open(tmp_path, "wb") as f:
+        f.write(base64.b64decode(b64_video))
+    os.replace(tmp_path, os.path.join(VIDEO_OUTPUT_DIR, video_name))
+
+
+def write_video_poster(poster_name: str, source_image: bytes):
+    os.makedirs(VIDEO_OUTPUT_DIR, exist_ok=True)
+    with Image.open(io.BytesIO(source_image)) as img:
+        img = img.convert("RGB")
+        img.thumbnail((VIDEO_POSTER_MAX_SIZE, VIDEO_POSTER_MAX_SIZE))
+        img.save(os.path.join(VIDEO_OUTPUT_DIR, poster_name), format="JPEG", quality=85, optimize=True)
+
+
+def video_job_status(request: Request, job: Dict[str, Any]) -> Dict[str, Any]:
+    """Absolute URLs, like video_job_result."""
+    status = {key: job.get(key) for key in ("job_id", "status", "error", "created_at", "updated_at")}
+    status["status_url"] = str(request.url_for("get_video_job_status", job_id=job["job_id"]))
+    status["events_url"] = str(request.url_for("stream_video_job", job_id=job["job_id"]))
+    if job.get("poster_file"):
+        status["poster_url"] = str(request.url_for("serve_video", name=job["poster_file"]))
+    if job["status"] == "succeeded":
+        status["result_url"] = str(request.url_for("get_video_job_result", job_id=job["job_id"]))
+        status["video_url"] = str(request.url_for("serve_video", name=job["video_file"]))
+    return status
+
+
+def get_video_job(job_id: str) -> Dict[str, Any]:
+    video_job_poller.start()
+    job = video_job_poller.jobs.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Video job not found.")
+    return job
+
+
+def video_job_result(request: Request, job: Dict[str, Any]) -> Dict[str, Any]:
+    """Absolute URLs, since the React dev server runs on a different origin than the API."""
+    result = {"video": str(request.url_for("serve_video", name=job["video_file"]))}
+    if job.get("poster_file"):
+        result["poster"] = str(request.url_for("serve_video", name=job["poster_file"]))
+    return result
+
+
+def is_not_modified(request: Request, etag: str, mtime: Optional[float]) -> bool:
+    """Evaluates If-None-Match (preferred) or If-Modified-Since against a file's validators.
+
+    Pass mtime=None when there is no meaningful timestamp; If-Modified-Since is then ignored.
+    """
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = [tag.strip() for tag in if_none_match.split(",")]
+        return "*" in tags or etag in tags
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since and mtime is not None:
+        try:
+            return int(mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def conditional_file_response(
+    request: Request,
+    path: str,
+    cache_control: str,
+    media_type: Optional[str] = None,
+    etag: Optional[str] = None,
+    extra_headers: Optional[Dict[str, str]] = None,
+):
+    """FileResponse with a strong ETag, Last-Modified and 304 handling; Range requests are handled by FileResponse."""
+    stat_result = os.stat(path)
+    etag = etag or f'"{stat_result.st_size:x}-{stat_result.st_mtime_ns:x}"'
+    headers = {
+        "ETag": etag,
+        "Last-Modified": formatdate(stat_result.st_mtime, usegmt=True),
+        "Cache-Control": cache_control,
+        **(extra_headers or {}),
+    }
+    if is_not_modified(request, etag, stat_result.st_mtime):
+        return Response(status_code=304, headers=headers)
+    return FileResponse(path, media_type=media_type, headers=headers, stat_result=stat_result)
+
 
 # --- NEW: IMAGE TO VIDEO ENDPOINT ---
 @app.post("/generate-video")
-async def generate_video(req: VideoRequest):
-    """Handles Image-to-Video generation using Google Veo 3.1"""
+async def generate_video(req: VideoRequest, request: Request):
+    """Launches Image-to-Video generation using Google Veo 3.1 and returns a job id to poll or stream.
+
+    Pass wait=true to block until the clip is ready and get {"video": url, "poster": url} back directly.
+    """
     if not GOOGLE_CLOUD_API_KEY:
         raise HTTPException(status_code=500, detail="Google Cloud API Key not configured.")
 
     # 1. Resolve Image to Base64
     clean_path = req.image_path.strip().replace('"', "")
-    if clean_path.startswith("data:image"):
-        _, encoded = clean_path.split(",", 1)
-        b64_image = encoded
-        mime_type = "image/png"
+    if is_reference_handle(clean_path):
+        with span("read"):
+            source_image = await load_reference(clean_path)
+    elif clean_path.startswith("data:image"):
+        try:
+            with span("decode"):
+                source_image, _ = await asyncio.to_thread(decode_data_url, clean_path)
+        except Exception as e:
+            raise HTTPException(status_code=400, detail=f"Invalid data URL image_path: {str(e)}")
     else:
-        raw_rel = clean_path.lstrip("/\\")
-        clean_path = os.path.join(REACT_PUBLIC_DIR, "public", "Video", os.path.basename(raw_rel))
-        if not os.path.exists(clean_path):
-             raise HTTPException(status_code=404, detail="Source image for video not found.")
-        with open(clean_path, "rb") as f:
-            b64_image = base64.b64encode(f.read()).decode('utf-8')
-            mime_type = mimetypes.guess_type(clean_path)[0] or "image/jpeg"
+        clean_path = await resolve_asset_path(clean_path, prefer_dir="Video", not_found_detail="Source image for video not found.")
+        with span("read"):
+            source_image = await asyncio.to_thread(Path(clean_path).read_bytes)
+
+    prepared = await prepare_source_image(source_image, UPLOAD_MAX_EDGE.get(req.resolution or "1080p", 1920), VIDEO_UPLOAD_MIMES)
+    source_image = prepared.data
+    with span("encode"):
+        b64_image = base64.b64encode(prepared.data).decode('utf-8')
+    mime_type = prepared.mime_type
 
     # 2. Call Veo API (REST PredictLongRunning) using API Key in query param
     # Using the verified Project ID 'content-factori' directly to ensure reliability
     project_id = os.getenv("GOOGLE_CLOUD_PROJECT", "content-factori")
-    url = f"https://us-central1-aiplatform.googleapis.com/v1/projects/{project_id}/locations/us-central1/publishers/google/models/{req.model}:predictLongRunning?key={GOOGLE_CLOUD_API_KEY}"
+    url = f"{VEO_API_BASE}/projects/{project_id}/locations/us-central1/publishers/google/models/{req.model}:predictLongRunning?key={GOOGLE_CLOUD_API_KEY}"
     
     headers = {
         "Content-Type": "application/json; charset=utf-8"
@@ -211,36 +2204,76 @@ async def generate_video(req: VideoRequest):
         }
     }
 
-    async with httpx.AsyncClient(timeout=300.0) as client:
-        try:
-            resp = await client.post(url, headers=headers, json=payload)
-            if resp.status_code != 200:
-                raise HTTPException(status_code=resp.status_code, detail=f"Veo Launch Error: {resp.text}")
-            
-            op_data = resp.json()
-            op_name = op_data.get("name")
-            
-            if not op_name:
-                raise HTTPException(status_code=500, detail=f"Operation name missing: {op_data}")
-
-            # Operation polling requires the API Key appended as a query parameter
-            poll_url = f"https://us-central1-aiplatform.googleapis.com/v1/{op_name}?key={GOOGLE_CLOUD_API_KEY}"
-            
-            # Polling for Operation completion
-            for _ in range(60): 
-                await asyncio.sleep(5)
-                poll_resp = await client.get(poll_url, headers=headers)
-                status = poll_resp.json()
-                if status.get("done"):
-                    video_info = status.get("response", {}).get("videos", [{}])[0]
-                    b64_video = video_info.get("bytesBase64Encoded")
-                    if b64_video:
-                        return {"video": f"data:video/mp4;base64,{b64_video}"}
-                    break
-            
-            raise HTTPException(status_code=408, detail="Video generation timed out.")
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=f"Veo Engine Error: {str(e)}")
+    client = get_upstream_clients().veo
+    await admit("veo")
+    try:
+        with observe_upstream("veo", req.model) as call:
+            resp = call.set_response(await client.post(url, headers=headers, json=payload, timeout=300.0))
+        if resp.status_code != 200:
+            raise HTTPException(status_code=resp.status_code, detail=f"Veo Launch Error: {resp.text}")
+        
+        op_data = resp.json()
+        op_name = op_data.get("name")
+        
+        if not op_name:
+            raise HTTPException(status_code=500, detail=f"Operation name missing: {op_data}")
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Veo Engine Error: {str(e)}")
+
+    # 3. Hand the operation to the background poller
+    job = await video_job_poller.submit(op_name, req, source_image)
+    if not req.wait:
+        return JSONResponse(video_job_status(request, job), status_code=202)
+
+    while job["status"] not in VIDEO_JOB_TERMINAL:
+        job = await video_job_poller.wait_for_change(job["job_id"], job["updated_at"], timeout=VIDEO_POLL_MAX_INTERVAL)
+    if job["status"] == "failed":
+        raise HTTPException(status_code=500, detail=job["error"])
+    return video_job_result(request, job)
+
+@app.get("/video-jobs/{job_id}")
+async def get_video_job_status(job_id: str, request: Request):
+    return video_job_status(request, get_video_job(job_id))
+
+@app.get("/video-jobs/{job_id}/result")
+async def get_video_job_result(job_id: str, request: Request):
+    job = get_video_job(job_id)
+    if job["status"] != "succeeded":
+        raise HTTPException(status_code=409, detail=f"Video job is {job['status']}.")
+    return video_job_result(request, job)
+
+@app.api_route("/videos/{name}", methods=["GET", "HEAD"], name="serve_video")
+async def serve_video(name: str, request: Request):
+    """Serves generated clips and posters with byte ranges, ETags and conditional requests."""
+    if name != os.path.basename(name) or not name.lower().endswith((".mp4", ".jpg")):
+        raise HTTPException(status_code=404, detail="Video not found.")
+    path = os.path.join(VIDEO_OUTPUT_DIR, name)
+    if not os.path.isfile(path):
+        raise HTTPException(status_code=404, detail="Video not found.")
+    # File names are unique per job and never rewritten
+    return conditional_file_response(request, path, "public, max-age=31536000, immutable")
+
+@app.get("/video-jobs/{job_id}/events")
+async def stream_video_job(job_id: str, request: Request):
+    """Server-Sent Events: one event per status change, ending once the job succeeds or fails."""
+    job = get_video_job(job_id)
+
+    async def events():
+        current = job
+        last_updated = -1.0
+        while True:
+            if current["updated_at"] > last_updated:
+                last_updated = current["updated_at"]
+                yield f"data: {json.dumps(video_job_status(request, current))}\n\n"
+                if current["status"] in VIDEO_JOB_TERMINAL:
+                    return
+            else:
+                yield ": keep-alive\n\n"
+            current = await video_job_poller.wait_for_change(job_id, last_updated, timeout=15.0)
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-store"})
 
 ### --- NEW: Aspect Ratio Helper ---
 def get_closest_aspect_ratio(width: int, height: int) -> str:
@@ -271,6 +2304,10 @@ class EblastRequest(BaseModel):
     prompt: Optional[str] = ""
     settings: Optional[Dict[str, Any]] = {}
     is_live: Optional[bool] = False
+    # Also return "reference", a handle for the result, so a refine loop can send it back instead of the image
+    return_reference: Optional[bool] = False
+    # Scheduling class for the upstream call; "refine all" style fan-outs send "bulk"
+    priority: Optional[Literal["interactive", "bulk"]] = None
 
 class AdvertorialRequest(BaseModel):
     brief: str
@@ -313,23 +2350,80 @@ Generate the advertorial content now. Return ONLY the JSON object."""
     url = f"{ENDPOINT}/openai/deployments/{VISION_DEPLOYMENT_NAME}/chat/completions?api-version={VISION_API_VERSION}"
     headers = {"Content-Type": "application/json", "api-key": API_KEY}
 
-    async with httpx.AsyncClient(timeout=60.0) as client:
-        try:
-            response = await client.post(url, headers=headers, json=payload)
-            if response.status_code == 200:
-                result = response.json()
-                content = result["choices"][0]["message"]["content"]
-                parsed = json.loads(content)
-                return {
-                    "header": parsed.get("header", ""),
-                    "body": parsed.get("body", "")
-                }
-            else:
-                raise HTTPException(status_code=response.status_code, detail=f"LLM Error: {response.text}")
-        except json.JSONDecodeError:
-            raise HTTPException(status_code=500, detail="Failed to parse LLM response as JSON")
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=str(e))
+    key = SingleFlight.make_key({**request.model_dump(), "brief": request.brief.strip()})
+    try:
+        response = await advertorial_flight.do(key, lambda: chat_completion(url, headers, payload))
+        if response.status_code == 200:
+            result = response.json()
+            content = result["choices"][0]["message"]["content"]
+            parsed = json.loads(content)
+            return {
+                "header": parsed.get("header", ""),
+                "body": parsed.get("body", "")
+            }
+        else:
+            raise HTTPException(status_code=response.status_code, detail=f"LLM Error: {response.text}")
+    except json.JSONDecodeError:
+        raise HTTPException(status_code=500, detail="Failed to parse LLM response as JSON")
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+EBLAST_DEFAULT_PROMPT = "Generate a professional retail eblast layout featuring these products. Use a clean, modern design."
+
+
+def eblast_content_config(s: Dict[str, Any]) -> types.GenerateContentConfig:
+    # Extract settings with defaults
+    chosen_aspect = s.get("aspectRatio", "9:16")
+    res = s.get("resolution", "1K").upper()
+    temp = float(s.get("temperature", 1.0))
+    top_p = float(s.get("top_p", 0.95))
+
+    safety = (s.get("safety_level") or "allow_all").lower()
+    threshold = "OFF" if safety == "allow_all" else "BLOCK_MEDIUM_AND_ABOVE" if safety == "allow_adults" else "BLOCK_LOW_AND_ABOVE"
+
+    return types.GenerateContentConfig(
+        temperature=temp,
+        top_p=top_p,
+        # Updated to include TEXT as the model requires it for multi-modal "reasoning"
+        response_modalities=["TEXT", "IMAGE"],
+        safety_settings=[types.SafetySetting(category=cat, threshold=threshold)
+                         for cat in ["HARM_CATEGORY_HATE_SPEECH", "HARM_CATEGORY_DANGEROUS_CONTENT",
+                                    "HARM_CATEGORY_SEXUALLY_EXPLICIT", "HARM_CATEGORY_HARASSMENT"]],
+        image_config=types.ImageConfig(aspect_ratio=chosen_aspect, image_size=res, output_mime_type="image/png"),
+    )
+
+
+async def run_eblast_generation(
+    image_parts: List[types.Part], prompt_text: str, settings: Dict[str, Any], priority: str = "interactive"
+) -> str:
+    """One Gemini eblast call. image_parts are shared, read-only, across calls; returns the first image as a data URL."""
+    client = get_upstream_clients().genai
+    # CORRECT SEQUENCE: Multiple Images FIRST, then Text Prompt (as per Nano Banana architectural patterns)
+    content_parts = [*image_parts, types.Part.from_text(text=prompt_text)]
+
+    # Async surface so concurrent eblast requests overlap instead of holding the event loop
+    async def attempt():
+        await admit("gemini_image", priority)
+        async with gemini_semaphore:
+            with observe_upstream("gemini_image", GOOGLE_IMAGE_MODEL):
+                return await client.aio.models.generate_content(
+                    model=GOOGLE_IMAGE_MODEL,
+                    contents=[types.Content(role="user", parts=content_parts)],
+                    config=eblast_content_config(settings),
+                )
+
+    response = await call_with_retry("gemini_image", attempt)
+
+    # Return the first generated layout
+    for part in response.candidates[0].content.parts:
+        if part.inline_data:
+            with span("encode"):
+                b64_img = base64.b64encode(part.inline_data.data).decode('utf-8')
+            return f"data:image/png;base64,{b64_img}"
+
+    raise HTTPException(status_code=500, detail="No image data returned from Gemini.")
 
 @app.post("/generate-eblast")
 async def generate_eblast(request: EblastRequest):
@@ -341,62 +2435,109 @@ async def generate_eblast(request: EblastRequest):
         raise HTTPException(status_code=500, detail="Google Cloud API Key not configured.")
 
     try:
-        client = genai.Client(vertexai=True, api_key=GOOGLE_CLOUD_API_KEY)
-        
-        # CORRECT SEQUENCE: Multiple Images FIRST, then Text Prompt
-        content_parts = []
-        
-        for img_data in request.images:
-            if img_data.startswith("data:image"):
-                try:
-                    header, encoded = img_data.split(",", 1)
-                    mime_type = header.split(";")[0].split(":")[1]
-                    content_parts.append(types.Part.from_bytes(data=base64.b64decode(encoded), mime_type=mime_type))
-                except Exception as e:
-                    print(f"Skipping malformed image: {e}")
-
-        # Append Text Instruction LAST (as per Nano Banana architectural patterns)
-        prompt_text = request.prompt or "Generate a professional retail eblast layout featuring these products. Use a clean, modern design."
-        content_parts.append(types.Part.from_text(text=prompt_text))
-
-        # Extract settings with defaults
-        s = request.settings
-        chosen_aspect = s.get("aspectRatio", "9:16")
-        res = s.get("resolution", "1K").upper()
-        temp = float(s.get("temperature", 1.0))
-        top_p = float(s.get("top_p", 0.95))
-        
-        safety = (s.get("safety_level") or "allow_all").lower()
-        threshold = "OFF" if safety == "allow_all" else "BLOCK_MEDIUM_AND_ABOVE" if safety == "allow_adults" else "BLOCK_LOW_AND_ABOVE"
-
-        generate_content_config = types.GenerateContentConfig(
-            temperature=temp,
-            top_p=top_p,
-            # Updated to include TEXT as the model requires it for multi-modal "reasoning"
-            response_modalities=["TEXT", "IMAGE"],
-            safety_settings=[types.SafetySetting(category=cat, threshold=threshold) 
-                             for cat in ["HARM_CATEGORY_HATE_SPEECH", "HARM_CATEGORY_DANGEROUS_CONTENT", 
-                                        "HARM_CATEGORY_SEXUALLY_EXPLICIT", "HARM_CATEGORY_HARASSMENT"]],
-            image_config=types.ImageConfig(aspect_ratio=chosen_aspect, image_size=res, output_mime_type="image/png"),
+        # Decoding several multi-MB data URLs is CPU work, keep it off the event loop
+        with span("decode"):
+            image_parts = await asyncio.to_thread(build_image_parts, request.images)
+        image = await run_eblast_generation(
+            image_parts, request.prompt or EBLAST_DEFAULT_PROMPT, request.settings, request.priority or "interactive"
         )
-
-        response = client.models.generate_content(
-            model=GOOGLE_IMAGE_MODEL,
-            contents=[types.Content(role="user", parts=content_parts)],
-            config=generate_content_config,
-        )
-
-        # Return the first generated layout
-        for part in response.candidates[0].content.parts:
-            if part.inline_data:
-                b64_img = base64.b64encode(part.inline_data.data).decode('utf-8')
-                return {"image": f"data:image/png;base64,{b64_img}"}
-        
-        raise HTTPException(status_code=500, detail="No image data returned from Gemini.")
-
+        if request.return_reference:
+            return {"image": image, "reference": (await asyncio.to_thread(store_result_references, [image]))[0]}
+        return {"image": image}
+
+    except HTTPException as e:
+        if e.status_code in (410, 429):
+            raise
+        raise HTTPException(status_code=500, detail=f"Gemini Eblast Error: {e.detail}")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Gemini Eblast Error: {str(e)}")
 
+# --- EBLAST BATCH ---
+# The compositor screens render several layouts (aspect ratios / prompt tweaks) from one set of product images.
+# The batch form takes the images once, decodes them once, and streams one NDJSON line per variant as it finishes.
+class EblastVariant(BaseModel):
+    variant_id: Optional[str] = None
+    aspectRatio: Optional[str] = None
+    prompt_suffix: Optional[str] = ""
+    count: int = Field(1, ge=1, le=8)
+    settings: Optional[Dict[str, Any]] = {}  # Overrides on top of the batch settings
+
+class EblastBatchRequest(BaseModel):
+    images: List[str]
+    prompt: Optional[str] = ""
+    settings: Optional[Dict[str, Any]] = {}
+    variants: List[EblastVariant]
+    is_live: Optional[bool] = False
+    return_references: Optional[bool] = False  # Adds "references" (one handle per image) to each variant line
+    # Scheduling class for the upstream calls; a batch fans out, so it defaults to "bulk"
+    priority: Optional[Literal["interactive", "bulk"]] = None
+
+@app.post("/generate-eblast-batch")
+async def generate_eblast_batch(request: EblastBatchRequest):
+    """Generates every variant from one upload of the images, streaming one NDJSON line per variant."""
+    if not request.variants:
+        raise HTTPException(status_code=400, detail="No variants provided")
+    if request.is_live and not GOOGLE_CLOUD_API_KEY:
+        raise HTTPException(status_code=500, detail="Google Cloud API Key not configured.")
+
+    with span("decode"):
+        image_parts = await asyncio.to_thread(build_image_parts, request.images) if request.is_live else []
+    base_prompt = request.prompt or EBLAST_DEFAULT_PROMPT
+
+    async def run_variant(index: int, variant: EblastVariant) -> Dict[str, Any]:
+        variant_id = variant.variant_id or str(index)
+        if not request.is_live:
+            return {"variant_id": variant_id, "images": ["/Eblast/Result Images/1.png"] * variant.count}
+
+        settings = {**(request.settings or {}), **(variant.settings or {})}
+        if variant.aspectRatio:
+            settings["aspectRatio"] = variant.aspectRatio
+        prompt_text = f"{base_prompt}{variant.prompt_suffix or ''}"
+        results = await asyncio.gather(
+            *[run_eblast_generation(image_parts, prompt_text, settings, request.priority or "bulk") for _ in range(variant.count)],
+            return_exceptions=True,
+        )
+        line = {"variant_id": variant_id, "images": [r for r in results if isinstance(r, str)]}
+        if request.return_references:
+            line["references"] = await asyncio.to_thread(store_result_references, line["images"])
+        errors = [e.detail if isinstance(e, HTTPException) else str(e) for e in results if not isinstance(e, str)]
+        if errors:
+            line["errors"] = errors
+        return line
+
+    async def stream():
+        tasks = [asyncio.create_task(run_variant(i, v)) for i, v in enumerate(request.variants)]
+        failed = 0
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                line = await next_done
+                if not line["images"]:
+                    failed += 1
+                yield json.dumps(line) + "\n"
+            yield json.dumps({"done": True, "total": len(tasks), "failed": failed}) + "\n"
+        finally:
+            # Client went away mid-stream: don't keep paying for variants nobody will see
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+def build_image_parts(images: List[str]) -> List[types.Part]:
+    """Decodes data URL images (or reference handles) into Gemini inline parts, skipping malformed entries."""
+    parts = []
+    for img_data in images:
+        if is_reference_handle(img_data):
+            data = read_reference(img_data)
+            parts.append(types.Part.from_bytes(data=data, mime_type=sniff_image_mime(data) or "image/png"))
+        elif img_data.startswith("data:image"):
+            try:
+                header, encoded = img_data.split(",", 1)
+                mime_type = header.split(";")[0].split(":")[1]
+                parts.append(types.Part.from_bytes(data=base64.b64decode(encoded), mime_type=mime_type))
+            except Exception as e:
+                print(f"Skipping malformed image: {e}")
+    return parts
+
 class ProjectSaveRequest(BaseModel):
     config: Dict[str, Any]
     rows: List[Any]
@@ -406,6 +2547,20 @@ class ProjectSaveRequest(BaseModel):
     designModel: str
     serverVersion: str
     customModels: List[Any]
+    projectId: Optional[str] = None  # POST /projects only: replace this project's snapshot instead of creating one
+
+class ProjectPatchRequest(BaseModel):
+    """Only what changed since baseRevision. A null cell or merge deletes it; rows are keyed by index."""
+    baseRevision: Optional[int] = None
+    cellData: Dict[str, Optional[Dict[str, Any]]] = {}
+    merges: Dict[str, Optional[Any]] = {}
+    rows: Dict[int, Any] = {}
+    rowCount: Optional[int] = Field(None, ge=0)
+    hiddenCells: Optional[List[str]] = None
+    config: Optional[Dict[str, Any]] = None
+    designModel: Optional[str] = None
+    serverVersion: Optional[str] = None
+    customModels: Optional[List[Any]] = None
 
 # -------------------------------
 # CAMPAIGN SCHEMA
@@ -430,54 +2585,465 @@ class CampaignRequest(BaseModel):
     previewUrl: Optional[str] = ""
     year: Optional[str] = None
 
-# --- CAMPAIGN ENDPOINTS ---
+# --- CAMPAIGN STORES ---
+# Two interchangeable backends behind the campaign endpoints:
+#   json   (default) one file per campaign in CAMPAIGN_SAVE_DIR, mirrored by an in-memory index
+#   sqlite a WAL-mode database with indexed filter/sort columns and transactional upserts
+CAMPAIGN_STORE = os.getenv("CAMPAIGN_STORE", "json").lower()
+CAMPAIGN_DB_PATH = os.getenv("CAMPAIGN_DB_PATH", os.path.join(REACT_PUBLIC_DIR, "campaigns.db"))
+CAMPAIGN_RESCAN_INTERVAL = float(os.getenv("CAMPAIGN_RESCAN_INTERVAL", "2"))
+CAMPAIGN_SORT_FIELDS = {
+    "name", "docketNumber", "strategicYear", "retailWeek", "banner", "status",
+    "startDate", "endDate", "created_at", "updated_at",
+}
 
-@app.post("/save-campaign")
-async def save_campaign(campaign: CampaignRequest):
+
+def campaign_safe_name(name: str) -> str:
+    return "".join(x for x in (name or "") if x.isalnum() or x in " -_")
+
+
+def encode_campaign_cursor(position) -> str:
+    return base64.urlsafe_b64encode(json.dumps(position).encode("utf-8")).decode("ascii")
+
+
+def decode_campaign_cursor(cursor: str):
     try:
-        os.makedirs(CAMPAIGN_SAVE_DIR, exist_ok=True)
-        safe_name = "".join(x for x in campaign.name if x.isalnum() or x in " -_")
-        file_path = os.path.join(CAMPAIGN_SAVE_DIR, f"{safe_name}.json")
-        data = campaign.model_dump()
-        if not data.get("strategicYear") and data.get("year") in ["2026", "2027", "2028"]:
-            data["strategicYear"] = data["year"]
-        data["updated_at"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        return json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+class CampaignQuery(BaseModel):
+    strategicYear: Optional[str] = None
+    retailWeek: Optional[int] = None
+    banner: Optional[str] = None
+    status: Optional[str] = None
+    channels: List[str] = []
+    sort_field: str = "name"
+    descending: bool = False
+    limit: Optional[int] = None
+    cursor: Optional[str] = None
+
+
+def campaign_sort_key(campaign: Dict[str, Any], field: str):
+    # (is-missing, type bucket, value) keeps mixed/missing values comparable
+    value = campaign.get(field)
+    if value is None or value == "":
+        return [1, 0, ""]
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return [0, 0, value]
+    return [0, 1, str(value).lower()]
+
+
+class CampaignIndex:
+    """JSON-file backend. Parsed files stay in memory; a listing re-stats the folder (at most every
+    CAMPAIGN_RESCAN_INTERVAL seconds) and only re-reads files whose mtime/size changed. The version is a hash
+    of the folder listing, so it survives restarts and agrees across workers."""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.version = ""
+        self._files: Dict[str, Any] = {}  # path -> (mtime_ns, size, campaign)
+        self._next_scan_at = 0.0
+        self._lock = threading.Lock()
+
+    def invalidate(self):
+        self._next_scan_at = 0.0
+
+    def refresh(self):
+        with self._lock:
+            now = datetime.now().timestamp()
+            if now < self._next_scan_at:
+                return
+            os.makedirs(self.directory, exist_ok=True)
+            seen = set()
+            changed = False
+            with os.scandir(self.directory) as entries:
+                for entry in entries:
+                    if not entry.name.lower().endswith(".json"):
+                        continue
+                    try:
+                        if not entry.is_file():
+                            continue
+                        st = entry.stat()
+                    except FileNotFoundError:
+                        continue  # Deleted while we were listing
+                    seen.add(entry.path)
+                    cached = self._files.get(entry.path)
+                    if cached and cached[0] == st.st_mtime_ns and cached[1] == st.st_size:
+                        continue
+                    try:
+                        with open(entry.path, "r", encoding="utf-8") as f:
+                            campaign = json.load(f)
+                    except Exception:
+                        campaign = None
+                    self._files[entry.path] = (st.st_mtime_ns, st.st_size, campaign)
+                    changed = True
+            for path in set(self._files) - seen:
+                del self._files[path]
+                changed = True
+            if changed or not self.version:
+                listing = sorted((os.path.basename(path), entry[0], entry[1]) for path, entry in self._files.items())
+                self.version = hashlib.sha256(json.dumps(listing).encode("utf-8")).hexdigest()[:16]
+            self._next_scan_at = now + CAMPAIGN_RESCAN_INTERVAL
+
+    def save(self, data: Dict[str, Any]) -> str:
+        os.makedirs(self.directory, exist_ok=True)
+        file_path = os.path.join(self.directory, f"{campaign_safe_name(data['name'])}.json")
         if os.path.exists(file_path):
             with open(file_path, "r", encoding="utf-8") as f:
                 existing = json.load(f)
                 data["created_at"] = existing.get("created_at", data["updated_at"])
         else:
             data["created_at"] = data["updated_at"]
-        with open(file_path, "w", encoding="utf-8") as f:
+        tmp_path = f"{file_path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
             json.dump(data, f, indent=2)
-        return {"message": "Campaign saved", "path": file_path}
+        os.replace(tmp_path, file_path)
+        self.invalidate()
+        return file_path
+
+    def delete(self, name: str) -> bool:
+        file_path = os.path.join(self.directory, f"{campaign_safe_name(name)}.json")
+        if not os.path.exists(file_path):
+            return False
+        os.remove(file_path)
+        self.invalidate()
+        return True
+
+    def current_version(self) -> str:
+        self.refresh()
+        return f"json-{self.version}"
+
+    def query(self, q: CampaignQuery) -> Dict[str, Any]:
+        self.refresh()
+        with self._lock:
+            campaigns = [entry[2] for entry in self._files.values() if isinstance(entry[2], dict)]
+
+        if q.strategicYear:
+            campaigns = [c for c in campaigns if str(c.get("strategicYear") or c.get("year") or "") == q.strategicYear]
+        if q.retailWeek is not None:
+            campaigns = [c for c in campaigns if c.get("retailWeek") == q.retailWeek]
+        if q.banner:
+            campaigns = [c for c in campaigns if str(c.get("banner") or "").lower() == q.banner.lower()]
+        if q.status:
+            campaigns = [c for c in campaigns if str(c.get("status") or "").lower() == q.status.lower()]
+        if q.channels:
+            wanted = {ch.lower() for ch in q.channels}
+            campaigns = [c for c in campaigns if wanted & {str(ch).lower() for ch in (c.get("channels") or [])}]
+
+        keyed = sorted(
+            ([campaign_sort_key(c, q.sort_field), str(c.get("name") or ""), c] for c in campaigns),
+            key=lambda item: (item[0], item[1]),
+            reverse=q.descending,
+        )
+        total = len(keyed)
+
+        # Keyset cursor: resume strictly after the last (sort value, name) seen, so inserts don't shift pages
+        if q.cursor:
+            after = decode_campaign_cursor(q.cursor)
+            keyed = [item for item in keyed if ((item[:2] < after) if q.descending else (item[:2] > after))]
+
+        next_cursor = None
+        if q.limit is not None and len(keyed) > q.limit:
+            keyed = keyed[:q.limit]
+            next_cursor = encode_campaign_cursor(keyed[-1][:2])
+        return {"campaigns": [item[2] for item in keyed], "total": total, "next_cursor": next_cursor}
+
+
+class SQLiteCampaignStore:
+    """SQLite (WAL) backend. Filter and sort columns are indexed together with the primary key, so a filtered,
+    sorted page is an index range scan and keyset pagination stays O(log n) as campaigns pile up."""
+
+    COLUMNS = ["docketNumber", "strategicYear", "retailWeek", "banner", "status", "startDate", "endDate", "created_at", "updated_at"]
+
+    def __init__(self, db_path: str, import_dir: Optional[str] = None):
+        self.db_path = db_path
+        self.import_dir = import_dir
+        self._local = threading.local()
+        self._init_lock = threading.Lock()
+        self._initialized = False
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        if not self._initialized:
+            self._initialize(conn)
+        return conn
+
+    def _initialize(self, conn: sqlite3.Connection):
+        with self._init_lock:
+            if self._initialized:
+                return
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS campaigns (
+                    name_key      TEXT PRIMARY KEY,
+                    name          TEXT NOT NULL,
+                    docketNumber  INTEGER NOT NULL DEFAULT 0,
+                    strategicYear TEXT NOT NULL DEFAULT '',
+                    retailWeek    INTEGER NOT NULL DEFAULT 0,
+                    banner        TEXT NOT NULL DEFAULT '' COLLATE NOCASE,
+                    status        TEXT NOT NULL DEFAULT '' COLLATE NOCASE,
+                    startDate     TEXT NOT NULL DEFAULT '',
+                    endDate       TEXT NOT NULL DEFAULT '',
+                    created_at    TEXT NOT NULL DEFAULT '',
+                    updated_at    TEXT NOT NULL DEFAULT '',
+                    data          TEXT NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS idx_campaigns_docket ON campaigns(docketNumber, name_key);
+                CREATE INDEX IF NOT EXISTS idx_campaigns_year ON campaigns(strategicYear, retailWeek, name_key);
+                CREATE INDEX IF NOT EXISTS idx_campaigns_week ON campaigns(retailWeek, name_key);
+                CREATE INDEX IF NOT EXISTS idx_campaigns_banner ON campaigns(banner, name_key);
+                CREATE INDEX IF NOT EXISTS idx_campaigns_updated ON campaigns(updated_at, name_key);
+                CREATE INDEX IF NOT EXISTS idx_campaigns_name ON campaigns(name COLLATE NOCASE, name_key);
+                CREATE TABLE IF NOT EXISTS campaign_channels (
+                    channel  TEXT NOT NULL COLLATE NOCASE,
+                    name_key TEXT NOT NULL REFERENCES campaigns(name_key) ON DELETE CASCADE,
+                    PRIMARY KEY (channel, name_key)
+                );
+                CREATE TABLE IF NOT EXISTS store_meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL);
+                INSERT OR IGNORE INTO store_meta (key, value) VALUES ('version', 0);
+            """)
+            empty = conn.execute("SELECT COUNT(*) FROM campaigns").fetchone()[0] == 0
+            imported = conn.execute("SELECT value FROM store_meta WHERE key = 'imported'").fetchone()
+            self._initialized = True
+            # One-shot import of the legacy JSON files the first time the database is created
+            if empty and imported is None and self.import_dir:
+                count = self.import_json_files(self.import_dir)
+                conn.execute("INSERT OR REPLACE INTO store_meta (key, value) VALUES ('imported', ?)", (count,))
+                logger.info("Imported %d campaigns from %s into %s", count, self.import_dir, self.db_path)
+
+    @staticmethod
+    def _row_values(data: Dict[str, Any]) -> Dict[str, Any]:
+        def as_int(value):
+            try:
+                return int(value)
+            except (TypeError, ValueError):
+                return 0
+        return {
+            "name_key": campaign_safe_name(data.get("name", "")),
+            "name": data.get("name", ""),
+            "docketNumber": as_int(data.get("docketNumber")),
+            "strategicYear": str(data.get("strategicYear") or data.get("year") or ""),
+            "retailWeek": as_int(data.get("retailWeek")),
+            "banner": data.get("banner") or "",
+            "status": data.get("status") or "",
+            "startDate": data.get("startDate") or "",
+            "endDate": data.get("endDate") or "",
+            "created_at": data.get("created_at") or "",
+            "updated_at": data.get("updated_at") or "",
+            "data": json.dumps(data),
+        }
+
+    def _upsert(self, conn: sqlite3.Connection, data: Dict[str, Any], keep_created_at: bool):
+        values = self._row_values(data)
+        columns = list(values)
+        updates = ", ".join(f"{col} = excluded.{col}" for col in columns if col not in ("name_key", "created_at"))
+        if not keep_created_at:
+            updates += ", created_at = excluded.created_at"
+        conn.execute(
+            f"INSERT INTO campaigns ({', '.join(columns)}) VALUES ({', '.join('?' for _ in columns)}) "
+            f"ON CONFLICT(name_key) DO UPDATE SET {updates}",
+            [values[col] for col in columns],
+        )
+        conn.execute("DELETE FROM campaign_channels WHERE name_key = ?", (values["name_key"],))
+        conn.executemany(
+            "INSERT OR IGNORE INTO campaign_channels (channel, name_key) VALUES (?, ?)",
+            [(str(ch), values["name_key"]) for ch in (data.get("channels") or [])],
+        )
+
+    def _bump_version(self, conn: sqlite3.Connection):
+        conn.execute("UPDATE store_meta SET value = value + 1 WHERE key = 'version'")
+
+    def save(self, data: Dict[str, Any]) -> str:
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # created_at survives re-saves inside the upsert itself: no read-then-write race
+            data["created_at"] = data["updated_at"]
+            self._upsert(conn, data, keep_created_at=True)
+            row = conn.execute(
+                "SELECT created_at FROM campaigns WHERE name_key = ?", (campaign_safe_name(data["name"]),)
+            ).fetchone()
+            if row and row["created_at"] != data["created_at"]:
+                data["created_at"] = row["created_at"]
+                conn.execute(
+                    "UPDATE campaigns SET data = ? WHERE name_key = ?", (json.dumps(data), campaign_safe_name(data["name"]))
+                )
+            self._bump_version(conn)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return f"{self.db_path}#{campaign_safe_name(data['name'])}"
+
+    def delete(self, name: str) -> bool:
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM campaign_channels WHERE name_key = ?", (campaign_safe_name(name),))
+            deleted = conn.execute("DELETE FROM campaigns WHERE name_key = ?", (campaign_safe_name(name),)).rowcount
+            if deleted:
+                self._bump_version(conn)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return bool(deleted)
+
+    def import_json_files(self, directory: str) -> int:
+        """Upserts every *.json campaign file in directory (keeping their created_at) in one transaction."""
+        conn = self._connect()
+        count = 0
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for fpath in glob.glob(os.path.join(directory, "*.json")):
+                try:
+                    with open(fpath, "r", encoding="utf-8") as f:
+                        data = json.load(f)
+                except Exception:
+                    continue
+                if isinstance(data, dict) and data.get("name"):
+                    self._upsert(conn, data, keep_created_at=False)
+                    count += 1
+            self._bump_version(conn)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return count
+
+    def current_version(self) -> str:
+        row = self._connect().execute("SELECT value FROM store_meta WHERE key = 'version'").fetchone()
+        return f"sqlite-{row[0]}"
+
+    def query(self, q: CampaignQuery) -> Dict[str, Any]:
+        conn = self._connect()
+        where, params = [], []
+        if q.strategicYear:
+            where.append("c.strategicYear = ?")
+            params.append(q.strategicYear)
+        if q.retailWeek is not None:
+            where.append("c.retailWeek = ?")
+            params.append(q.retailWeek)
+        if q.banner:
+            where.append("c.banner = ?")
+            params.append(q.banner)
+        if q.status:
+            where.append("c.status = ?")
+            params.append(q.status)
+        if q.channels:
+            where.append(
+                f"c.name_key IN (SELECT name_key FROM campaign_channels WHERE channel IN ({', '.join('?' for _ in q.channels)}))"
+            )
+            params.extend(q.channels)
+
+        total = conn.execute(
+            f"SELECT COUNT(*) FROM campaigns c {'WHERE ' + ' AND '.join(where) if where else ''}", params
+        ).fetchone()[0]
+
+        # Names compare case-insensitively, as in the JSON backend, so switching stores keeps the page order
+        sort_expr = "c.name COLLATE NOCASE" if q.sort_field == "name" else f"c.{q.sort_field}"
+        direction = "DESC" if q.descending else "ASC"
+        page_where, page_params = list(where), list(params)
+        if q.cursor:
+            after_value, after_key = decode_campaign_cursor(q.cursor)
+            page_where.append(f"({sort_expr}, c.name_key) {'<' if q.descending else '>'} (?, ?)")
+            page_params.extend([after_value, after_key])
+
+        sql = (
+            f"SELECT c.name_key, {sort_expr} AS sort_value, c.data FROM campaigns c "
+            f"{'WHERE ' + ' AND '.join(page_where) if page_where else ''} "
+            f"ORDER BY {sort_expr} {direction}, c.name_key {direction}"
+        )
+        if q.limit is not None:
+            sql += " LIMIT ?"
+            page_params.append(q.limit + 1)
+        rows = conn.execute(sql, page_params).fetchall()
+
+        next_cursor = None
+        if q.limit is not None and len(rows) > q.limit:
+            rows = rows[:q.limit]
+            next_cursor = encode_campaign_cursor([rows[-1]["sort_value"], rows[-1]["name_key"]])
+        return {"campaigns": [json.loads(row["data"]) for row in rows], "total": total, "next_cursor": next_cursor}
+
+
+if CAMPAIGN_STORE == "sqlite":
+    campaign_store = SQLiteCampaignStore(CAMPAIGN_DB_PATH, import_dir=CAMPAIGN_SAVE_DIR)
+else:
+    campaign_store = CampaignIndex(CAMPAIGN_SAVE_DIR)
+
+# --- CAMPAIGN ENDPOINTS ---
+
+@app.post("/save-campaign")
+async def save_campaign(campaign: CampaignRequest):
+    try:
+        data = campaign.model_dump()
+        if not data.get("strategicYear") and data.get("year") in ["2026", "2027", "2028"]:
+            data["strategicYear"] = data["year"]
+        data["updated_at"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        location = await asyncio.to_thread(campaign_store.save, data)
+        return {"message": "Campaign saved", "path": location}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/list-campaigns")
-async def list_campaigns():
+async def list_campaigns(
+    request: Request,
+    strategicYear: Optional[str] = None,
+    retailWeek: Optional[int] = None,
+    banner: Optional[str] = None,
+    status: Optional[str] = None,
+    channels: Optional[str] = Query(None, description="Comma-separated; matches campaigns with any of them"),
+    sort: str = Query("name", description="Field to sort by, prefix with '-' for descending"),
+    limit: Optional[int] = Query(None, ge=1, le=1000),
+    cursor: Optional[str] = None,
+):
+    sort_field = sort.lstrip("-")
+    if sort_field not in CAMPAIGN_SORT_FIELDS:
+        raise HTTPException(status_code=400, detail=f"Unsupported sort field: {sort_field}")
+    query = CampaignQuery(
+        strategicYear=strategicYear,
+        retailWeek=retailWeek,
+        banner=banner,
+        status=status,
+        channels=[ch.strip() for ch in (channels or "").split(",") if ch.strip()],
+        sort_field=sort_field,
+        descending=sort.startswith("-"),
+        limit=limit,
+        cursor=cursor,
+    )
+
     try:
-        os.makedirs(CAMPAIGN_SAVE_DIR, exist_ok=True)
-        files = glob.glob(os.path.join(CAMPAIGN_SAVE_DIR, "*.json"))
-        campaigns = []
-        for fpath in files:
-            try:
-                with open(fpath, "r", encoding="utf-8") as f:
-                    campaigns.append(json.load(f))
-            except Exception:
-                continue
-        return JSONResponse({"campaigns": campaigns}, headers={"Cache-Control": "no-store"})
+        version = await asyncio.to_thread(campaign_store.current_version)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    # Unchanged store + same query = same body; let the browser revalidate instead of re-downloading
+    etag = '"' + hashlib.sha256(f"{version}|{request.url.query}".encode("utf-8")).hexdigest()[:32] + '"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if is_not_modified(request, etag, None):
+        return Response(status_code=304, headers=headers)
+
+    try:
+        body = await asyncio.to_thread(campaign_store.query, query)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    return JSONResponse(body, headers=headers)
 
 @app.post("/delete-campaign")
 async def delete_campaign(payload: dict):
     try:
         name = payload.get("name")
-        safe_name = "".join(x for x in name if x.isalnum() or x in " -_")
-        file_path = os.path.join(CAMPAIGN_SAVE_DIR, f"{safe_name}.json")
-        if os.path.exists(file_path):
-            os.remove(file_path)
+        if await asyncio.to_thread(campaign_store.delete, name):
             return {"message": "Campaign deleted"}
         raise HTTPException(status_code=404, detail="Campaign not found")
     except Exception as e:
@@ -509,92 +3075,586 @@ async def open_folder(payload: dict):
 
 # --- IMAGE & PROJECT ENDPOINTS ---
 
+# --- IMAGE DERIVATIVES ---
+# Resized copies for tiles and previews, cached on disk by (source path, mtime, size, params).
+DERIVATIVE_CACHE_DIR = os.getenv("DERIVATIVE_CACHE_DIR", os.path.join(tempfile.gettempdir(), "sjc_derivatives"))
+DERIVATIVE_CACHE_MAX_BYTES = int(float(os.getenv("DERIVATIVE_CACHE_MAX_MB", "1024")) * 1024 * 1024)
+DERIVATIVE_MAX_CONCURRENCY = max(1, int(os.getenv("DERIVATIVE_MAX_CONCURRENCY", str(os.cpu_count() or 2))))
+DERIVATIVE_MAX_EDGE = 4096
+DERIVATIVE_FORMATS = {"jpeg": "image/jpeg", "png": "image/png", "webp": "image/webp"}
+
+derivative_cache = DiskLRUCache(DERIVATIVE_CACHE_DIR, DERIVATIVE_CACHE_MAX_BYTES, ".img")
+# Caps CPU when a grid asks for a page of thumbnails at once
+derivative_semaphore = asyncio.Semaphore(DERIVATIVE_MAX_CONCURRENCY)
+
+
+def render_derivative(path: str, w: Optional[int], h: Optional[int], fit: str, fmt: str) -> bytes:
+    with Image.open(path) as src:
+        if src.format == "JPEG":
+            src.draft("RGB", (w or DERIVATIVE_MAX_EDGE, h or DERIVATIVE_MAX_EDGE))
+        img = ImageOps.exif_transpose(src)
+        img = img.convert("RGBA" if fmt != "jpeg" and img.mode in ("RGBA", "LA", "PA", "P") else "RGB")
+
+        if w and h and fit == "cover":
+            img = ImageOps.fit(img, (w, h), Image.Resampling.LANCZOS)
+        elif w and h and fit == "fill":
+            img = img.resize((w, h), Image.Resampling.LANCZOS)
+        else:
+            # contain: fit inside the box, never upscale; a missing side is unconstrained
+            img.thumbnail((w or DERIVATIVE_MAX_EDGE, h or DERIVATIVE_MAX_EDGE), Image.Resampling.LANCZOS)
+
+        out = io.BytesIO()
+        if fmt == "jpeg":
+            img.save(out, format="JPEG", quality=82, optimize=True, progressive=True)
+        elif fmt == "webp":
+            img.save(out, format="WEBP", quality=80, method=4)
+        else:
+            img.save(out, format="PNG", compress_level=6)
+        return out.getvalue()
+
+
 @app.get("/get-local-image")
-async def get_local_image(path: str = Query(..., description="Absolute path to the image file")):
-    clean_path = path.strip().replace('"', '')
-    if not os.path.exists(clean_path):
-        raise HTTPException(status_code=404, detail="Image file not found")
-    return FileResponse(clean_path)
+async def get_local_image(
+    request: Request,
+    path: str = Query(..., description="Absolute path to the image file, or a path under the public folder"),
+    w: Optional[int] = Query(None, ge=1, le=DERIVATIVE_MAX_EDGE, description="Target width in pixels"),
+    h: Optional[int] = Query(None, ge=1, le=DERIVATIVE_MAX_EDGE, description="Target height in pixels"),
+    fit: Literal["contain", "cover", "fill"] = Query("contain"),
+    format: Optional[Literal["auto", "jpeg", "png", "webp"]] = Query(None, description="Output format; auto picks WebP when accepted"),
+):
+    # An explicit path: serve that file or 404, never a same-named file from another folder
+    clean_path = await resolve_asset_path(path, not_found_detail="Image file not found", by_basename=False)
+
+    # No derivative requested: the original, with validators so repeat views are a 304
+    if w is None and h is None and format is None:
+        return conditional_file_response(request, clean_path, "no-cache")
+
+    fmt = format or "auto"
+    vary = {}
+    if fmt == "auto":
+        fmt = "webp" if "image/webp" in request.headers.get("accept", "") else "png"
+        vary = {"Vary": "Accept"}
+
+    stat_result = os.stat(clean_path)
+    key_source = f"{os.path.abspath(clean_path)}|{stat_result.st_mtime_ns}|{stat_result.st_size}|{w}|{h}|{fit}|{fmt}"
+    key = hashlib.sha256(key_source.encode("utf-8")).hexdigest()
+    etag = f'"{key[:40]}"'
+    if is_not_modified(request, etag, stat_result.st_mtime):
+        return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "public, max-age=300", **vary})
+
+    cached_path = await asyncio.to_thread(derivative_cache.get_path, key)
+    if cached_path is None:
+        async with derivative_semaphore:
+            try:
+                data = await asyncio.to_thread(render_derivative, clean_path, w, h, fit, fmt)
+            except Exception as e:
+                raise HTTPException(status_code=415, detail=f"Cannot render image derivative: {str(e)}")
+            await asyncio.to_thread(derivative_cache.put_bytes, key, data)
+        cached_path = derivative_cache.path(key)
+
+    # Key covers the source mtime, so a short max-age plus ETag revalidation picks up edits to the original
+    return conditional_file_response(
+        request, cached_path, "public, max-age=300", media_type=DERIVATIVE_FORMATS[fmt], etag=etag, extra_headers=vary
+    )
+
+# --- PROJECT IMAGE BLOBS ---
+# Project images are stored once, named by their SHA-256, in a shared folder next to the saved projects.
+# Re-saving a grid only writes images that were never seen before; the project JSON points at the blob URLs.
+PROJECT_BLOB_DIR = os.getenv("PROJECT_BLOB_DIR", os.path.join(SAVE_BASE_DIR, "_blobs"))
+PROJECT_SAVE_WORKERS = max(1, int(os.getenv("PROJECT_SAVE_WORKERS", "4")))
+project_save_executor = ThreadPoolExecutor(max_workers=PROJECT_SAVE_WORKERS, thread_name_prefix="project-save")
+
+
+def public_url(abs_path: str) -> str:
+    """Converts absolute disk path to a relative URL path from the public folder."""
+    # Ensure path uses forward slashes for web compatibility
+    rel_to_public = os.path.relpath(abs_path, REACT_PUBLIC_DIR).replace("\\", "/")
+    return f"/{rel_to_public}"
+
+
+class ProjectBlobStore:
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def path(self, digest: str, extension: str) -> str:
+        # Two-level fan-out keeps any single folder small
+        return os.path.join(self.directory, digest[:2], f"{digest}{extension}")
+
+    @staticmethod
+    def extension_for(data: bytes, declared_mime: Optional[str] = None) -> str:
+        mime = sniff_image_mime(data) or declared_mime or "image/png"
+        return mimetypes.guess_extension(mime) or ".png"
+
+    def put_bytes(self, data: bytes, declared_mime: Optional[str] = None) -> Tuple[str, bool]:
+        """Stores data under its content hash. Returns (path, written) where written is False for a dedupe hit."""
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.path(digest, self.extension_for(data, declared_mime))
+        if os.path.exists(path):
+            return path, False
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write-then-rename so a concurrent save of the same image never sees a partial file
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        return path, True
+
+    def put_file(self, fileobj, declared_mime: Optional[str] = None, chunk_size: int = 1024 * 1024) -> Tuple[str, bool]:
+        """Streams a file-like object into the store, hashing chunk by chunk so memory stays at one chunk."""
+        os.makedirs(self.directory, exist_ok=True)
+        tmp_path = os.path.join(self.directory, f"upload-{uuid.uuid4().hex}.tmp")
+        digest = hashlib.sha256()
+        head = b""
+        try:
+            with open(tmp_path, "wb") as out:
+                while True:
+                    chunk = fileobj.read(chunk_size)
+                    if not chunk:
+                        break
+                    if len(head) < 16:
+                        head += chunk[:16]
+                    digest.update(chunk)
+                    out.write(chunk)
+            if not head:
+                raise ValueError("Empty image data")
+            path = self.path(digest.hexdigest(), self.extension_for(head, declared_mime))
+            if os.path.exists(path):
+                return path, False
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(tmp_path, path)
+            return path, True
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def put_data_url(self, data_url: str) -> Tuple[str, bool]:
+        return self.put_bytes(*decode_data_url(data_url))
+
+
+project_blob_store = ProjectBlobStore(PROJECT_BLOB_DIR)
+
+
+def project_image_refs(cell_data: Dict[str, Any]):
+    """Yields every image string in a grid's cellData: each cell's main image and its variations."""
+    for cell_content in cell_data.values():
+        if not isinstance(cell_content, dict):
+            continue
+        if isinstance(cell_content.get("image"), str) and cell_content["image"]:
+            yield cell_content["image"]
+        for var_img in cell_content.get("variations") or []:
+            if isinstance(var_img, str):
+                yield var_img
+
+
+def rewrite_project_images(cell_data: Dict[str, Any], resolve) -> Dict[str, Any]:
+    """Returns a copy of cellData with every image string passed through resolve(str) -> str."""
+    processed = {}
+    for cell_id, cell_content in cell_data.items():
+        if isinstance(cell_content, dict):
+            cell_content = dict(cell_content)
+            if isinstance(cell_content.get("image"), str) and cell_content["image"]:
+                cell_content["image"] = resolve(cell_content["image"])
+            if isinstance(cell_content.get("variations"), list):
+                cell_content["variations"] = [
+                    resolve(v) if isinstance(v, str) else v for v in cell_content["variations"]
+                ]
+        processed[cell_id] = cell_content
+    return processed
+
+
+async def store_project_data_urls(cell_data: Dict[str, Any]) -> Tuple[Dict[str, str], int]:
+    """Decodes and stores each distinct data URL on the worker pool. Returns ({data_url: blob_url}, new_blob_count)."""
+    loop = asyncio.get_running_loop()
+    unique = list(dict.fromkeys(ref for ref in project_image_refs(cell_data) if ref.startswith("data:image")))
+    results = await asyncio.gather(
+        *[loop.run_in_executor(project_save_executor, project_blob_store.put_data_url, ref) for ref in unique],
+        return_exceptions=True,
+    )
+    urls, written = {}, 0
+    for ref, result in zip(unique, results):
+        if isinstance(result, Exception):
+            continue  # Leave undecodable images inline, as before
+        urls[ref] = public_url(result[0])
+        written += int(result[1])
+    return urls, written
+
+
+def resolve_project_image(img_str: str, blob_urls: Dict[str, str]) -> str:
+    if img_str in blob_urls:
+        return blob_urls[img_str]
+    if os.path.isabs(img_str) and REACT_PUBLIC_DIR in img_str:
+        # Convert existing absolute paths to relative
+        return public_url(img_str)
+    return img_str
+
+
+def write_project_json(folder_name: str, final_json: Dict[str, Any]) -> str:
+    full_folder_path = os.path.join(SAVE_BASE_DIR, folder_name)
+    os.makedirs(full_folder_path, exist_ok=True)
+    json_path = os.path.join(full_folder_path, f"{folder_name}.json")
+    with open(json_path, "w", encoding="utf-8") as f:
+        json.dump(final_json, f, indent=2)
+    return json_path
+
+# --- PROJECT STORE ---
+# A project is a snapshot plus an append-only log of deltas. A PATCH appends one small line instead of rewriting
+# the whole grid; once the log grows past PROJECT_COMPACT_EVERY entries (or outweighs the snapshot) it is folded
+# back into a fresh snapshot. Recently used projects stay materialized in memory so loads don't replay the log.
+PROJECT_STORE_DIR = os.getenv("PROJECT_STORE_DIR", os.path.join(SAVE_BASE_DIR, "_projects"))
+PROJECT_COMPACT_EVERY = max(1, int(os.getenv("PROJECT_COMPACT_EVERY", "50")))
+PROJECT_STATE_CACHE_SIZE = max(1, int(os.getenv("PROJECT_STATE_CACHE_SIZE", "8")))
+PROJECT_SNAPSHOT_FIELDS = [
+    "config", "designModel", "serverVersion", "rows", "merges", "hiddenCells", "cellData", "customModels"
+]
+
+
+def apply_project_delta(state: Dict[str, Any], delta: Dict[str, Any]) -> Dict[str, Any]:
+    """Applies one ProjectPatchRequest-shaped delta to a materialized project in place."""
+    for cell_id, cell_content in (delta.get("cellData") or {}).items():
+        if cell_content is None:
+            state["cellData"].pop(cell_id, None)
+        else:
+            state["cellData"][cell_id] = cell_content
+    for merge_id, merge in (delta.get("merges") or {}).items():
+        if merge is None:
+            state["merges"].pop(merge_id, None)
+        else:
+            state["merges"][merge_id] = merge
+    rows = state["rows"]
+    if delta.get("rowCount") is not None:
+        del rows[delta["rowCount"]:]
+        rows.extend([None] * (delta["rowCount"] - len(rows)))
+    for index, row in (delta.get("rows") or {}).items():
+        index = int(index)
+        if index >= len(rows):
+            rows.extend([None] * (index + 1 - len(rows)))
+        rows[index] = row
+    for field in ("hiddenCells", "config", "designModel", "serverVersion", "customModels"):
+        if delta.get(field) is not None:
+            state[field] = delta[field]
+    return state
+
+
+class ProjectRevisionConflict(Exception):
+    pass
+
+
+class ProjectLock:
+    """A Lock that can be weakly referenced, so per-project locks go away once nobody holds them."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        self._lock.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self._lock.release()
+
+
+class ProjectStore:
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._states: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._log_stats: Dict[str, Dict[str, int]] = {}  # project_id -> {"entries", "bytes", "snapshot_bytes"}
+        self._locks: "weakref.WeakValueDictionary[str, ProjectLock]" = weakref.WeakValueDictionary()
+        self._guard = threading.Lock()
+
+    @staticmethod
+    def valid_id(project_id: str) -> bool:
+        return len(project_id) == 32 and all(ch in "0123456789abcdef" for ch in project_id)
+
+    def _lock(self, project_id: str) -> ProjectLock:
+        with self._guard:
+            lock = self._locks.get(project_id)
+            if lock is None:
+                lock = self._locks[project_id] = ProjectLock()
+            return lock
+
+    def _paths(self, project_id: str) -> Tuple[str, str]:
+        folder = os.path.join(self.directory, project_id)
+        return os.path.join(folder, "snapshot.json"), os.path.join(folder, "log.jsonl")
+
+    def _remember(self, project_id: str, state: Dict[str, Any]):
+        self._states[project_id] = state
+        self._states.move_to_end(project_id)
+        while len(self._states) > PROJECT_STATE_CACHE_SIZE:
+            self._states.popitem(last=False)
+
+    def _write_snapshot(self, project_id: str, state: Dict[str, Any]):
+        snapshot_path, log_path = self._paths(project_id)
+        os.makedirs(os.path.dirname(snapshot_path), exist_ok=True)
+        payload = json.dumps(state).encode("utf-8")
+        tmp_path = f"{snapshot_path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(payload)
+        os.replace(tmp_path, snapshot_path)
+        # The snapshot now covers every logged revision; entries at or below it are skipped on replay anyway
+        with open(log_path, "wb"):
+            pass
+        self._log_stats[project_id] = {"entries": 0, "bytes": 0, "snapshot_bytes": len(payload)}
+
+    def _materialize(self, project_id: str) -> Dict[str, Any]:
+        state = self._states.get(project_id)
+        if state is not None:
+            self._states.move_to_end(project_id)
+            return state
+        snapshot_path, log_path = self._paths(project_id)
+        if not os.path.exists(snapshot_path):
+            raise KeyError(project_id)
+        with open(snapshot_path, "r", encoding="utf-8") as f:
+            state = json.load(f)
+        entries = log_bytes = 0
+        if os.path.exists(log_path):
+            with open(log_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        break  # Torn final line from an interrupted append
+                    entries += 1
+                    log_bytes += len(line)
+                    if entry["revision"] > state["revision"]:
+                        apply_project_delta(state, entry["delta"])
+                        state["revision"] = entry["revision"]
+                        state["updated_at"] = entry["at"]
+        self._log_stats[project_id] = {
+            "entries": entries, "bytes": log_bytes, "snapshot_bytes": os.path.getsize(snapshot_path)
+        }
+        self._remember(project_id, state)
+        return state
+
+    def create_or_replace(self, project_id: Optional[str], snapshot: Dict[str, Any]) -> Dict[str, Any]:
+        project_id = project_id or uuid.uuid4().hex
+        with self._lock(project_id):
+            try:
+                revision = self._materialize(project_id)["revision"] + 1
+            except KeyError:
+                revision = 1
+            state = {
+                "projectId": project_id, "revision": revision, "updated_at": datetime.now().timestamp(), **snapshot
+            }
+            self._write_snapshot(project_id, state)
+            self._remember(project_id, state)
+            return state
+
+    def load(self, project_id: str) -> Dict[str, Any]:
+        with self._lock(project_id):
+            return json.loads(json.dumps(self._materialize(project_id)))
+
+    def peek_revision(self, project_id: str) -> Tuple[int, float]:
+        with self._lock(project_id):
+            state = self._materialize(project_id)
+            return state["revision"], state["updated_at"]
+
+    def append(self, project_id: str, delta: Dict[str, Any], base_revision: Optional[int]) -> int:
+        """Appends a delta and returns the new revision. Raises ProjectRevisionConflict on a stale base_revision."""
+        with self._lock(project_id):
+            state = self._materialize(project_id)
+            if base_revision is not None and base_revision != state["revision"]:
+                raise ProjectRevisionConflict(f"Project is at revision {state['revision']}, not {base_revision}")
+            revision = state["revision"] + 1
+            now = datetime.now().timestamp()
+            line = json.dumps({"revision": revision, "at": now, "delta": delta}) + "\n"
+            _, log_path = self._paths(project_id)
+            with open(log_path, "a", encoding="utf-8") as f:
+                f.write(line)
+            apply_project_delta(state, delta)
+            state["revision"] = revision
+            state["updated_at"] = now
+
+            stats = self._log_stats[project_id]
+            stats["entries"] += 1
+            stats["bytes"] += len(line)
+            if stats["entries"] >= PROJECT_COMPACT_EVERY or stats["bytes"] > stats["snapshot_bytes"]:
+                self._write_snapshot(project_id, state)
+            return revision
+
+
+project_store = ProjectStore(PROJECT_STORE_DIR)
+
+
+def project_snapshot(project: ProjectSaveRequest, cell_data: Dict[str, Any]) -> Dict[str, Any]:
+    snapshot = {field: getattr(project, field) for field in PROJECT_SNAPSHOT_FIELDS}
+    snapshot["cellData"] = cell_data
+    return snapshot
+
+
+def get_project_id(project_id: str) -> str:
+    if not ProjectStore.valid_id(project_id):
+        raise HTTPException(status_code=404, detail="Project not found")
+    return project_id
+
+@app.get("/projects/{project_id}")
+async def load_project(project_id: str, request: Request):
+    project_id = get_project_id(project_id)
+    try:
+        revision, updated_at = await asyncio.to_thread(project_store.peek_revision, project_id)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Project not found")
+    etag = f'"{project_id}-{revision}"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache", "Last-Modified": formatdate(updated_at, usegmt=True)}
+    if is_not_modified(request, etag, updated_at):
+        return Response(status_code=304, headers=headers)
+    state = await asyncio.to_thread(project_store.load, project_id)
+    return JSONResponse(state, headers=headers)
+
+@app.patch("/projects/{project_id}")
+async def patch_project(project_id: str, patch: ProjectPatchRequest):
+    project_id = get_project_id(project_id)
+    try:
+        delta = patch.model_dump(exclude_unset=True, exclude={"baseRevision"})
+        new_blobs = 0
+        if delta.get("cellData"):
+            live_cells = {k: v for k, v in delta["cellData"].items() if v is not None}
+            blob_urls, new_blobs = await store_project_data_urls(live_cells)
+            delta["cellData"] = {
+                **delta["cellData"],
+                **rewrite_project_images(live_cells, lambda img_str: resolve_project_image(img_str, blob_urls)),
+            }
+        revision = await asyncio.to_thread(project_store.append, project_id, delta, patch.baseRevision)
+        return {"projectId": project_id, "revision": revision, "new_images": new_blobs}
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Project not found")
+    except ProjectRevisionConflict as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+async def finish_project_save(project: "ProjectSaveRequest", blob_urls: Dict[str, str], new_blobs: int):
+    """Writes the timestamped export JSON. The server-side project store is only touched by /projects."""
+    timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+    folder_name = f"{project.designModel}_{project.serverVersion}_{timestamp}"
+    processed_cell_data = rewrite_project_images(
+        project.cellData, lambda img_str: resolve_project_image(img_str, blob_urls)
+    )
+
+    final_json = {
+        "version": 2,
+        "timestamp": timestamp,
+        "config": project.config,
+        "designModel": project.designModel,
+        "serverVersion": project.serverVersion,
+        "rows": project.rows,
+        "merges": project.merges,
+        "hiddenCells": project.hiddenCells,
+        "cellData": processed_cell_data,
+        "customModels": project.customModels
+    }
+
+    json_path = await asyncio.to_thread(write_project_json, folder_name, final_json)
+    return {
+        "message": "Project saved successfully",
+        "path": json_path,
+        "images": len(set(blob_urls.values())),
+        "new_images": new_blobs,
+    }
 
 @app.post("/save-project")
 async def save_project(project: ProjectSaveRequest):
     try:
-        timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-        folder_name = f"{project.designModel}_{project.serverVersion}_{timestamp}"
-        full_folder_path = os.path.join(SAVE_BASE_DIR, folder_name)
-        os.makedirs(full_folder_path, exist_ok=True)
-
-        image_counter = 1
-        processed_cell_data = project.cellData.copy()
-
-        def get_relative_url(abs_path):
-            """Converts absolute disk path to a relative URL path from the public folder."""
-            # Ensure path uses forward slashes for web compatibility
-            rel_to_public = os.path.relpath(abs_path, REACT_PUBLIC_DIR).replace("\\", "/")
-            return f"/{rel_to_public}"
-
-        for cell_id, cell_content in processed_cell_data.items():
-            # Handle Main Image
-            if "image" in cell_content and cell_content["image"]:
-                img_str = cell_content["image"]
-                if img_str.startswith("data:image"):
-                    try:
-                        header, encoded = img_str.split(",", 1)
-                        data = base64.b64decode(encoded)
-                        file_name = f"{image_counter}.png"
-                        file_path = os.path.join(full_folder_path, file_name)
-                        with open(file_path, "wb") as f:
-                            f.write(data)
-                        # Save as relative URL for the browser
-                        cell_content["image"] = get_relative_url(file_path)
-                        image_counter += 1
-                    except Exception:
-                        pass
-                elif os.path.isabs(img_str) and REACT_PUBLIC_DIR in img_str:
-                    # Convert existing absolute paths to relative
-                    cell_content["image"] = get_relative_url(img_str)
-
-            # Handle Variations
-            if "variations" in cell_content and isinstance(cell_content["variations"], list):
-                new_vars = []
-                for var_img in cell_content["variations"]:
-                    if var_img.startswith("data:image"):
-                        try:
-                            header, encoded = var_img.split(",", 1)
-                            data = base64.b64decode(encoded)
-                            file_name = f"{image_counter}.png"
-                            file_path = os.path.join(full_folder_path, file_name)
-                            with open(file_path, "wb") as f:
-                                f.write(data)
-                            new_vars.append(get_relative_url(file_path))
-                            image_counter += 1
-                        except Exception:
-                            new_vars.append(var_img)
-                    elif os.path.isabs(var_img) and REACT_PUBLIC_DIR in var_img:
-                        new_vars.append(get_relative_url(var_img))
-                    else:
-                        new_vars.append(var_img)
-                cell_content["variations"] = new_vars
-            processed_cell_data[cell_id] = cell_content
-
-        final_json = {
-            "version": 2,
-            "timestamp": timestamp,
-            "config": project.config,
-            "designModel": project.designModel,
-            "serverVersion": project.serverVersion,
-            "rows": project.rows,
-            "merges": project.merges,
-            "hiddenCells": project.hiddenCells,
-            "cellData": processed_cell_data,
-            "customModels": project.customModels
+        blob_urls, new_blobs = await store_project_data_urls(project.cellData)
+        return await finish_project_save(project, blob_urls, new_blobs)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+# Multipart variant: a "project" field with the same JSON as /save-project, plus one binary file part per image.
+# cellData refers to a part as "part:<field name>". Parts are spooled to disk by the form parser and streamed
+# into the blob store, so memory stays bounded regardless of grid size. Inline data URLs are still accepted.
+PROJECT_UPLOAD_MAX_PARTS = int(os.getenv("PROJECT_UPLOAD_MAX_PARTS", "2000"))
+PROJECT_UPLOAD_MAX_JSON_MB = float(os.getenv("PROJECT_UPLOAD_MAX_JSON_MB", "64"))
+PROJECT_PART_PREFIX = "part:"
+
+async def read_project_upload(request: Request) -> Tuple["ProjectSaveRequest", Dict[str, str], int]:
+    """Parses the multipart project form and stores every image part. Returns (project, blob urls by ref, new blobs)."""
+    try:
+        form = await request.form(
+            max_files=PROJECT_UPLOAD_MAX_PARTS,
+            max_fields=16,
+            max_part_size=int(PROJECT_UPLOAD_MAX_JSON_MB * 1024 * 1024),
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Invalid multipart body: {str(e)}")
+
+    try:
+        metadata = form.get("project")
+        if not isinstance(metadata, str):
+            raise HTTPException(status_code=400, detail="Missing 'project' JSON field")
+        try:
+            project = ProjectSaveRequest.model_validate_json(metadata)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=f"Invalid project JSON: {str(e)}")
+
+        parts = [(name, value) for name, value in form.multi_items() if not isinstance(value, str)]
+        loop = asyncio.get_running_loop()
+        results = await asyncio.gather(
+            *[
+                loop.run_in_executor(project_save_executor, project_blob_store.put_file, upload.file, upload.content_type)
+                for _, upload in parts
+            ],
+            return_exceptions=True,
+        )
+        blob_urls, new_blobs = {}, 0
+        for (name, _), result in zip(parts, results):
+            if isinstance(result, Exception):
+                raise HTTPException(status_code=400, detail=f"Could not store part '{name}': {str(result)}")
+            blob_urls[f"{PROJECT_PART_PREFIX}{name}"] = public_url(result[0])
+            new_blobs += int(result[1])
+
+        missing = {
+            ref for ref in project_image_refs(project.cellData)
+            if ref.startswith(PROJECT_PART_PREFIX) and ref not in blob_urls
         }
+        if missing:
+            raise HTTPException(status_code=400, detail=f"cellData references missing parts: {sorted(missing)[:5]}")
 
-        json_path = os.path.join(full_folder_path, f"{folder_name}.json")
-        with open(json_path, "w", encoding="utf-8") as f:
-            json.dump(final_json, f, indent=2)
+        inline_urls, inline_new = await store_project_data_urls(project.cellData)
+        blob_urls.update(inline_urls)
+        return project, blob_urls, new_blobs + inline_new
+    finally:
+        await form.close()
 
-        return {"message": "Project saved successfully", "path": json_path}
+@app.post("/save-project-multipart")
+async def save_project_multipart(request: Request):
+    try:
+        project, blob_urls, new_blobs = await read_project_upload(request)
+        return await finish_project_save(project, blob_urls, new_blobs)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/projects")
+async def create_project(request: Request):
+    """First save of a server-side project (same multipart form as /save-project-multipart). Later saves PATCH it.
+
+    With projectId set, the snapshot replaces that project wholesale (e.g. after a 409 on PATCH).
+    """
+    try:
+        project, blob_urls, new_blobs = await read_project_upload(request)
+        if project.projectId is not None and not ProjectStore.valid_id(project.projectId):
+            raise HTTPException(status_code=400, detail="Invalid projectId")
+        processed_cell_data = rewrite_project_images(
+            project.cellData, lambda img_str: resolve_project_image(img_str, blob_urls)
+        )
+        state = await asyncio.to_thread(
+            project_store.create_or_replace, project.projectId, project_snapshot(project, processed_cell_data)
+        )
+        return {
+            "projectId": state["projectId"],
+            "revision": state["revision"],
+            "images": len(set(blob_urls.values())),
+            "new_images": new_blobs,
+        }
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -620,6 +3680,8 @@ async def analyze_style(request: StyleAnalysisRequest):
     }]
 
     for b64_img in request.images:
+        if is_reference_handle(b64_img):
+            b64_img = await asyncio.to_thread(reference_data_url, b64_img)
         content_blocks.append({"type": "image_url", "image_url": {"url": b64_img}})
 
     payload = {
@@ -631,38 +3693,32 @@ async def analyze_style(request: StyleAnalysisRequest):
     url = f"{ENDPOINT}/openai/deployments/{VISION_DEPLOYMENT_NAME}/chat/completions?api-version={VISION_API_VERSION}"
     headers = {"Content-Type": "application/json", "api-key": API_KEY}
 
-    async with httpx.AsyncClient(timeout=60.0) as client:
-        try:
-            response = await client.post(url, headers=headers, json=payload)
-            if response.status_code == 200:
-                result = response.json()
-                return {"prompt": result["choices"][0]["message"]["content"]}
-            else:
-                raise HTTPException(status_code=response.status_code, detail=f"Vision API Error: {response.text}")
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=str(e))
+    key = SingleFlight.make_key({"images": request.images, "model_name": request.model_name.strip()})
+    try:
+        response = await style_flight.do(key, lambda: chat_completion(url, headers, payload))
+        if response.status_code == 200:
+            result = response.json()
+            return {"prompt": result["choices"][0]["message"]["content"]}
+        else:
+            raise HTTPException(status_code=response.status_code, detail=f"Vision API Error: {response.text}")
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
 
 ### --- MODIFIED handle_nano_banana ---
-async def handle_nano_banana(product: ProductRequest):
+async def handle_nano_banana(product: ProductRequest, source: "SourceImage"):
     """V2 > Nano Banana Architecture using Google Gemini 3 Pro Image with Dynamic Aspect Ratio"""
     if not GOOGLE_CLOUD_API_KEY:
         raise HTTPException(status_code=500, detail="Google Cloud API Key not configured.")
-    
-    clean_path = product.image_path.strip().replace('"', "")
-    if not os.path.exists(clean_path):
-        raise HTTPException(status_code=404, detail=f"Source image not found: {clean_path}")
 
     # Determine dynamic aspect ratio
     chosen_aspect = get_closest_aspect_ratio(product.width or 1024, product.height or 1024)
 
     try:
-        client = genai.Client(vertexai=True, api_key=GOOGLE_CLOUD_API_KEY)
-        
-        with open(clean_path, "rb") as img_file:
-            img_data = img_file.read()
-            mime_type = mimetypes.guess_type(clean_path)[0] or "image/jpeg"
-            image_part = types.Part.from_bytes(data=img_data, mime_type=mime_type)
+        client = get_upstream_clients().genai
 
+        img_data = source.data
 
         text_part = types.Part.from_text(text=product.custom_prompt)
 
@@ -683,6 +3739,10 @@ async def handle_nano_banana(product: ProductRequest):
         if resolution not in {"1K", "2K", "4K"}:
             resolution = "1K"
 
+        # Upload a metadata-free copy sized for the output tier instead of the raw file
+        prepared = await prepare_source_image(img_data, UPLOAD_MAX_EDGE[resolution])
+        image_part = types.Part.from_bytes(data=prepared.data, mime_type=prepared.mime_type)
+
         safety_level = (product.safety_level or "allow_all").lower()
         if safety_level == "block_all":
             threshold = "BLOCK_LOW_AND_ABOVE"
@@ -709,24 +3769,83 @@ async def handle_nano_banana(product: ProductRequest):
         )
 
 
-        generated_images = []
-        for _ in range(product.n or 1):
-            response = client.models.generate_content(
-                model=GOOGLE_IMAGE_MODEL,
-                contents=[types.Content(role="user", parts=[image_part, text_part])],
-                config=generate_content_config,
-            )
-            for part in response.candidates[0].content.parts:
-                if part.inline_data:
-                    b64_img = base64.b64encode(part.inline_data.data).decode('utf-8')
-                    generated_images.append(f"data:image/png;base64,{b64_img}")
+        # Fan the variations out concurrently: bounded per request and by the process-wide Gemini cap
+        variation_count = max(1, product.n or 1)
+        request_slots = asyncio.Semaphore(min(variation_count, NANO_BANANA_VARIATION_CONCURRENCY))
+
+        cache_params = {
+            "engine": "v2",
+            "model": GOOGLE_IMAGE_MODEL,
+            "prompt": product.custom_prompt,
+            "aspect_ratio": chosen_aspect,
+            "resolution": resolution,
+            "temperature": temperature,
+            "top_p": top_p,
+            "threshold": threshold,
+        }
+
+        # Sampling is non-deterministic, so each variation index is its own cache entry
+        async def generate_variation(index: int) -> List[str]:
+            cache_key = GenerationCache.make_key(img_data, cache_params, index)
+            if product.use_cache:
+                with span("cache"):
+                    cached = await asyncio.to_thread(generation_cache.get, cache_key)
+                if cached:
+                    return cached
+
+            async def attempt():
+                await admit("gemini_image", product.priority)
+                async with gemini_semaphore:
+                    with observe_upstream("gemini_image", GOOGLE_IMAGE_MODEL):
+                        return await client.aio.models.generate_content(
+                            model=GOOGLE_IMAGE_MODEL,
+                            contents=[types.Content(role="user", parts=[image_part, text_part])],
+                            config=generate_content_config,
+                        )
+
+            async with request_slots:
+                response = await call_with_retry("gemini_image", attempt)
+            images = []
+            with span("encode"):
+                for part in response.candidates[0].content.parts:
+                    if part.inline_data:
+                        b64_img = base64.b64encode(part.inline_data.data).decode('utf-8')
+                        images.append(f"data:image/png;base64,{b64_img}")
+            if product.use_cache:
+                await asyncio.to_thread(generation_cache.put, cache_key, images)
+            return images
+
+        results = await asyncio.gather(
+            *[generate_variation(i) for i in range(variation_count)],
+            return_exceptions=True,
+        )
 
-        return {"images": generated_images}
+        generated_images = []
+        errors = []
+        for result in results:
+            if isinstance(result, Exception):
+                errors.append(str(result))
+            else:
+                generated_images.extend(result)
+
+        # Only fail the whole request when every variation failed; otherwise return what we have
+        if errors and not generated_images:
+            first_error = next(r for r in results if isinstance(r, Exception))
+            if isinstance(first_error, HTTPException) and first_error.status_code == 429:
+                raise first_error  # Keep Retry-After so the client can back off
+            raise HTTPException(status_code=500, detail=f"Gemini Engine Error: {errors[0]}")
+
+        response_body = {"images": generated_images}
+        if errors:
+            response_body["errors"] = errors
+        return response_body
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Gemini Engine Error: {str(e)}")
 
 
-async def handle_gpt_image1_request(product: ProductRequest, clean_path: str, mask_path: Optional[str] = None):
+async def handle_gpt_image1_request(product: ProductRequest, source: "SourceImage", mask_path: Optional[str] = None):
     if not product.custom_prompt:
         raise HTTPException(status_code=400, detail="Prompt missing.")
 
@@ -761,23 +3880,59 @@ async def handle_gpt_image1_request(product: ProductRequest, clean_path: str, ma
     }
 
 
-    async with httpx.AsyncClient(timeout=120.0) as client:
-        with open(clean_path, "rb") as img_file:
-            files = {"image[]": (os.path.basename(clean_path), img_file, "image/jpeg")}
-            if mask_path:
-                with open(mask_path, "rb") as m_file:
-                    files["mask"] = (os.path.basename(mask_path), m_file, "image/png")
-                    resp = await client.post(edit_url, headers=headers, data=data, files=files)
-            else:
-                resp = await client.post(edit_url, headers=headers, data=data, files=files)
+    img_bytes = source.data
+    with span("read"):
+        mask_bytes = await asyncio.to_thread(Path(mask_path).read_bytes) if mask_path else b""
+    # images/edits tops out at 1536px, anything larger is wasted upload
+    prepared = await prepare_source_image(img_bytes, 1536)
+
+    # Each image is cached under its index, without n, so an n=1 request reuses image 0 of an earlier n=4 run
+    # and a partial hit only asks upstream for the missing ones
+    cache_params = {key: value for key, value in data.items() if key != "n"}
+    cache_params.update(engine="v1", mask=hashlib.sha256(mask_bytes).hexdigest() if mask_bytes else None)
+    cache_keys = [GenerationCache.make_key(img_bytes, cache_params, i) for i in range(int(product.n or 1))]
+    cached: List[Optional[List[str]]] = [None] * len(cache_keys)
+    if product.use_cache:
+        with span("cache"):
+            cached = [await asyncio.to_thread(generation_cache.get, key) for key in cache_keys]
+        if all(cached):
+            return {"images": [img for entry in cached for img in entry]}
+    missing = [i for i, entry in enumerate(cached) if not entry]
+    data["n"] = str(len(missing))
+
+    client = get_upstream_clients().azure
+    upload_name = f"{source.name}.{prepared.extension}"
+    files = {"image[]": (upload_name, prepared.data, prepared.mime_type)}
+    if mask_path:
+        mask_upload = await asyncio.to_thread(resize_mask, mask_bytes, prepared.width, prepared.height)
+        files["mask"] = (os.path.basename(mask_path), mask_upload, "image/png")
+    async def attempt():
+        await admit("azure_image", product.priority)
+        with observe_upstream("azure_image", DEPLOYMENT_NAME) as call:
+            return call.set_response(await client.post(edit_url, headers=headers, data=data, files=files, timeout=120.0))
+
+    resp = await call_with_retry("azure_image", attempt)
 
     if resp.status_code != 200:
         raise HTTPException(status_code=resp.status_code, detail=resp.text)
-    result = resp.json()
-    images = [f"data:image/png;base64,{item['b64_json']}" for item in result.get("data", [])]
-    return {"images": images}
+    with span("parse"):
+        result = resp.json()
+    fresh = [f"data:image/png;base64,{item['b64_json']}" for item in result.get("data", [])]
+    for index, image in zip(missing, fresh):
+        cached[index] = [image]
+        if product.use_cache:
+            await asyncio.to_thread(generation_cache.put, cache_keys[index], [image])
+    return {"images": [img for entry in cached if entry for img in entry]}
 
 
 if __name__ == "__main__":
+    import sys
+
+    # python app.py import-campaigns  -> (re)load public/Campaigns/*.json into the SQLite store and exit
+    if len(sys.argv) > 1 and sys.argv[1] == "import-campaigns":
+        store = SQLiteCampaignStore(CAMPAIGN_DB_PATH)
+        print(f"Imported {store.import_json_files(CAMPAIGN_SAVE_DIR)} campaigns into {CAMPAIGN_DB_PATH}")
+        sys.exit(0)
+
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=5001)
\ No newline at end of file
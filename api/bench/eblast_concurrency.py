@@ -0,0 +1,86 @@
+"""
+Concurrency check for /generate-eblast with a stubbed Gemini client.
+
+Fires one request, then N concurrent requests, against the ASGI app in-process.
+With the async generation path the concurrent batch should finish in roughly
+the time of a single call instead of N times that.
+
+Usage (from the api folder):
+    python bench/eblast_concurrency.py --concurrency 9 --delay 2.0
+"""
+import argparse
+import asyncio
+import base64
+import os
+import sys
+import time
+from types import SimpleNamespace
+
+os.environ.setdefault("AZURE_OPENAI_API_KEY", "bench")
+os.environ.setdefault("GOOGLE_CLOUD_API_KEY", "bench")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx  # noqa: E402
+
+import app as backend  # noqa: E402
+
+# 1x1 transparent PNG
+TINY_PNG = base64.b64decode(
+    "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAQAAAC1HAwCAAAAC0lEQVR42mNkYAAAAAYAAjCB0C8AAAAASUVORK5CYII="
+)
+
+
+class StubModels:
+    def __init__(self, delay: float):
+        self.delay = delay
+
+    async def generate_content(self, model, contents, config):
+        await asyncio.sleep(self.delay)
+        part = SimpleNamespace(inline_data=SimpleNamespace(data=TINY_PNG, mime_type="image/png"))
+        return SimpleNamespace(candidates=[SimpleNamespace(content=SimpleNamespace(parts=[part]))])
+
+
+def install_stub(delay: float):
+    class StubClient:
+        def __init__(self, *args, **kwargs):
+            self.aio = SimpleNamespace(models=StubModels(delay))
+
+    backend.genai.Client = StubClient
+
+
+async def run_batch(client: httpx.AsyncClient, count: int) -> float:
+    payload = {
+        "images": [f"data:image/png;base64,{base64.b64encode(TINY_PNG).decode()}"],
+        "prompt": "bench",
+        "settings": {"aspectRatio": "9:16", "resolution": "1K"},
+        "is_live": True,
+    }
+    start = time.perf_counter()
+    responses = await asyncio.gather(*[client.post("/generate-eblast", json=payload) for _ in range(count)])
+    elapsed = time.perf_counter() - start
+    failed = [r.status_code for r in responses if r.status_code != 200]
+    if failed:
+        raise SystemExit(f"Requests failed: {failed}")
+    return elapsed
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, default=9)
+    parser.add_argument("--delay", type=float, default=2.0, help="Stubbed upstream latency in seconds")
+    args = parser.parse_args()
+
+    install_stub(args.delay)
+    transport = httpx.ASGITransport(app=backend.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        await run_batch(client, 1)  # warm-up: creates the shared upstream clients
+        single = await run_batch(client, 1)
+        batch = await run_batch(client, args.concurrency)
+
+    print(f"single request       : {single:.2f}s")
+    print(f"{args.concurrency} concurrent requests: {batch:.2f}s")
+    print(f"overlap ratio        : {batch / single:.2f}x (1.0 = perfect overlap, {args.concurrency}.0 = serialized)")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,321 @@
+"""
+End-to-end benchmark of the API against local upstream stubs (bench/stub_upstreams.py).
+
+Starts the stub server and the API (uvicorn, separate processes) with every data directory pointed at a scratch
+folder, then drives each scenario at the given concurrency levels. For every (scenario, concurrency) it reports
+throughput, latency percentiles, error counts and the API process's peak RSS during that run.
+
+Scenarios:
+    card      POST /generate-card with a file in public/Image (engine from --engine, cache off)
+    eblast    POST /generate-eblast with one data URL
+    video     POST /generate-video with wait=true (launch + poller until the stub reports done)
+    save      POST /save-project with --project-images data URL cells
+    campaigns GET /list-campaigns?limit=50 over --campaigns seeded campaigns
+
+Usage (from the api folder):
+    python bench/run_benchmarks.py --concurrency 1,8,32 --requests 64 --gemini-latency 2
+    python bench/run_benchmarks.py --scenarios save,campaigns --concurrency 16 --json results.json
+"""
+import argparse
+import asyncio
+import base64
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+from stub_upstreams import add_stub_arguments, noise_png
+
+API_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCENARIOS = ("card", "eblast", "video", "save", "campaigns")
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))] if ordered else 0.0
+
+
+def read_rss_kb(pid: int):
+    """Current RSS of pid in KB (Linux /proc, else psutil when installed, else None)."""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    try:
+        import psutil
+        return psutil.Process(pid).memory_info().rss // 1024
+    except Exception:
+        return None
+
+
+class RssSampler:
+    """Polls a process's RSS in the background and keeps the peak seen since reset()."""
+
+    def __init__(self, pid: int, interval: float = 0.05):
+        self.pid = pid
+        self.interval = interval
+        self.peak_kb = 0
+        self._task = None
+
+    def reset(self):
+        self.peak_kb = read_rss_kb(self.pid) or 0
+
+    async def _run(self):
+        while True:
+            self.peak_kb = max(self.peak_kb, read_rss_kb(self.pid) or 0)
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+
+
+def wait_for_http(url: str, proc: subprocess.Popen, timeout: float = 60.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise SystemExit(f"Process exited early with code {proc.returncode}: {' '.join(proc.args)}")
+        try:
+            httpx.get(url, timeout=1.0)
+            return
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    raise SystemExit(f"Timed out waiting for {url}")
+
+
+def api_environment(args, work_dir: str) -> dict:
+    stub = f"http://127.0.0.1:{args.stub_port}"
+    public = os.path.join(work_dir, "public")
+    env = dict(os.environ)
+    env.update({
+        "AZURE_OPENAI_API_KEY": "bench",
+        "AZURE_OPENAI_ENDPOINT": f"{stub}/azure",
+        "AZURE_OPENAI_DEPLOYMENT_NAME": "gpt-image-1",
+        "AZURE_OPENAI_API_VERSION": "2025-04-01-preview",
+        "VISION_DEPLOYMENT_NAME": "gpt-4o",
+        "VISION_API_VERSION": "2024-08-01-preview",
+        "GOOGLE_CLOUD_API_KEY": "bench",
+        "GEMINI_API_BASE": f"{stub}/gemini",
+        "VEO_API_BASE": f"{stub}/veo/v1",
+        "REACT_PUBLIC_DIR": work_dir,
+        "SAVE_BASE_DIR": os.path.join(public, "All AI Jsons"),
+        "CAMPAIGN_SAVE_DIR": os.path.join(public, "Campaigns"),
+        "CAMPAIGN_DB_PATH": os.path.join(work_dir, "campaigns.db"),
+        "GENERATION_CACHE_DIR": os.path.join(work_dir, "generation_cache"),
+        "DERIVATIVE_CACHE_DIR": os.path.join(work_dir, "derivative_cache"),
+        "REFERENCE_DIR": os.path.join(work_dir, "references"),
+        "VIDEO_JOB_DIR": os.path.join(work_dir, "video_jobs"),
+        "VIDEO_OUTPUT_DIR": os.path.join(public, "Video", "Generated"),
+        "VIDEO_POLL_MIN_INTERVAL": "0.2",
+        "VIDEO_POLL_MAX_INTERVAL": "1",
+        "TRACE_LOG_PATH": os.path.join(work_dir, "_traces", "trace.jsonl"),
+    })
+    if not args.keep_limits:
+        # Measure the backend, not the production rate limits
+        for provider in ("GEMINI_IMAGE", "VEO", "AZURE_IMAGE", "AZURE_CHAT"):
+            env[f"{provider}_RATE_PER_MIN"] = "1000000"
+            env[f"{provider}_BURST"] = "100000"
+    return env
+
+
+def prepare_work_dir(work_dir: str, source_png: bytes):
+    image_dir = os.path.join(work_dir, "public", "Image")
+    os.makedirs(image_dir, exist_ok=True)
+    with open(os.path.join(image_dir, "bench_source.png"), "wb") as f:
+        f.write(source_png)
+
+
+def scenario_request(name: str, args, source_data_url: str, project_cells: dict):
+    """Returns a coroutine factory issuing one request of the scenario."""
+    if name == "card":
+        payload = {
+            "image_path": "/Image/bench_source.png", "product_name": "Bench Product", "price": "9.99",
+            "server_version": args.engine, "n": args.variations, "use_cache": False,
+            "custom_prompt": "Place the product on a clean retail flyer card.",  # required by the v1 engine
+        }
+        return lambda client: client.post("/generate-card", json=payload)
+    if name == "eblast":
+        payload = {
+            "images": [source_data_url], "prompt": "bench", "is_live": True,
+            "settings": {"aspectRatio": "9:16", "resolution": "1K"},
+        }
+        return lambda client: client.post("/generate-eblast", json=payload)
+    if name == "video":
+        payload = {"image_path": "/Image/bench_source.png", "prompt": "bench", "resolution": "720p", "wait": True}
+        return lambda client: client.post("/generate-video", json=payload)
+    if name == "save":
+        payload = {
+            "config": {"rows": 4, "cols": 4}, "rows": [], "merges": {}, "hiddenCells": [],
+            "cellData": project_cells, "designModel": "bench", "serverVersion": "v2", "customModels": [],
+        }
+        return lambda client: client.post("/save-project", json=payload)
+    if name == "campaigns":
+        return lambda client: client.get("/list-campaigns", params={"limit": 50, "sort": "-retailWeek"})
+    raise ValueError(name)
+
+
+async def seed_campaigns(client: httpx.AsyncClient, count: int):
+    for i in range(count):
+        resp = await client.post("/save-campaign", json={
+            "name": f"Bench Campaign {i:05d}", "docketNumber": i, "strategicYear": "2026",
+            "retailWeek": i % 52 + 1, "banner": ("Metro", "Food Basics")[i % 2],
+            "channels": ["Flyer", "Eblast", "Social"][: i % 3 + 1], "status": "Planning",
+        })
+        resp.raise_for_status()
+
+
+async def run_level(client, request, total: int, concurrency: int, sampler: RssSampler):
+    latencies, statuses = [], {}
+    queue = iter(range(total))
+
+    async def worker():
+        for _ in queue:
+            started = time.perf_counter()
+            try:
+                resp = await request(client)
+                status = resp.status_code
+            except httpx.HTTPError as e:
+                status = type(e).__name__
+            latencies.append(time.perf_counter() - started)
+            statuses[status] = statuses.get(status, 0) + 1
+
+    sampler.reset()
+    started = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    elapsed = time.perf_counter() - started
+    ok = statuses.get(200, 0) + statuses.get(202, 0)
+    return {
+        "requests": total,
+        "ok": ok,
+        "errors": {str(k): v for k, v in statuses.items() if k not in (200, 202)},
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(ok / elapsed, 2) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 1),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 1),
+        "max_ms": round(max(latencies) * 1000, 1),
+        "peak_rss_mb": round(sampler.peak_kb / 1024, 1),
+    }
+
+
+def print_table(results):
+    header = f"{'scenario':<10}{'conc':>6}{'reqs':>6}{'ok':>6}{'req/s':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}{'rss MB':>9}  errors"
+    print("\n" + header)
+    print("-" * len(header))
+    for r in results:
+        errors = ", ".join(f"{k}x{v}" for k, v in r["errors"].items()) or "-"
+        print(f"{r['scenario']:<10}{r['concurrency']:>6}{r['requests']:>6}{r['ok']:>6}{r['throughput_rps']:>9.2f}"
+              f"{r['p50_ms']:>10.1f}{r['p95_ms']:>10.1f}{r['p99_ms']:>10.1f}{r['max_ms']:>10.1f}{r['peak_rss_mb']:>9.1f}  {errors}")
+
+
+async def run(args, api_pid: int, source_png: bytes):
+    source_data_url = f"data:image/png;base64,{base64.b64encode(source_png).decode('ascii')}"
+    # Distinct images per cell, the same set on every save (so repeat saves also show blob dedupe)
+    project_cells = {
+        f"{row}-{col}": {"image": f"data:image/png;base64,{base64.b64encode(noise_png(args.project_image_kb)).decode('ascii')}"}
+        for row, col in ((i // 4, i % 4) for i in range(args.project_images))
+    }
+    limits = httpx.Limits(max_connections=max(args.concurrency) + 10, max_keepalive_connections=max(args.concurrency) + 10)
+    sampler = RssSampler(api_pid)
+    sampler.start()
+    results = []
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{args.api_port}", timeout=args.timeout, limits=limits) as client:
+        if "campaigns" in args.scenarios:
+            await seed_campaigns(client, args.campaigns)
+        for name in args.scenarios:
+            request = scenario_request(name, args, source_data_url, project_cells)
+            await request(client)  # warm-up: upstream pools, asset index, caches
+            for concurrency in args.concurrency:
+                total = max(args.requests, concurrency)
+                result = await run_level(client, request, total, concurrency, sampler)
+                results.append({"scenario": name, "concurrency": concurrency, **result})
+                print(f"{name:<10} c={concurrency:<4} {result['throughput_rps']:.2f} req/s  p95 {result['p95_ms']:.0f} ms")
+        stub_stats = httpx.get(f"http://127.0.0.1:{args.stub_port}/stats").json()
+    await sampler.stop()
+    return results, stub_stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help=f"Comma-separated subset of {','.join(SCENARIOS)}")
+    parser.add_argument("--concurrency", default="1,8,32", help="Comma-separated concurrency levels")
+    parser.add_argument("--requests", type=int, default=32, help="Requests per level (at least the concurrency)")
+    parser.add_argument("--engine", choices=("v1", "v2"), default="v2", help="Card engine for the card scenario")
+    parser.add_argument("--variations", type=int, default=1, help="n for the card scenario")
+    parser.add_argument("--source-kb", type=int, default=800, help="Size of the source image")
+    parser.add_argument("--project-images", type=int, default=16, help="Image cells per saved project")
+    parser.add_argument("--project-image-kb", type=int, default=300)
+    parser.add_argument("--campaigns", type=int, default=500, help="Campaigns seeded before the campaigns scenario")
+    parser.add_argument("--api-port", type=int, default=5101)
+    parser.add_argument("--stub-port", type=int, default=9100)
+    parser.add_argument("--api-workers", type=int, default=1)
+    parser.add_argument("--timeout", type=float, default=600.0, help="Per-request client timeout in seconds")
+    parser.add_argument("--keep-limits", action="store_true", help="Keep the production admission rates")
+    parser.add_argument("--work-dir", help="Scratch folder (default: a temp dir, removed afterwards)")
+    parser.add_argument("--json", help="Also write the results to this file")
+    add_stub_arguments(parser)
+    args = parser.parse_args()
+    args.scenarios = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+    args.concurrency = [int(c) for c in args.concurrency.split(",")]
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="cf_bench_")
+    source_png = noise_png(args.source_kb)
+    prepare_work_dir(work_dir, source_png)
+
+    stub_args = [
+        sys.executable, os.path.join(API_DIR, "bench", "stub_upstreams.py"), "--port", str(args.stub_port),
+        "--chat-latency", str(args.chat_latency), "--edit-latency", str(args.edit_latency),
+        "--gemini-latency", str(args.gemini_latency), "--veo-latency", str(args.veo_latency),
+        "--poll-latency", str(args.poll_latency), "--veo-polls", str(args.veo_polls), "--jitter", str(args.jitter),
+        "--image-kb", str(args.image_kb), "--video-kb", str(args.video_kb), "--chat-chars", str(args.chat_chars),
+        "--error-rate", str(args.error_rate), "--error-status", str(args.error_status),
+    ]
+    api_args = [
+        sys.executable, "-m", "uvicorn", "app:app", "--host", "127.0.0.1", "--port", str(args.api_port),
+        "--workers", str(args.api_workers), "--log-level", "warning", "--no-access-log",
+    ]
+    stub_proc = subprocess.Popen(stub_args)
+    api_proc = None
+    try:
+        wait_for_http(f"http://127.0.0.1:{args.stub_port}/stats", stub_proc)
+        api_proc = subprocess.Popen(api_args, cwd=API_DIR, env=api_environment(args, work_dir))
+        wait_for_http(f"http://127.0.0.1:{args.api_port}/asset-index-stats", api_proc)
+        # With several workers the parent only supervises; its RSS is a lower bound
+        results, stub_stats = asyncio.run(run(args, api_proc.pid, source_png))
+    finally:
+        for proc in (api_proc, stub_proc):
+            if proc is not None:
+                proc.terminate()
+                try:
+                    proc.wait(timeout=10)
+                except subprocess.TimeoutExpired:
+                    proc.kill()
+        if not args.work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    print_table(results)
+    print(f"\nupstream stub calls: {json.dumps(stub_stats['calls'], sort_keys=True)}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"args": {k: v for k, v in vars(args).items()}, "results": results, "stub": stub_stats}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+"""
+Local stand-ins for the paid upstreams, for benchmarking the backend without live providers.
+
+One server, three prefixes (point the API at them with the env vars shown):
+    /azure   Azure OpenAI chat/completions and images/edits   AZURE_OPENAI_ENDPOINT=http://127.0.0.1:9100/azure
+    /gemini  Gemini generateContent (Vertex AI REST shape)    GEMINI_API_BASE=http://127.0.0.1:9100/gemini
+    /veo     Veo predictLongRunning + operation polling       VEO_API_BASE=http://127.0.0.1:9100/veo/v1
+
+Latency, payload sizes and error injection are set per run. Errors are returned with the status given by
+--error-status (a 429 also carries Retry-After) so the API's retry, breaker and scheduler paths get exercised.
+GET /stats returns call counts per route.
+
+Usage (from the api folder):
+    python bench/stub_upstreams.py --port 9100 --gemini-latency 6 --image-kb 1500 --error-rate 0.02
+"""
+import argparse
+import asyncio
+import base64
+import io
+import json
+import os
+import random
+import uuid
+from collections import Counter
+
+from fastapi import FastAPI, Request, Response
+from fastapi.responses import JSONResponse
+from PIL import Image
+
+stub = FastAPI()
+calls = Counter()
+operations = {}  # op name -> polls so far
+
+# Filled in by configure()
+STUB = {}
+
+
+def noise_png(target_kb: int) -> bytes:
+    """A real PNG of roughly target_kb (random pixels barely compress)."""
+    side = max(8, int((target_kb * 1024 / 3) ** 0.5))
+    img = Image.frombytes("RGB", (side, side), os.urandom(side * side * 3))
+    buf = io.BytesIO()
+    img.save(buf, format="PNG", compress_level=1)
+    return buf.getvalue()
+
+
+def configure(args):
+    STUB.update(vars(args))
+    STUB["image_b64"] = base64.b64encode(noise_png(args.image_kb)).decode("ascii")
+    STUB["video_b64"] = base64.b64encode(os.urandom(args.video_kb * 1024)).decode("ascii")
+
+
+async def simulate(route: str, latency: float):
+    """Counts the call, sleeps for the route's latency (+/- jitter) and returns an error response when injected."""
+    calls[route] += 1
+    if latency > 0:
+        jitter = STUB["jitter"]
+        await asyncio.sleep(max(0.0, latency * random.uniform(1 - jitter, 1 + jitter)))
+    if random.random() < STUB["error_rate"]:
+        calls[f"{route}:error"] += 1
+        status = STUB["error_status"]
+        headers = {"Retry-After": "1"} if status == 429 else None
+        return JSONResponse({"error": {"code": status, "message": "Injected by stub_upstreams", "status": "STUB"}},
+                            status_code=status, headers=headers)
+    return None
+
+
+@stub.post("/azure/openai/deployments/{deployment}/chat/completions")
+async def chat_completions(deployment: str, request: Request):
+    await request.body()
+    error = await simulate("azure_chat", STUB["chat_latency"])
+    if error:
+        return error
+    content = json.dumps({"header": "Stub header", "body": "x" * STUB["chat_chars"]})
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex}",
+        "object": "chat.completion",
+        "model": deployment,
+        "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": content}}],
+        "usage": {"prompt_tokens": 100, "completion_tokens": 100, "total_tokens": 200},
+    }
+
+
+@stub.post("/azure/openai/deployments/{deployment}/images/edits")
+async def image_edits(deployment: str, request: Request):
+    form = await request.form()
+    n = int(form.get("n") or 1)
+    await form.close()
+    error = await simulate("azure_image", STUB["edit_latency"])
+    if error:
+        return error
+    return {"created": 0, "data": [{"b64_json": STUB["image_b64"]} for _ in range(n)]}
+
+
+@stub.post("/gemini/{path:path}")
+async def generate_content(path: str, request: Request):
+    if not path.endswith(":generateContent"):
+        return Response(status_code=404)
+    await request.body()
+    error = await simulate("gemini_image", STUB["gemini_latency"])
+    if error:
+        return error
+    return {
+        "candidates": [{
+            "content": {"role": "model", "parts": [
+                {"text": "Here is the image."},
+                {"inlineData": {"mimeType": "image/png", "data": STUB["image_b64"]}},
+            ]},
+            "finishReason": "STOP",
+        }],
+        "modelVersion": path.rsplit("/", 1)[-1].split(":")[0],
+    }
+
+
+@stub.post("/veo/v1/{path:path}")
+async def predict_long_running(path: str, request: Request):
+    if not path.endswith(":predictLongRunning"):
+        return Response(status_code=404)
+    await request.body()
+    error = await simulate("veo", STUB["veo_latency"])
+    if error:
+        return error
+    op_name = f"{path.split(':')[0]}/operations/{uuid.uuid4()}"
+    operations[op_name] = 0
+    return {"name": op_name}
+
+
+@stub.get("/veo/v1/{op_name:path}")
+async def get_operation(op_name: str):
+    if op_name not in operations:
+        return JSONResponse({"error": {"code": 404, "message": "Unknown operation"}}, status_code=404)
+    error = await simulate("veo_poll", STUB["poll_latency"])
+    if error:
+        return error
+    operations[op_name] += 1
+    if operations[op_name] < STUB["veo_polls"]:
+        return {"name": op_name}
+    operations.pop(op_name)
+    return {
+        "name": op_name,
+        "done": True,
+        "response": {"videos": [{"bytesBase64Encoded": STUB["video_b64"], "mimeType": "video/mp4"}]},
+    }
+
+
+@stub.get("/stats")
+async def stats():
+    return {"calls": dict(calls), "pending_operations": len(operations)}
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    add_stub_arguments(parser)
+    return parser
+
+
+def add_stub_arguments(parser: argparse.ArgumentParser):
+    """Shared with bench/run_benchmarks.py, which passes them through when it starts the stub."""
+    group = parser.add_argument_group("stub upstreams")
+    group.add_argument("--chat-latency", type=float, default=1.0, help="Azure chat/completions seconds")
+    group.add_argument("--edit-latency", type=float, default=4.0, help="Azure images/edits seconds")
+    group.add_argument("--gemini-latency", type=float, default=5.0, help="Gemini generateContent seconds")
+    group.add_argument("--veo-latency", type=float, default=0.5, help="Veo predictLongRunning seconds")
+    group.add_argument("--poll-latency", type=float, default=0.1, help="Veo operation GET seconds")
+    group.add_argument("--veo-polls", type=int, default=3, help="Polls before an operation reports done")
+    group.add_argument("--jitter", type=float, default=0.2, help="Latency varies by +/- this fraction")
+    group.add_argument("--image-kb", type=int, default=1200, help="Size of each returned image")
+    group.add_argument("--video-kb", type=int, default=4000, help="Size of each returned video")
+    group.add_argument("--chat-chars", type=int, default=800, help="Length of the chat completion body")
+    group.add_argument("--error-rate", type=float, default=0.0, help="Fraction of calls that fail")
+    group.add_argument("--error-status", type=int, default=503, help="Status code for injected failures")
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    args = build_parser().parse_args()
+    configure(args)
+    uvicorn.run(stub, host=args.host, port=args.port, log_level="warning")
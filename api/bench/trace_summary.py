@@ -0,0 +1,69 @@
+"""
+Summarizes the sampled request traces written by the API (TRACE_LOG_PATH, default api/_traces/trace.jsonl).
+
+Prints p50/p95 per phase for each route, reading the live file and its rotated backups (trace.jsonl.1, .2, ...).
+Phases that ran concurrently inside one request (e.g. parallel variations) are summed per request, so a phase
+can be larger than the request total.
+
+Usage (from the api folder):
+    python bench/trace_summary.py
+    python bench/trace_summary.py _traces/trace.jsonl --route /generate-card --min-status 200 --max-status 299
+"""
+import argparse
+import glob
+import json
+import os
+from collections import defaultdict
+
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "_traces", "trace.jsonl")
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def load_traces(path):
+    for file_path in sorted(glob.glob(glob.escape(path) + "*")):
+        with open(file_path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # a line cut short by a crash or rotation
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("path", nargs="?", default=os.getenv("TRACE_LOG_PATH", DEFAULT_PATH))
+    parser.add_argument("--route", help="Only this route template, e.g. /generate-card")
+    parser.add_argument("--min-status", type=int, default=0)
+    parser.add_argument("--max-status", type=int, default=599)
+    args = parser.parse_args()
+
+    # route -> phase -> [ms per request]
+    phases = defaultdict(lambda: defaultdict(list))
+    for trace in load_traces(args.path):
+        if args.route and trace.get("route") != args.route:
+            continue
+        if not args.min_status <= trace.get("status", 0) <= args.max_status:
+            continue
+        route = trace.get("route") or "?"
+        phases[route]["total"].append(trace["total_ms"])
+        for name, entry in trace.get("spans", {}).items():
+            phases[route][name].append(entry["ms"])
+
+    if not phases:
+        raise SystemExit(f"No traces found at {args.path}*")
+
+    for route in sorted(phases, key=lambda r: -len(phases[r]["total"])):
+        requests = len(phases[route]["total"])
+        print(f"\n{route}  ({requests} requests)")
+        print(f"  {'phase':<12}{'seen':>7}{'p50 ms':>11}{'p95 ms':>11}")
+        ordered = sorted(phases[route].items(), key=lambda item: (item[0] == "total", -percentile(item[1], 0.5)))
+        for name, values in ordered:
+            print(f"  {name:<12}{len(values):>7}{percentile(values, 0.5):>11.1f}{percentile(values, 0.95):>11.1f}")
+
+
+if __name__ == "__main__":
+    main()
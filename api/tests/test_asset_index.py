@@ -0,0 +1,64 @@
+import os
+import sys
+
+import pytest
+
+os.environ.setdefault("AZURE_OPENAI_API_KEY", "test")
+os.environ.setdefault("GOOGLE_CLOUD_API_KEY", "test")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import AmbiguousAssetError, AssetIndex  # noqa: E402
+
+
+def touch(path):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(b"png")
+    return str(path)
+
+
+@pytest.fixture
+def tree(tmp_path):
+    public = tmp_path / "site" / "public"
+    return {
+        "index": AssetIndex(str(public)),
+        "image": touch(public / "Image" / "a.png"),
+        "other": touch(public / "Other" / "b.png"),
+        "dam": touch(tmp_path / "dam" / "b.png"),
+        "dupe_1": touch(public / "Image" / "c.png"),
+        "dupe_2": touch(public / "Other" / "c.png"),
+    }
+
+
+def test_external_absolute_path_is_served_as_given(tree):
+    assert tree["index"].resolve(tree["dam"]) == tree["dam"]
+
+
+def test_missing_external_path_does_not_fall_back_to_basename(tree):
+    missing = os.path.join(os.path.dirname(tree["dam"]), "a.png")
+    assert tree["index"].resolve(missing) is None
+    # Several public files share the name, but an external path must not turn into a 409
+    assert tree["index"].resolve(os.path.join(os.path.dirname(tree["dam"]), "c.png")) is None
+
+
+def test_windows_and_unc_paths_do_not_fall_back_to_basename(tree):
+    assert tree["index"].resolve(r"C:\Users\someone\DAM\b.png") is None
+    assert tree["index"].resolve(r"\\fileserver\dam\b.png") is None
+
+
+def test_public_relative_paths_and_bare_names(tree):
+    index = tree["index"]
+    assert index.resolve("/Image/a.png") == tree["image"]
+    assert index.resolve("public/Other/b.png") == tree["other"]
+    assert index.resolve(tree["other"]) == tree["other"]
+    assert index.resolve("a.png") == tree["image"]
+    assert index.resolve("c.png", prefer_dir="Other") == tree["dupe_2"]
+    with pytest.raises(AmbiguousAssetError):
+        index.resolve("c.png")
+
+
+def test_exact_lookup_does_not_fall_back_to_basename(tree):
+    index = tree["index"]
+    assert index.resolve("/Image/a.png", by_basename=False) == tree["image"]
+    assert index.resolve("/Image/zzz/a.png", by_basename=False) is None
+    assert index.resolve("/Image/zzz/a.png") == tree["image"]
+    assert index.resolve("c.png", by_basename=False) is None
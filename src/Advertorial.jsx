@@ -232,7 +232,8 @@ Williams secured a business loan through the program to expand her film producti
               images: base64Images,
               prompt,
               settings: { ...settings, aspectRatio: ratio, columnGrid },
-              is_live: true
+              is_live: true,
+              priority: 'bulk'
             })
           }).then(res => res.json())
         ));
@@ -267,7 +268,8 @@ Williams secured a business loan through the program to expand her film producti
               images: [imgUrl],
               prompt: refineModal.prompt,
               settings: { ...settings, columnGrid },
-              is_live: true
+              is_live: true,
+              priority: 'bulk'
             })
           });
           const data = await resp.json();
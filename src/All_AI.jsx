@@ -4,6 +4,7 @@ import { clsx } from 'clsx';
 import { twMerge } from 'tailwind-merge';
 import { getPrompt } from './prompts';
 import Grid from './Grid';
+import { readNdjson } from './ndjson';
 import { PersonalizationModal } from './Personalization';
 
 // --- Utility ---
@@ -142,7 +143,6 @@ const DEFAULTS = {
 
 const INITIAL_ROW = { cols: 3, auto: true, height: 133, type: 'offer' };
 const IMPORT_DELAY_MS = 100;
-const MAX_CONCURRENT_REQUESTS = 4;
 
 const stripScale = (row) => {
   if (!row) return row;
@@ -159,6 +159,8 @@ function useLayoutManager(initialDefaults = DEFAULTS, externalCustomModels = [])
   const [merges, setMerges] = useState({});
   const [hiddenCells, setHiddenCells] = useState(new Set());
   const [cellData, setCellData] = useState({});
+  const [projectId, setProjectId] = useState(null);
+  const [projectLoading, setProjectLoading] = useState(false); // cells still being filled in by applyProjectData
   const [isSelecting, setIsSelecting] = useState(false);
   const [selection, setSelection] = useState(null);
   const [isMultiSelect, setIsMultiSelect] = useState(false);
@@ -346,7 +348,7 @@ function useLayoutManager(initialDefaults = DEFAULTS, externalCustomModels = [])
     setContextMenu(null);
   };
 
-  const generateAsset = async (cellId, itemData, model, n = 1) => {
+  const buildCardRequest = (cellId, itemData, model, n = 1) => {
     const [rIdx, cIdx] = cellId.split('_').map(Number);
     const row = rows[rIdx];
     const mergeData = merges[cellId];
@@ -362,46 +364,81 @@ function useLayoutManager(initialDefaults = DEFAULTS, externalCustomModels = [])
       }
     }
 
-    setCellData(prev => ({ ...prev, [cellId]: { ...prev[cellId], loading: true, error: false, productData: itemData } }));
     const promptModelKey = model;
     const generatedPrompt = getPrompt('v2', promptModelKey, itemData, externalCustomModels);
 
+    return {
+      image_path: itemData['Product Image'],
+      product_name: itemData['Product Name'],
+      description: itemData['Description'],
+      price: itemData['Price'],
+      sku: itemData['SKU'],
+      unit: itemData['Unit'],
+      model: model,
+      n: n,
+      server_version: serverVersion,
+      custom_prompt: generatedPrompt,
+      width: Math.round(targetWidth),
+      height: Math.round(targetHeight)
+    };
+  };
+
+  const applyCardResult = (cellId, result) => {
+    setCellData(prev => {
+      const existingCell = prev[cellId] || {};
+      const currentImage = existingCell.image;
+      const newVariations = result.images;
+      if (currentImage) {
+        const uniqueVars = newVariations.filter(img => img !== currentImage);
+        return { ...prev, [cellId]: { ...existingCell, loading: false, variations: uniqueVars, error: false } };
+      } else {
+        return { ...prev, [cellId]: { ...existingCell, loading: false, image: result.images[0], variations: [], error: false } };
+      }
+    });
+  };
+
+  const markCellFailed = (cellId) => {
+    setCellData(prev => ({ ...prev, [cellId]: { ...prev[cellId], loading: false, error: true } }));
+  };
+
+  // Renders many cells over one connection; the server streams an NDJSON line per cell as it finishes
+  const generateAssetsBatch = async (entries, model, n = 1) => {
+    if (entries.length === 0) return;
+    const pending = new Set(entries.map(entry => entry.cellId));
+    setCellData(prev => {
+      const nextData = { ...prev };
+      entries.forEach(({ cellId, itemData }) => {
+        nextData[cellId] = { ...prev[cellId], loading: true, error: false, productData: itemData };
+      });
+      return nextData;
+    });
+
+    const handleResult = (result) => {
+      if (!result.cell_id) return;
+      pending.delete(result.cell_id);
+      if (!result.error && result.images && result.images.length > 0) {
+        applyCardResult(result.cell_id, result);
+      } else {
+        console.error("Asset Generation Error:", result.cell_id, result.error || "No images returned");
+        markCellFailed(result.cell_id);
+      }
+    };
+
     try {
-      const response = await fetch('http://localhost:5001/generate-card', {
+      const response = await fetch('http://localhost:5001/generate-cards', {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
         body: JSON.stringify({
-          image_path: itemData['Product Image'],
-          product_name: itemData['Product Name'],
-          description: itemData['Description'],
-          price: itemData['Price'],
-          sku: itemData['SKU'],
-          unit: itemData['Unit'],
-          model: model,
-          n: n,
-          server_version: serverVersion,
-          custom_prompt: generatedPrompt,
-          width: Math.round(targetWidth),
-          height: Math.round(targetHeight)
+          cells: entries.map(({ cellId, itemData }) => ({ cell_id: cellId, ...buildCardRequest(cellId, itemData, model, n) }))
         })
       });
-      const result = await response.json();
-      if (response.ok && result.images && result.images.length > 0) {
-        setCellData(prev => {
-          const existingCell = prev[cellId] || {};
-          const currentImage = existingCell.image;
-          const newVariations = result.images;
-          if (currentImage) {
-            const uniqueVars = newVariations.filter(img => img !== currentImage);
-            return { ...prev, [cellId]: { ...existingCell, loading: false, variations: uniqueVars, error: false } };
-          } else {
-            return { ...prev, [cellId]: { ...existingCell, loading: false, image: result.images[0], variations: [], error: false } };
-          }
-        });
-      } else { throw new Error(result.detail || "No images returned"); }
+      if (!response.ok || !response.body) throw new Error(`Batch generation failed (${response.status})`);
+
+      await readNdjson(response, handleResult);
     } catch (err) {
-      console.error("Asset Generation Error:", err);
-      setCellData(prev => ({ ...prev, [cellId]: { ...prev[cellId], loading: false, error: true } }));
+      console.error("Batch Generation Error:", err);
+    } finally {
+      pending.forEach(markCellFailed);
     }
   };
 
@@ -460,21 +497,8 @@ function useLayoutManager(initialDefaults = DEFAULTS, externalCustomModels = [])
   };
 
   const processQueue = async (items, availableSlots, model) => {
-    let currentIndex = 0;
-    let activeRequests = 0;
-    const totalItems = items.length;
-    const next = () => {
-      if (currentIndex >= totalItems && activeRequests === 0) return;
-      while (activeRequests < MAX_CONCURRENT_REQUESTS && currentIndex < totalItems) {
-        const index = currentIndex;
-        const item = items[index];
-        const cellId = availableSlots[index];
-        currentIndex++;
-        activeRequests++;
-        generateAsset(cellId, item, model, 1).finally(() => { activeRequests--; next(); });
-      }
-    };
-    next();
+    const entries = items.map((item, index) => ({ cellId: availableSlots[index], itemData: item }));
+    await generateAssetsBatch(entries, model, 1);
   };
 
   const handleFileUpload = (e) => {
@@ -482,6 +506,7 @@ function useLayoutManager(initialDefaults = DEFAULTS, externalCustomModels = [])
     if (!file) return;
     importTimers.current.forEach(t => clearTimeout(t));
     importTimers.current = [];
+    setProjectLoading(false);
     const reader = new FileReader();
     reader.onload = async (evt) => {
       const csvText = evt.target.result;
@@ -538,30 +563,44 @@ function useLayoutManager(initialDefaults = DEFAULTS, externalCustomModels = [])
     if (validCount === 0) return alert("No valid server-generated cells to regenerate.");
     setSelectedCells(new Set());
     setIsMultiSelect(false);
-    let currentIndex = 0;
-    let activeRequests = 0;
-    const next = () => {
-      if (currentIndex >= validCells.length && activeRequests === 0) return;
-      while (activeRequests < MAX_CONCURRENT_REQUESTS && currentIndex < validCells.length) {
-        const item = validCells[currentIndex];
-        currentIndex++;
-        activeRequests++;
-        generateAsset(item.id, item.data, regenConfig.model, regenConfig.n).finally(() => { activeRequests--; next(); });
+    await generateAssetsBatch(validCells.map(item => ({ cellId: item.id, itemData: item.data })), regenConfig.model, regenConfig.n);
+  };
+
+  const currentProjectState = () => ({
+    config, rows, merges, hiddenCells: Array.from(hiddenCells), cellData, designModel, serverVersion, customModels: externalCustomModels
+  });
+
+  // Images go as binary parts instead of base64 inside the JSON; identical images are sent once
+  const buildProjectForm = async (project) => {
+    const form = new FormData();
+    const partNames = new Map();
+    const toPart = async (img) => {
+      if (typeof img !== 'string' || !img.startsWith('data:image')) return img;
+      if (!partNames.has(img)) {
+        const name = `img${partNames.size + 1}`;
+        partNames.set(img, name);
+        form.append(name, await (await fetch(img)).blob(), name);
       }
+      return `part:${partNames.get(img)}`;
     };
-    next();
+    const partCellData = {};
+    for (const [cellId, cell] of Object.entries(project.cellData)) {
+      const next = { ...cell };
+      if (cell && cell.image) next.image = await toPart(cell.image);
+      if (cell && Array.isArray(cell.variations)) next.variations = await Promise.all(cell.variations.map(toPart));
+      partCellData[cellId] = next;
+    }
+    form.append('project', JSON.stringify({ ...project, cellData: partCellData }));
+    return form;
   };
 
   const handleExportJson = async () => {
-    const dataToSave = {
-      config, rows, merges, hiddenCells: Array.from(hiddenCells), cellData, designModel, serverVersion, customModels: externalCustomModels, marketVersions, marketOptions
-    };
+    const dataToSave = { ...currentProjectState(), marketVersions, marketOptions };
 
     try {
-      const response = await fetch('http://localhost:5001/save-project', {
+      const response = await fetch('http://localhost:5001/save-project-multipart', {
         method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify(dataToSave)
+        body: await buildProjectForm(dataToSave)
       });
 
       if (response.ok) {
@@ -577,61 +616,184 @@ function useLayoutManager(initialDefaults = DEFAULTS, externalCustomModels = [])
     }
   };
 
-  const handleImportJson = (e) => {
-    const file = e.target.files[0];
-    if (!file) return;
+  // Server-side project: the first Save creates it, later saves PATCH only what changed since the last saved
+  // state (cells, merges and rows are compared by reference), and ?project=<id> in the URL reopens it.
+  const savedProject = useRef(null); // { projectId, revision, state }
+
+  const diffById = (current, saved) => {
+    const delta = {};
+    for (const [id, value] of Object.entries(current)) if (saved[id] !== value) delta[id] = value;
+    for (const id of Object.keys(saved)) if (!(id in current)) delta[id] = null;
+    return delta;
+  };
+
+  const projectDelta = (current, saved) => {
+    const delta = {};
+    const cells = diffById(current.cellData, saved.cellData);
+    if (Object.keys(cells).length) delta.cellData = cells;
+    const changedMerges = diffById(current.merges, saved.merges);
+    if (Object.keys(changedMerges).length) delta.merges = changedMerges;
+    const changedRows = {};
+    current.rows.forEach((row, index) => { if (row !== saved.rows[index]) changedRows[index] = row; });
+    if (Object.keys(changedRows).length) delta.rows = changedRows;
+    if (current.rows.length !== saved.rows.length) delta.rowCount = current.rows.length;
+    if ([...current.hiddenCells].sort().join('|') !== [...saved.hiddenCells].sort().join('|')) delta.hiddenCells = current.hiddenCells;
+    for (const field of ['config', 'designModel', 'serverVersion', 'customModels']) {
+      if (current[field] !== saved[field]) delta[field] = current[field];
+    }
+    return delta;
+  };
+
+  const rememberSavedProject = (id, revision, state) => {
+    savedProject.current = { projectId: id, revision, state };
+    setProjectId(id);
+    const url = new URL(window.location.href);
+    url.searchParams.set('project', id);
+    window.history.replaceState(null, '', url);
+  };
+
+  const handleSaveProject = async () => {
+    // Cells not shown yet would read as deleted and the PATCH would drop them on the server
+    if (projectLoading) return alert("The project is still loading. Save once every cell is shown.");
+    const current = currentProjectState();
+    const saved = savedProject.current;
+    try {
+      if (saved) {
+        const delta = projectDelta(current, saved.state);
+        if (Object.keys(delta).length === 0) return alert("No changes to save.");
+        const response = await fetch(`http://localhost:5001/projects/${saved.projectId}`, {
+          method: 'PATCH',
+          headers: { 'Content-Type': 'application/json' },
+          body: JSON.stringify({ baseRevision: saved.revision, ...delta })
+        });
+        if (response.ok) {
+          const result = await response.json();
+          rememberSavedProject(saved.projectId, result.revision, current);
+          return alert(`Project saved (revision ${result.revision}).`);
+        }
+        if (response.status !== 409 && response.status !== 404) {
+          const err = await response.json();
+          return alert(`Failed to save project: ${err.detail}`);
+        }
+        // Changed elsewhere or gone: fall through to a full save that replaces it under the same id
+      }
+
+      const response = await fetch('http://localhost:5001/projects', {
+        method: 'POST',
+        body: await buildProjectForm({ ...current, projectId: saved ? saved.projectId : null })
+      });
+      if (response.ok) {
+        const result = await response.json();
+        rememberSavedProject(result.projectId, result.revision, current);
+        alert(`Project saved (revision ${result.revision}).`);
+      } else {
+        const err = await response.json();
+        alert(`Failed to save project: ${err.detail}`);
+      }
+    } catch (err) {
+      console.error("Save Error:", err);
+      alert("Failed to connect to server for saving.");
+    }
+  };
+
+  // Hydrates the grid from a saved project (imported file or GET /projects/<id>). Cells are filled in one by
+  // one; onApplied(applied) runs once the last one is shown.
+  const applyProjectData = (data, onApplied) => {
     importTimers.current.forEach(t => clearTimeout(t));
     setSelectedCells(new Set());
     setIsMultiSelect(false);
-    const reader = new FileReader();
-    reader.onload = (evt) => {
-      try {
-        const data = JSON.parse(evt.target.result);
-        if (data.config) setConfig(data.config);
-        if (data.rows) setRows(data.rows.map(stripScale));
-        if (data.merges) setMerges(data.merges);
-        if (data.hiddenCells) setHiddenCells(new Set(data.hiddenCells));
-        if (data.designModel) setDesignModel(data.designModel);
-        if (data.serverVersion) setServerVersion(data.serverVersion);
-        if (data.marketVersions) setMarketVersions(data.marketVersions);
-        if (data.marketOptions) setMarketOptions(data.marketOptions);
-
-        setCellData({});
-        if (data.cellData) {
-          const keys = Object.keys(data.cellData);
-          const loadedCellData = {};
-
-          keys.forEach((key) => {
-            const cell = data.cellData[key];
-            if (cell.image && !cell.image.startsWith('data:')) {
-              if (cell.image.includes(':') || cell.image.startsWith('\\\\')) {
-                cell.image = `http://localhost:5001/get-local-image?path=${encodeURIComponent(cell.image)}`;
-              }
-            }
-            if (cell.variations && cell.variations.length > 0) {
-              cell.variations = cell.variations.map(v => {
-                if (!v.startsWith('data:') && (v.includes(':') || v.startsWith('\\\\'))) {
-                  return `http://localhost:5001/get-local-image?path=${encodeURIComponent(v)}`;
-                }
-                return v;
-              });
-            }
-            loadedCellData[key] = cell;
-          });
 
-          keys.forEach((key, index) => {
-            const t = setTimeout(() => {
-              setCellData(prev => ({ ...prev, [key]: loadedCellData[key] }));
-            }, index * IMPORT_DELAY_MS);
-            importTimers.current.push(t);
+    const applied = {
+      config: data.config || config,
+      rows: data.rows ? data.rows.map(stripScale) : rows,
+      merges: data.merges || merges,
+      hiddenCells: data.hiddenCells || Array.from(hiddenCells),
+      designModel: data.designModel || designModel,
+      serverVersion: data.serverVersion || serverVersion,
+      customModels: externalCustomModels,
+      cellData: {},
+    };
+    if (data.config) setConfig(applied.config);
+    if (data.rows) setRows(applied.rows);
+    if (data.merges) setMerges(applied.merges);
+    if (data.hiddenCells) setHiddenCells(new Set(applied.hiddenCells));
+    if (data.designModel) setDesignModel(applied.designModel);
+    if (data.serverVersion) setServerVersion(applied.serverVersion);
+    if (data.marketVersions) setMarketVersions(data.marketVersions);
+    if (data.marketOptions) setMarketOptions(data.marketOptions);
+
+    setCellData({});
+    if (data.cellData) {
+      const keys = Object.keys(data.cellData);
+
+      keys.forEach((key) => {
+        const cell = data.cellData[key];
+        if (cell.image && !cell.image.startsWith('data:')) {
+          if (cell.image.includes(':') || cell.image.startsWith('\\\\')) {
+            cell.image = `http://localhost:5001/get-local-image?path=${encodeURIComponent(cell.image)}`;
+          }
+        }
+        if (cell.variations && cell.variations.length > 0) {
+          cell.variations = cell.variations.map(v => {
+            if (!v.startsWith('data:') && (v.includes(':') || v.startsWith('\\\\'))) {
+              return `http://localhost:5001/get-local-image?path=${encodeURIComponent(v)}`;
+            }
+            return v;
           });
         }
+        applied.cellData[key] = cell;
+      });
+
+      keys.forEach((key, index) => {
+        const t = setTimeout(() => {
+          setCellData(prev => ({ ...prev, [key]: applied.cellData[key] }));
+        }, index * IMPORT_DELAY_MS);
+        importTimers.current.push(t);
+      });
+    }
+    setProjectLoading(true);
+    const lastDelay = Math.max(Object.keys(applied.cellData).length - 1, 0) * IMPORT_DELAY_MS;
+    importTimers.current.push(setTimeout(() => {
+      setProjectLoading(false);
+      if (onApplied) onApplied(applied);
+    }, lastDelay));
+  };
+
+  const handleImportJson = (e) => {
+    const file = e.target.files[0];
+    if (!file) return;
+    const reader = new FileReader();
+    reader.onload = (evt) => {
+      try {
+        applyProjectData(JSON.parse(evt.target.result));
+        // An imported file is a new project; the next Save creates it on the server
+        savedProject.current = null;
+        setProjectId(null);
       } catch (err) { alert("Failed to parse JSON."); }
     };
     reader.readAsText(file);
     e.target.value = null;
   };
 
+  const loadProject = async (id) => {
+    try {
+      const response = await fetch(`http://localhost:5001/projects/${id}`);
+      if (!response.ok) return alert("Project not found on the server.");
+      const data = await response.json();
+      // Until every cell is in, there is no baseline to diff against
+      savedProject.current = null;
+      applyProjectData(data, applied => rememberSavedProject(id, data.revision, applied));
+    } catch (err) {
+      console.error("Load Error:", err);
+      alert("Failed to connect to server for loading.");
+    }
+  };
+
+  useEffect(() => {
+    const id = new URLSearchParams(window.location.search).get('project');
+    if (id) loadProject(id);
+  }, []);
+
   const swapCells = (id1, id2) => {
     setCellData(prev => {
       const next = { ...prev };
@@ -674,7 +836,7 @@ function useLayoutManager(initialDefaults = DEFAULTS, externalCustomModels = [])
     },
     mergeCells, clearMerge, getBounds, isSelected,
     triggerCellUpload, handleDirectFileUpload,
-    handleFileUpload, handleExportJson, handleImportJson,
+    handleFileUpload, handleExportJson, handleImportJson, handleSaveProject, projectId, projectLoading,
     handleRegenerateClick, confirmRegeneration,
     selectVariation: (img) => {
       if (!currentReviewCell) return;
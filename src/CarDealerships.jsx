@@ -1,5 +1,7 @@
 import React, { useState, useRef } from 'react';
 import UniversalPreview from './UniversalPreview';
+import { generateEblastVariants } from './ndjson';
+import { sendWithReference } from './referenceHandles';
 
 // Organized Asset Sets for the cycling logic (Car Dealerships folder)
 const ASSET_SETS = {
@@ -119,6 +121,8 @@ function CarDealerships({ onPushToDAM }) {
     : null;
 
   const resultImgRefs = useRef([]);
+  // Server-side handle for each refined result ({ image, handle }), so the next refine sends only the handle
+  const resultReferences = useRef([]);
   const [resultImgWidths, setResultImgWidths] = useState(Array(9).fill(null));
 
   const updateResultImgWidth = (index) => {
@@ -208,19 +212,8 @@ function CarDealerships({ onPushToDAM }) {
         }));
 
         const targetRatios = Array(9).fill(settings.aspectRatio);
-        const responses = await Promise.all(targetRatios.map(ratio =>
-          fetch('http://localhost:5001/generate-eblast', {
-            method: 'POST',
-            headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify({
-              images: base64Images,
-              prompt: `${prompt}. Car Color: ${selectedColor.name}`,
-              settings: { ...settings, aspectRatio: ratio },
-              is_live: true
-            })
-          }).then(res => res.json())
-        ));
-        setResultImages(responses.map(r => r.image));
+        const images = await generateEblastVariants(base64Images, `${prompt}. Car Color: ${selectedColor.name}`, settings, targetRatios);
+        setResultImages(images);
       } catch (e) {
         alert("Live Generation Failed");
       }
@@ -244,24 +237,34 @@ function CarDealerships({ onPushToDAM }) {
 
     if (isLiveMode) {
       try {
+        let failed = 0;
         const refinePromises = resultImages.map(async (imgUrl, idx) => {
-          const resp = await fetch('http://localhost:5001/generate-eblast', {
+          const known = resultReferences.current[idx];
+          // A variant that failed to generate has no image to refine; an upload error only fails its own tile
+          const resp = imgUrl && await sendWithReference(imgUrl, (image) => fetch('http://localhost:5001/generate-eblast', {
             method: 'POST',
             headers: { 'Content-Type': 'application/json' },
             body: JSON.stringify({
-              images: [imgUrl],
+              images: [image],
               prompt: refineModal.prompt,
               settings: { ...settings },
-              is_live: true
+              is_live: true,
+              return_reference: true,
+              priority: 'bulk'
             })
-          });
-          const data = await resp.json();
-          await new Promise(r => setTimeout(r, 1000 + Math.random() * 2000));
-          setResultImages(prev => {
-            const next = [...prev];
-            next[idx] = data.image;
-            return next;
-          });
+          }), known && known.image === imgUrl ? known.handle : null).catch(() => null);
+          const data = resp && resp.ok ? await resp.json() : null;
+          if (data && data.image) {
+            await new Promise(r => setTimeout(r, 1000 + Math.random() * 2000));
+            resultReferences.current[idx] = data.reference ? { image: data.image, handle: data.reference } : null;
+            setResultImages(prev => {
+              const next = [...prev];
+              next[idx] = data.image;
+              return next;
+            });
+          } else {
+            failed += 1;  // Keep the current image for this tile
+          }
           setBoxesRefining(prev => {
             const next = [...prev];
             next[idx] = false;
@@ -270,6 +273,7 @@ function CarDealerships({ onPushToDAM }) {
           setTimeout(() => updateResultImgWidth(idx), 0);
         });
         await Promise.all(refinePromises);
+        if (failed) alert(`Refinement failed for ${failed} of ${resultImages.length} images.`);
       } catch (e) {
         alert("Live Refinement Failed");
         setBoxesRefining(Array(resultImages.length).fill(false));
@@ -79,7 +79,7 @@ const Grid = ({ manager, customModels, onGlobalSave }) => {
       isSelecting, isMultiSelect, setIsMultiSelect, selectedCells, setSelectedCells,
       serverVersion, setServerVersion, designModel, setDesignModel,
       handleMouseDown, handleMouseEnter, handleMouseUp, handleContextMenu, handleCellClick,
-      handleRegenerateClick, handleExportJson, handleImportJson, handleFileUpload,
+      handleRegenerateClick, handleExportJson, handleImportJson, handleSaveProject, projectId, projectLoading, handleFileUpload,
       triggerCellUpload, handleDirectFileUpload, clearCell, clearMerge, mergeCells, getBounds,
       regenModalOpen, setRegenModalOpen, regenConfig, setRegenConfig, confirmRegeneration,
       reviewModalOpen, setReviewModalOpen, currentReviewCell, selectVariation,
@@ -410,7 +410,7 @@ const Grid = ({ manager, customModels, onGlobalSave }) => {
                 <Upload className="h-3 w-3" /> Fill CSV
                 <input type="file" accept=".csv" className="hidden" onChange={handleFileUpload} />
              </label>
-             <Button size="sm" className="h-8 px-4 gap-2 bg-red-700 hover:bg-red-600" onClick={handleExportJson}><Save className="h-3 w-3" /> Save</Button>
+             <Button size="sm" className="h-8 px-4 gap-2 bg-red-700 hover:bg-red-600" onClick={handleSaveProject} disabled={projectLoading} title={projectLoading ? "Loading project..." : projectId ? `Project ${projectId}` : "Save to server"}><Save className="h-3 w-3" /> Save</Button>
           </div>
       </div>
 
@@ -14,6 +14,32 @@ const KNOWN_IMAGE_FILES = [
   '3.jpg'
 ];
 
+const API_BASE = 'http://localhost:5001';
+
+// Follows a video job's Server-Sent Events until it succeeds or fails, then fetches the result
+const waitForVideoJob = (job) => new Promise((resolve, reject) => {
+  const events = new EventSource(job.events_url);
+  events.onmessage = async (event) => {
+    const status = JSON.parse(event.data);
+    if (status.status === 'succeeded') {
+      events.close();
+      try {
+        const result = await fetch(status.result_url).then(r => r.json());
+        resolve(result);
+      } catch (err) {
+        reject(err);
+      }
+    } else if (status.status === 'failed') {
+      events.close();
+      reject(new Error(status.error || 'Video generation failed'));
+    }
+  };
+  events.onerror = () => {
+    // EventSource reconnects on its own; only give up once the browser closes the stream
+    if (events.readyState === EventSource.CLOSED) reject(new Error('Lost connection to video job'));
+  };
+});
+
 // NEW: Upload Icon for local files
 const UploadIcon = () => (
   <svg className="w-3 h-3" fill="none" stroke="currentColor" viewBox="0 0 24 24">
@@ -41,6 +67,7 @@ function ImageToVideo({ onPushToDAM, incomingAssets, onClearIncoming }) {
     seed: -1
   });
   const [liveVideos, setLiveVideos] = useState({}); // Stores { imgId_version: videoUrl }
+  const [livePosters, setLivePosters] = useState({}); // Stores { imgId_version: posterUrl }
 
   const [videoPool, setVideoPool] = useState([]);
   const [isGenerated, setIsGenerated] = useState(false);
@@ -95,7 +122,7 @@ function ImageToVideo({ onPushToDAM, incomingAssets, onClearIncoming }) {
   const findMatchingVideo = (imgId, imageName, versionIndex) => {
     // 1. Check Live store first
     const liveKey = `${imgId}_${versionIndex}`;
-    if (liveVideos[liveKey]) return { url: liveVideos[liveKey], name: `Live_V${versionIndex}` };
+    if (liveVideos[liveKey]) return { url: liveVideos[liveKey], poster: livePosters[liveKey], name: `Live_V${versionIndex}` };
 
     // 2. Fallback to static pool
     const baseName = getBaseName(imageName);
@@ -229,7 +256,7 @@ function ImageToVideo({ onPushToDAM, incomingAssets, onClearIncoming }) {
             });
           }
 
-          const response = await fetch('http://localhost:5001/generate-video', {
+          const response = await fetch(`${API_BASE}/generate-video`, {
             method: 'POST',
             headers: { 'Content-Type': 'application/json' },
             body: JSON.stringify({
@@ -244,9 +271,11 @@ function ImageToVideo({ onPushToDAM, incomingAssets, onClearIncoming }) {
           });
 
           if (!response.ok) throw new Error("API Failed");
-          const data = await response.json();
+          const job = await response.json();
+          const data = await waitForVideoJob(job);
           if (data.video) {
             setLiveVideos(prev => ({ ...prev, [`${img.id}_0`]: data.video }));
+            if (data.poster) setLivePosters(prev => ({ ...prev, [`${img.id}_0`]: data.poster }));
           }
         }
       } catch (err) {
@@ -567,7 +596,7 @@ function ImageToVideo({ onPushToDAM, incomingAssets, onClearIncoming }) {
                     <div className="grid grid-cols-3 gap-4 h-64">
                       <div className="col-span-1 bg-black rounded border border-gray-700 overflow-hidden relative"><img src={img.url} alt="Source" className="w-full h-full object-contain" /></div>
                       <div className="col-span-2 bg-black rounded border border-gray-700 overflow-hidden relative flex items-center justify-center">
-                        {matchedVideo ? <video key={matchedVideo.url} src={matchedVideo.url} controls autoPlay loop muted className="w-full h-full object-contain" /> : <div className="text-center p-4"><div className="text-3xl mb-2">❓</div><p className="text-xs text-gray-500">Video {getBaseName(img.name)}{version > 0 ? `_${version}` : ''}.mp4 not found</p></div>}
+                        {matchedVideo ? <video key={matchedVideo.url} src={matchedVideo.url} poster={matchedVideo.poster} preload="metadata" controls autoPlay loop muted className="w-full h-full object-contain" /> : <div className="text-center p-4"><div className="text-3xl mb-2">❓</div><p className="text-xs text-gray-500">Video {getBaseName(img.name)}{version > 0 ? `_${version}` : ''}.mp4 not found</p></div>}
                       </div>
                     </div>
                     <div className="mt-3 flex justify-end gap-2">
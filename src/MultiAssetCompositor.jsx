@@ -1,5 +1,6 @@
 import React, { useState, useRef, useEffect } from 'react';
 import UniversalPreview from './UniversalPreview';
+import { generateEblastVariants } from './ndjson';
 
 // Dynamically generate Asset Sets (supports up to 20 sets)
 const MAX_SETS = 20;
@@ -155,19 +156,8 @@ function EblastAutomation({ onPushToDAM }) {
           ? Array(4).fill(settings.aspectRatio)
           : [...selectedRatios, ...Array(4 - selectedRatios.length).fill(selectedRatios[0])].slice(0, 4);
 
-        const responses = await Promise.all(targetRatios.map(ratio =>
-          fetch('http://localhost:5001/generate-eblast', {
-            method: 'POST',
-            headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify({
-              images: base64Images,
-              prompt,
-              settings: { ...settings, aspectRatio: ratio },
-              is_live: true
-            })
-          }).then(res => res.json())
-        ));
-        setResultImages(responses.map(r => r.image));
+        const images = await generateEblastVariants(base64Images, prompt, settings, targetRatios);
+        setResultImages(images);
       } catch (e) {
         alert("Live Generation Failed");
       }
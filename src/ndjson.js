@@ -0,0 +1,43 @@
+// Readers for the backend's NDJSON streaming endpoints (/generate-cards, /generate-eblast-batch).
+
+// Calls onMessage with each parsed line of an NDJSON response body as it arrives
+export const readNdjson = async (response, onMessage) => {
+  const handleLine = (line) => {
+    if (line.trim()) onMessage(JSON.parse(line));
+  };
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffered = '';
+  while (true) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buffered += decoder.decode(value, { stream: true });
+    const lines = buffered.split('\n');
+    buffered = lines.pop();
+    lines.forEach(handleLine);
+  }
+  handleLine(buffered);
+};
+
+// One batch request for every layout: the product images are uploaded and decoded once,
+// and each variant streams back as an NDJSON line when it finishes.
+export const generateEblastVariants = async (images, prompt, settings, ratios) => {
+  const response = await fetch('http://localhost:5001/generate-eblast-batch', {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json' },
+    body: JSON.stringify({
+      images,
+      prompt,
+      settings,
+      variants: ratios.map((ratio, idx) => ({ variant_id: String(idx), aspectRatio: ratio })),
+      is_live: true
+    })
+  });
+  if (!response.ok || !response.body) throw new Error(`Eblast batch failed (${response.status})`);
+
+  const results = Array(ratios.length).fill(null);
+  await readNdjson(response, (msg) => {
+    if (msg.variant_id !== undefined && msg.images && msg.images.length) results[Number(msg.variant_id)] = msg.images[0];
+  });
+  return results;
+};
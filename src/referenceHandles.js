@@ -0,0 +1,51 @@
+// Reference handles ("ref:<hash>") let refine loops send a short handle instead of re-uploading a multi-MB image.
+// Known handles sit in a small LRU keyed by the SHA-256 of the image bytes (never by the data URL itself).
+// The server drops handles after an hour unused or under disk pressure and answers 410; sendWithReference
+// then uploads the image again and retries once.
+const API_BASE = 'http://localhost:5001';
+const MAX_HANDLES = 64;
+
+const handles = new Map(); // sha256 hex -> handle, in LRU order (oldest first)
+
+const remember = (key, handle) => {
+  handles.delete(key);
+  handles.set(key, handle);
+  while (handles.size > MAX_HANDLES) handles.delete(handles.keys().next().value);
+};
+
+const sha256Hex = async (blob) => {
+  const digest = await crypto.subtle.digest('SHA-256', await blob.arrayBuffer());
+  return Array.from(new Uint8Array(digest), b => b.toString(16).padStart(2, '0')).join('');
+};
+
+export const isReferenceHandle = (value) => typeof value === 'string' && value.startsWith('ref:');
+
+// Returns a handle for the image, uploading it when needed. Falls back to the image itself if the upload fails.
+export const toReferenceHandle = async (image, { refresh = false } = {}) => {
+  if (isReferenceHandle(image)) return image;
+  const blob = await (await fetch(image)).blob();
+  const key = await sha256Hex(blob);
+  if (!refresh && handles.has(key)) {
+    const handle = handles.get(key);
+    remember(key, handle);
+    return handle;
+  }
+  handles.delete(key);
+
+  const form = new FormData();
+  form.append('file', blob, 'reference');
+  const resp = await fetch(`${API_BASE}/references`, { method: 'POST', body: form });
+  if (!resp.ok) return image;
+  const { handle } = await resp.json();
+  remember(key, handle);
+  return handle;
+};
+
+// Calls send(imageOrHandle) with a handle for the image (knownHandle when the server already returned one).
+// On 410 the handle has expired server-side: upload again and retry once.
+export const sendWithReference = async (image, send, knownHandle = null) => {
+  const handle = knownHandle || await toReferenceHandle(image);
+  const resp = await send(handle);
+  if (resp.status !== 410 || !isReferenceHandle(handle)) return resp;
+  return send(await toReferenceHandle(image, { refresh: true }));
+};